@@ -0,0 +1,86 @@
+"""
+Benchmark of the meal normalization against the previous pandas pipeline of Mensa.meal_data
+
+Run with: python -m benchmarks.bench_meals
+"""
+import json
+import os
+import time
+import tracemalloc
+
+import config
+from model.meals import normalize_meals
+from utils.utils import get_symbol
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'meals.json')
+
+
+def pandas_meal_lines(payload, mains_only=True) -> list:
+    """
+    Previous pandas pipeline of Mensa.meal_data and Mensa.meal_data_lines, kept as a reference for benchmarking
+    """
+    pd = config.import_pandas()
+    df = pd.DataFrame.from_records(payload, index='category')
+
+    if mains_only:
+        df = df.loc[df['prices'].apply(lambda x: x.get('students')) > 1.0]
+
+    df['price'] = df['prices'].apply(
+        lambda x: '{:4.2f}'.format(float(x.get('students'))) + ' €' if x.get(
+            'students') is not None else '-')  # Extract student prices
+
+    df['symbol'] = df.apply(lambda x: get_symbol(x['name'], x['notes']), axis=1)
+    df.set_index('name', append=True, inplace=True)
+
+    df.drop(columns=['id', 'prices'], inplace=True)
+
+    return [(line, contents.loc[line].reset_index().apply(lambda x: f'▫ {x["name"]} {x["symbol"]}', axis=1).tolist())
+            for line, contents in df.groupby(level=0, sort=False)]
+
+
+def normalized_meal_lines(payload, mains_only=True) -> list:
+    return [(line, [f'▫ {meal.name} {meal.symbol}' for meal in meals])
+            for line, meals in normalize_meals(payload, mains_only=mains_only)]
+
+
+def measure(function, payload, repeat) -> dict:
+    """
+    Time function on payload and record allocations of a single call
+
+    :return: Dict with mean time per call in microseconds, allocated KiB and number of allocations
+    """
+    function(payload)  # Warm up imports and caches
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(payload)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    function(payload)
+    snapshot_after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = snapshot_after.compare_to(snapshot_before, 'filename')
+
+    return {'us_per_call': 1e6 * elapsed / repeat, 'peak_kib': peak / 1024,
+            'allocations': sum(max(stat.count_diff, 0) for stat in stats)}
+
+
+def main(repeat=200):
+    with open(FIXTURE, 'r') as f:
+        payload = json.load(f)
+
+    assert pandas_meal_lines(payload) == normalized_meal_lines(payload)
+    results = {function.__name__: measure(function, payload, repeat)
+               for function in (pandas_meal_lines, normalized_meal_lines)}
+
+    print(f'{len(payload)} meals, {repeat} calls')
+    for name, result in results.items():
+        print(f'{name:>22}: {result["us_per_call"]:10.1f} µs/call  peak {result["peak_kib"]:8.1f} KiB  '
+              f'{result["allocations"]:6d} allocations')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark of the bitmask PollData against the previous DataFrame implementation
+
+Run with: python -m benchmarks.bench_poll
+"""
+import random
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from model.model import PollData
+from utils.utils import prettify_table
+
+OPTIONS = ['11:40 Uhr', '12:10 Uhr', '12:40 Uhr', '13:10 Uhr', '13:30 Uhr', '13:50 Uhr']
+
+
+class DataFramePollData:
+    """
+    Previous pandas-backed PollData, kept as a reference for benchmarking
+    """
+
+    def __init__(self, option_list):
+        self.data = pd.DataFrame(columns=option_list, dtype='int8')
+        self.data.index.name = 'user_id'
+        self.active = True
+
+    def set_choice(self, user_first_name, option):
+        self.data.loc[user_first_name, option] = 1
+        self.data.loc[user_first_name, 'Out'] = 0
+
+    def calculate_stats(self):
+        times = self.data.T.apply(lambda x: ', '.join(x.loc[x == 1].index.tolist()), axis=1). \
+            rename('attendees', inplace=True).to_frame()
+        times['total'] = self.data.T.apply(lambda x: int(np.sum(x)) if not np.isnan(np.sum(x)) else 0, axis=1)
+
+        max_votes = times['total'].max()
+        times['is_choice'] = times['total'].apply(lambda x: x == max_votes if max_votes != 0 else False)
+        times.loc['Out', 'is_choice'] = None
+        unique_max = np.sum(times['is_choice']) == 1
+        shared_max = np.sum(times['is_choice']) > 1
+        times.reset_index(inplace=True)
+        times.columns = ['time', 'attendees', 'total', 'is_choice']
+
+        return times, unique_max, shared_max
+
+    def get_results(self):
+        times, unique_max, shared_max = self.calculate_stats()
+        times['time'] = times.apply(lambda x: str(f'{x["time"]} ({x["total"]}):'), axis=1)
+        times['attendees'] = times.apply(
+            lambda x: str(f'{x["attendees"]} ✔') if (x['is_choice'] == 1 and unique_max) else
+            f'{x["attendees"]} ❎' if (x['is_choice'] == 1 and shared_max)
+            else x['attendees'], axis=1)
+
+        times.set_index('time', inplace=True)
+        times.drop(columns=['total', 'is_choice'], inplace=True)
+        return prettify_table(times, show_index=True, tablefmt='simple')
+
+    def delete_user(self, user_first_name, times_only=False):
+        if times_only:
+            self.data.loc[user_first_name, [col for col in self.data.columns if col != 'Out']] = 0
+        else:
+            self.data.loc[user_first_name, :] = 0
+
+    def checkall_user(self, user_first_name):
+        self.data.loc[user_first_name, [col for col in self.data.columns if col != 'Out']] = 1
+        self.data.loc[user_first_name, 'Out'] = 0
+
+
+def make_votes(n_voters, seed=0) -> list:
+    rng = random.Random(seed)
+    votes = []
+    for num in range(n_voters):
+        user = f'User{num}'
+        votes.append(('set_choice', user, rng.choice(OPTIONS)))
+        if rng.random() < 0.3:
+            votes.append(('set_choice', user, rng.choice(OPTIONS)))
+        if rng.random() < 0.1:
+            votes.append(('checkall_user', user, None))
+        if rng.random() < 0.05:
+            votes.append(('delete_user', user, None))
+    return votes
+
+
+def run(poll_class, votes) -> dict:
+    """
+    Apply votes to a fresh poll, timing the vote updates and the result rendering after each vote
+
+    :param poll_class: PollData implementation
+    :param votes: List of (method, user, option) tuples
+    :return: Dict with mean update and render time in microseconds and peak allocated bytes
+    """
+    tracemalloc.start()
+    poll = poll_class(OPTIONS)
+    update_time = 0.0
+    render_time = 0.0
+    for method, user, option in votes:
+        start = time.perf_counter()
+        if option is None:
+            getattr(poll, method)(user)
+        else:
+            getattr(poll, method)(user, option)
+        update_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        poll.get_results()
+        render_time += time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'update_us': 1e6 * update_time / len(votes), 'render_us': 1e6 * render_time / len(votes),
+            'peak_kib': peak / 1024}
+
+
+def main():
+    for n_voters in (10, 100, 1000):
+        votes = make_votes(n_voters)
+        print(f'\n{n_voters} voters, {len(votes)} votes')
+        for poll_class in (DataFramePollData, PollData):
+            result = run(poll_class, votes)
+            print(f'{poll_class.__name__:>18}: update {result["update_us"]:10.1f} µs  '
+                  f'get_results {result["render_us"]:10.1f} µs  peak {result["peak_kib"]:10.1f} KiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark of the incremental SimpleTable renderer against tabulate on the poll results path
+
+Run with: python -m benchmarks.bench_table
+"""
+import time
+
+from benchmarks.bench_poll import OPTIONS, make_votes
+from model.model import PollData
+from utils.table import SimpleTable
+from utils.utils import prettify_table
+
+
+def percentile(samples, fraction) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def result_rows(poll) -> list:
+    """
+    Build the rows PollData.get_results renders
+
+    :param poll: PollData instance
+    :return: List of rows
+    """
+    times, unique_max, shared_max = poll.calculate_stats()
+    table = []
+    for time_label, attendees, total, is_choice in times:
+        if is_choice and unique_max:
+            attendees = f'{attendees} ✔'
+        elif is_choice and shared_max:
+            attendees = f'{attendees} ❎'
+        table.append([f'{time_label} ({total}):', attendees])
+    return table
+
+
+def run(render, votes) -> dict:
+    """
+    Apply votes to a fresh poll and time rendering the results table after each vote
+
+    :param render: Callable taking the rows, returning the table text
+    :param votes: List of (method, user, option) tuples
+    :return: Dict with p50 and p99 render latency in microseconds and the last table
+    """
+    poll = PollData(OPTIONS)
+    samples = []
+    text = None
+    for method, user, option in votes:
+        if option is None:
+            getattr(poll, method)(user)
+        else:
+            getattr(poll, method)(user, option)
+        rows = result_rows(poll)
+        start = time.perf_counter()
+        text = render(rows)
+        samples.append(time.perf_counter() - start)
+
+    return {'p50_us': 1e6 * percentile(samples, 0.5), 'p99_us': 1e6 * percentile(samples, 0.99), 'text': text}
+
+
+def main():
+    for n_voters in (10, 100, 1000):
+        votes = make_votes(n_voters)
+        print(f'\n{n_voters} voters, {len(votes)} votes')
+
+        results = {'tabulate': run(lambda rows: prettify_table(rows, tablefmt='simple'), votes),
+                   'SimpleTable': run(SimpleTable().render, votes)}
+        assert results['tabulate']['text'] == results['SimpleTable']['text']
+        poll = PollData(OPTIONS)
+        for method, user, option in votes:
+            getattr(poll, method)(*((user,) if option is None else (user, option)))
+            assert poll.get_results() == prettify_table(result_rows(poll), tablefmt='simple')
+
+        for name, result in results.items():
+            print(f'{name:<12} render p50 {result["p50_us"]:9.1f} µs   p99 {result["p99_us"]:9.1f} µs')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Stand-ins for the Telegram bot, job queue, callback context and updates that record all API calls
+"""
+import itertools
+from types import SimpleNamespace
+
+
+class FakeBot:
+    """
+    Bot recording send_message, edit_message_text and answer_* calls instead of sending them
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._message_ids = itertools.count(1000)
+
+    def _record(self, method, **kwargs):
+        self.calls.append((method, kwargs))
+        return SimpleNamespace(message_id=next(self._message_ids), chat_id=kwargs.get('chat_id'),
+                               text=kwargs.get('text'), reply_markup=kwargs.get('reply_markup'))
+
+    def send_message(self, **kwargs):
+        return self._record('send_message', **kwargs)
+
+    def edit_message_text(self, **kwargs):
+        return self._record('edit_message_text', **kwargs)
+
+    def answer_callback_query(self, *args, **kwargs):
+        return self._record('answer_callback_query', **kwargs)
+
+    def answer_inline_query(self, *args, **kwargs):
+        return self._record('answer_inline_query', **kwargs)
+
+    def count(self, method) -> int:
+        return sum(1 for name, _ in self.calls if name == method)
+
+
+class FakeJobQueue:
+    """
+    Job queue running one-off jobs immediately, so edits scheduled by handlers are part of the measurement
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.scheduled = []
+
+    def run_once(self, callback, when, context=None):
+        job = SimpleNamespace(callback=callback, when=when, context=context)
+        if isinstance(when, (int, float)):
+            callback(SimpleNamespace(bot=self.bot, job=job, job_queue=self))
+        else:
+            self.scheduled.append(job)  # Jobs at a time of day, e.g. poll close jobs
+        return job
+
+    def run_repeating(self, callback, interval, first=None, context=None):
+        job = SimpleNamespace(callback=callback, interval=interval, context=context)
+        self.scheduled.append(job)
+        return job
+
+
+def make_context(bot=None, job_queue=None):
+    bot = bot if bot is not None else FakeBot()
+    return SimpleNamespace(bot=bot, job_queue=job_queue if job_queue is not None else FakeJobQueue(bot),
+                           user_data={}, chat_data={}, job=None)
+
+
+def make_command_update(chat_id, text='/today', user_id=1, first_name='Alice'):
+    user = SimpleNamespace(id=user_id, first_name=first_name)
+    message = SimpleNamespace(text=text, message_id=1, from_user=user, chat_id=chat_id,
+                              reply_text=lambda *args, **kwargs: None)
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), effective_user=user, message=message,
+                           callback_query=None, inline_query=None)
+
+
+def make_callback_update(chat_id, message_id, data, user_id, first_name, reply_markup=None):
+    user = SimpleNamespace(id=user_id, first_name=first_name)
+    message = SimpleNamespace(message_id=message_id, chat_id=chat_id, reply_markup=reply_markup)
+    query = SimpleNamespace(id=str(user_id), data=data, from_user=user, message=message,
+                            answer=lambda *args, **kwargs: None)
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), effective_user=user, message=None,
+                           callback_query=query, inline_query=None)
+
+
+def make_inline_update(query, user_id=1, first_name='Alice'):
+    user = SimpleNamespace(id=user_id, first_name=first_name)
+    inline_query = SimpleNamespace(id=str(user_id), query=query, from_user=user)
+    return SimpleNamespace(inline_query=inline_query, effective_user=user, effective_chat=None, message=None,
+                           callback_query=None)
@@ -0,0 +1,132 @@
+"""
+Local stand-in for the OpenMensa API serving recorded fixtures
+"""
+import datetime
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURE_DIR, name), 'r') as f:
+        return json.load(f)
+
+
+class FakeOpenMensa:
+    """
+    HTTP server answering /canteens/{id}, /canteens/{id}/days and /canteens/{id}/days/{date}/meals.
+    Days are generated relative to the requested start date, every open day serves the recorded meals fixture.
+    Responses carry an ETag and conditional requests for unchanged payloads are answered with 304.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, canteen=None, meals=None, n_days=14, closed_weekdays=(),
+                 n_canteens=800):
+        """
+        Constructor for FakeOpenMensa instance
+
+        :param host: Host to listen on
+        :param port: Port to listen on, 0 picks a free port
+        :param canteen: Canteen info payload, defaults to fixtures/canteen.json
+        :param meals: Meals payload, defaults to fixtures/meals.json
+        :param n_days: Number of days returned by /days
+        :param closed_weekdays: Weekdays (0 is Monday) reported as closed
+        :param n_canteens: Number of canteens listed by /canteens, the first being the canteen fixture
+        """
+        self.canteen = canteen if canteen is not None else load_fixture('canteen.json')
+        self.meals = meals if meals is not None else load_fixture('meals.json')
+        self.n_days = n_days
+        self.closed_weekdays = set(closed_weekdays)
+        self.directory = [self.canteen] + self._generate_canteens(n_canteens - 1)
+        self.requests = []
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/api/v2/'
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, like openmensa.org
+            disable_nagle_algorithm = True  # Headers and body are written separately
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                fake.requests.append(url.path)
+                payload = fake.route(url.path, parse_qs(url.query))
+                body = json.dumps(payload).encode('utf-8') if payload is not None else b'{}'
+                etag = f'"{hashlib.sha1(body).hexdigest()}"'
+                if payload is not None and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200 if payload is not None else 404)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                if payload is not None:
+                    self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    @staticmethod
+    def _generate_canteens(n) -> list:
+        generator = random.Random(0)
+        return [{'id': 1000 + num, 'name': f'Stadt{num % 97}, Mensa {num}', 'city': f'Stadt{num % 97}',
+                 'address': f'Campus {num}', 'coordinates': [round(generator.uniform(47.5, 55.0), 6),
+                                                             round(generator.uniform(6.0, 15.0), 6)]}
+                for num in range(n)]
+
+    def route(self, path, query):
+        """
+        Get payload for request path
+
+        :param path: Request path
+        :param query: Parsed query parameters
+        :return: Decoded JSON payload or None for unknown paths
+        """
+        if path == '/api/v2/canteens':
+            limit = int(query.get('limit', ['10'])[0])
+            page = int(query.get('page', ['1'])[0])
+            return self.directory[(page - 1) * limit:page * limit]
+        if re.fullmatch(r'/api/v2/canteens/\d+', path):
+            canteen_id = int(path.rsplit('/', 1)[1])
+            return next((canteen for canteen in self.directory if canteen['id'] == canteen_id), self.canteen)
+        if re.fullmatch(r'/api/v2/canteens/\d+/days', path):
+            start = datetime.date.fromisoformat(query.get('start', [str(datetime.date.today())])[0])
+            dates = [start + datetime.timedelta(days=num) for num in range(self.n_days)]
+            return [{'date': str(date), 'closed': date.weekday() in self.closed_weekdays} for date in dates]
+        if re.fullmatch(r'/api/v2/canteens/\d+/days/[\d-]+/meals', path):
+            return self.meals
+        return None
+
+    def start(self) -> 'FakeOpenMensa':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='FakeOpenMensa', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,210 @@
+"""
+Local stand-in for the Telegram Bot API recording all calls and serving pushed updates by long polling
+"""
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+TOKEN = '123456:FAKE-TOKEN'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Mensa Bot', 'username': 'mensa_bot'}
+
+_MESSAGE_METHODS = {'sendMessage', 'sendLocation', 'sendPhoto', 'sendDocument', 'editMessageText',
+                    'editMessageReplyMarkup'}
+
+
+def message_update(chat_id, text, user_id=None, first_name='User') -> dict:
+    """
+    Build an update of a text message, e.g. a command
+
+    :param chat_id: Chat ID, negative for group chats
+    :param text: Message text
+    :param user_id: Sender ID, defaults to chat_id for private chats
+    :param first_name: Sender first name
+    :return: Update as decoded JSON without update_id
+    """
+    user_id = user_id if user_id is not None else abs(chat_id)
+    entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}] if text.startswith('/') else []
+    return {'message': {'message_id': 1, 'date': int(time.time()), 'text': text, 'entities': entities,
+                        'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'},
+                        'from': {'id': user_id, 'is_bot': False, 'first_name': first_name}}}
+
+
+def callback_update(chat_id, message_id, data, user_id, first_name='User', query_id=None) -> dict:
+    """
+    Build an update of a button press on a message sent by the bot
+
+    :param chat_id: Chat ID of the message
+    :param message_id: ID of the message
+    :param data: Callback data of the button
+    :param user_id: ID of the user pressing the button
+    :param first_name: First name of the user
+    :param query_id: Callback query ID, defaults to a unique one
+    :return: Update as decoded JSON without update_id
+    """
+    return {'callback_query': {
+        'id': query_id if query_id is not None else f'{chat_id}-{message_id}-{user_id}-{time.monotonic_ns()}',
+        'chat_instance': str(chat_id), 'data': data,
+        'from': {'id': user_id, 'is_bot': False, 'first_name': first_name},
+        'message': {'message_id': message_id, 'date': int(time.time()), 'text': 'Live polling',
+                    'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'}}}}
+
+
+class FakeTelegram:
+    """
+    HTTP server answering Bot API requests to /bot<token>/<method>.
+    Every call is recorded with its receive time; sent and edited messages are answered with a message object
+    carrying a new message ID. Updates added with push_update are served by getUpdates, honouring offset and
+    long polling timeout.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        """
+        Constructor for FakeTelegram instance
+
+        :param host: Host to listen on
+        :param port: Port to listen on, 0 picks a free port
+        :param latency: Seconds every call except getUpdates takes, like the round trip to Telegram
+        """
+        self.latency = latency
+        self.calls = []  # (monotonic time, method, params, result)
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+        self._condition = threading.Condition()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def api_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/bot'
+
+    def push_update(self, update) -> int:
+        """
+        Queue an update for getUpdates
+
+        :param update: Update as decoded JSON, the update_id is assigned here
+        :return: Update ID
+        """
+        with self._condition:
+            update = dict(update, update_id=next(self._update_ids))
+            self._updates.append(update)
+            self._condition.notify_all()
+        return update['update_id']
+
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._updates)
+
+    def calls_of(self, method) -> list:
+        with self._condition:
+            return [call for call in self.calls if call[1] == method]
+
+    def count(self, method) -> int:
+        return len(self.calls_of(method))
+
+    def wait_for(self, predicate, timeout=30.0) -> bool:
+        """
+        Wait until predicate() is true
+
+        :param predicate: Callable without arguments
+        :param timeout: Maximum number of seconds to wait
+        :return: False on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _get_updates(self, params) -> list:
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            # Confirmed updates are dropped, like Telegram does
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._condition.wait(deadline - time.monotonic())
+            return self._updates[:int(params.get('limit') or 100)]
+
+    def call(self, method, params):
+        """
+        Answer a Bot API call
+
+        :param method: Method name, e.g. sendMessage
+        :param params: Decoded parameters
+        :return: Result of the call
+        """
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if self.latency:
+            time.sleep(self.latency)
+
+        if method == 'getMe':
+            result = BOT_USER
+        elif method in _MESSAGE_METHODS:
+            chat_id = int(params.get('chat_id', 0))
+            message_id = int(params['message_id']) if 'message_id' in params else next(self._message_ids)
+            result = {'message_id': message_id, 'date': int(time.time()), 'from': BOT_USER,
+                      'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'},
+                      'text': params.get('text', '')}
+        else:
+            result = True
+
+        with self._condition:
+            self.calls.append((time.monotonic(), method, params, result))
+        return result
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, like api.telegram.org
+
+            def _answer(self, params):
+                method = urlparse(self.path).path.rsplit('/', 1)[-1]
+                body = json.dumps({'ok': True, 'result': fake.call(method, params)}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._answer(dict(parse_qsl(urlparse(self.path).query)))
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    params = json.loads(body.decode('utf-8')) if body else {}
+                else:
+                    params = dict(parse_qsl(body.decode('utf-8')))
+                self._answer(params)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> 'FakeTelegram':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='FakeTelegram', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        with self._condition:
+            self._condition.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,139 @@
+"""
+Load test of the sharded mode against local OpenMensa and Telegram stand-ins
+
+Starts the front process with each given number of shard processes, creates a poll in every chat and then sends
+votes mixed with /today commands at a fixed rate. Reports the latency from pushing a command to the bot's answer,
+which is what a chat notices while other chats are busy voting.
+
+Run with: python -m benchmarks.load_sharded [--shards 1 2 4] [--chats 64] [--updates 2000] [--rate 200]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+
+import config
+from benchmarks.fake_openmensa import FakeOpenMensa
+from benchmarks.fake_telegram import FakeTelegram, TOKEN, callback_update, message_update
+from benchmarks.run import percentile
+from main import run_sharded
+
+OPTIONS = 6
+VOTERS = 20
+
+
+def run(shards, chats, n_updates, rate, command_every, timeout=300) -> dict:
+    """
+    Run one load test
+
+    :param shards: Number of shard processes
+    :param chats: Number of chats
+    :param n_updates: Number of updates sent after the polls were created
+    :param rate: Updates sent per second, 0 for as fast as possible
+    :param command_every: Every n-th update is a /today command, all others are votes
+    :param timeout: Seconds to wait for all answers
+    :return: Dict of results
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir, FakeOpenMensa() as fake_openmensa, FakeTelegram() as telegram:
+        overrides = {'TELEGRAM_API_URL': telegram.api_url, 'OPENMENSA_BASE_URL': fake_openmensa.base_url,
+                     'SHARD_DIR': os.path.join(tmp_dir, 'shards'),
+                     'MENU_SNAPSHOT_PATH': os.path.join(tmp_dir, 'menus.sqlite3'),
+                     'ARCHIVE_DIR': os.path.join(tmp_dir, 'archive'),
+                     'POLL_ARCHIVE_DIR': os.path.join(tmp_dir, 'polls'),
+                     'METRICS_ENABLED': False, 'SERVING_MODE': 'polling', 'POLLING_TIMEOUT': 1,
+                     'DEFAULT_SUBSCRIBERS': [], 'LOG_LEVEL': 'WARNING'}
+        stopped = threading.Event()
+        front = threading.Thread(target=run_sharded, args=(TOKEN, shards, stopped, overrides), name='Front',
+                                 daemon=True)
+        start = time.monotonic()
+        front.start()
+
+        # JOB: Create a poll in every chat, which also waits for all shard processes to be up
+        chat_ids = list(range(1, chats + 1))
+        for chat_id in chat_ids:
+            telegram.push_update(message_update(chat_id, '/schedule'))
+
+        def polls():
+            return {int(call[2]['chat_id']): call[3]['message_id'] for call in telegram.calls_of('sendMessage')
+                    if 'reply_markup' in call[2]}
+
+        if not telegram.wait_for(lambda: len(polls()) == chats, timeout=timeout):
+            raise RuntimeError(f'Only {len(polls())} of {chats} polls were created')
+        poll_ids = polls()
+        startup = time.monotonic() - start
+        answered_before = {chat_id: 0 for chat_id in chat_ids}
+        for call in telegram.calls_of('sendMessage'):
+            answered_before[int(call[2]['chat_id'])] += 1
+
+        # JOB: Send votes and commands at the given rate
+        sent = defaultdict(deque)  # chat ID -> push times of commands
+        commands = 0
+        t0 = time.monotonic()
+        for num in range(n_updates):
+            if rate:
+                delay = t0 + num / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            chat_id = chat_ids[num % chats]
+            if num % command_every == 0:
+                sent[chat_id].append(time.monotonic())
+                telegram.push_update(message_update(chat_id, '/today'))
+                commands += 1
+            else:
+                user_id = 10 ** 6 + chat_id * VOTERS + num // chats % VOTERS
+                telegram.push_update(callback_update(chat_id, poll_ids[chat_id], f'option_{num % OPTIONS}', user_id,
+                                                     first_name=f'User{user_id % 1000}'))
+        send_time = time.monotonic() - t0
+
+        def answers():
+            return telegram.count('sendMessage') - sum(answered_before.values())
+
+        if not telegram.wait_for(lambda: answers() >= commands and not telegram.pending(), timeout=timeout):
+            raise RuntimeError(f'Only {answers()} of {commands} commands were answered')
+        drain = time.monotonic() - t0
+
+        # Match answers to commands in order per chat
+        latencies = []
+        skip = dict(answered_before)
+        for answered_at, _, params, _ in telegram.calls_of('sendMessage'):
+            chat_id = int(params['chat_id'])
+            if skip[chat_id]:
+                skip[chat_id] -= 1
+            elif sent[chat_id]:
+                latencies.append(answered_at - sent[chat_id].popleft())
+
+        stopped.set()
+        front.join(timeout)
+        edits = telegram.count('editMessageText')
+
+    return {'shards': shards, 'startup_s': startup, 'updates': n_updates, 'commands': commands,
+            'send_s': send_time, 'drain_s': drain, 'updates_per_s': n_updates / drain,
+            'p50_ms': 1000 * percentile(latencies, 0.5), 'p99_ms': 1000 * percentile(latencies, 0.99),
+            'max_ms': 1000 * max(latencies), 'edits': edits}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--chats', type=int, default=64)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=200, help='Updates per second, 0 for as fast as possible')
+    parser.add_argument('--command-every', type=int, default=10, help='Every n-th update is a /today command')
+    args = parser.parse_args()
+
+    print(f'{os.cpu_count()} CPUs, {args.chats} chats, {args.updates} updates at '
+          f'{args.rate or "max"} updates/s, every {args.command_every}th is a command\n')
+    print(f'{"shards":>6}{"startup s":>11}{"drain s":>9}{"updates/s":>11}{"p50 ms":>9}{"p99 ms":>9}{"max ms":>9}'
+          f'{"edits":>7}')
+    for shards in args.shards:
+        result = run(shards, args.chats, args.updates, args.rate, args.command_every)
+        print(f'{result["shards"]:6d}{result["startup_s"]:11.2f}{result["drain_s"]:9.2f}'
+              f'{result["updates_per_s"]:11.1f}{result["p50_ms"]:9.1f}{result["p99_ms"]:9.1f}'
+              f'{result["max_ms"]:9.1f}{result["edits"]:7d}')
+
+
+if __name__ == '__main__':
+    config.LOG_LEVEL = 'WARNING'
+    main()
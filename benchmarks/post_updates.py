@@ -0,0 +1,70 @@
+"""
+Post recorded Telegram updates to the local webhook listener
+
+Run with: python -m benchmarks.post_updates [--url http://127.0.0.1:8443/webhook] [--count N] [--concurrency N]
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import config
+
+UPDATE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'updates')
+
+
+def load_updates() -> list:
+    updates = []
+    for path in sorted(glob.glob(os.path.join(UPDATE_DIR, '*.json'))):
+        with open(path, 'r') as f:
+            updates.append(json.load(f))
+    return updates
+
+
+def post(url, update) -> tuple:
+    """
+    Post update and return HTTP status and latency in seconds
+    """
+    request = Request(url, data=json.dumps(update).encode('utf-8'), headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    try:
+        with urlopen(request, timeout=10) as response:
+            status = response.status
+    except HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default=f'http://{config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}/{config.WEBHOOK_PATH}')
+    parser.add_argument('--count', type=int, default=100, help='Number of updates to post')
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    updates = load_updates()
+    batch = []
+    for num in range(args.count):
+        update = dict(updates[num % len(updates)])
+        update['update_id'] = update['update_id'] + num
+        batch.append(update)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda update: post(args.url, update), batch))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for _, latency in results)
+    print(f'Posted {len(results)} updates in {elapsed:.2f} s ({len(results) / elapsed:.0f} updates/s)')
+    print(f'Status codes: {dict(Counter(status for status, _ in results))}')
+    print(f'Latency p50 {1000 * latencies[len(latencies) // 2]:.1f} ms, '
+          f'p99 {1000 * latencies[min(int(0.99 * len(latencies)), len(latencies) - 1)]:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Offline end-to-end benchmarks of the bot's hot paths against local OpenMensa and Telegram stand-ins
+
+Run with: python -m benchmarks.run [--repeat N] [--baseline results/<file>.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fake_bot import FakeBot, FakeJobQueue, make_callback_update, make_command_update, make_context, \
+    make_inline_update
+from benchmarks.fake_openmensa import FakeOpenMensa
+from controller import controller
+from model.client import OpenMensaClient
+from model.model import Mensa, PollData
+from view.menu import render_cache
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+OPTIONS = ['11:40 Uhr', '12:10 Uhr', '12:40 Uhr', '13:10 Uhr', '13:30 Uhr', '13:50 Uhr']
+
+
+def percentile(samples, fraction) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def measure(function, repeat, setup=None) -> dict:
+    """
+    Time function and record allocations of one additional call
+
+    :param function: Callable without arguments
+    :param repeat: Number of timed calls
+    :param setup: Optional callable run untimed before every call
+    :return: Dict with p50 and p99 latency in milliseconds, allocated KiB and number of allocated blocks
+    """
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    function()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(max(stat.count_diff, 0) for stat in after.compare_to(before, 'filename'))
+
+    return {'p50_ms': 1000 * percentile(samples, 0.5), 'p99_ms': 1000 * percentile(samples, 0.99),
+            'peak_kib': peak / 1024, 'allocations': blocks, 'repeat': repeat}
+
+
+def clear_caches():
+    Mensa.cache.clear()
+    render_cache.clear()
+
+
+def bench_meal_data(repeat) -> dict:
+    mensa = Mensa()
+    return {'meal_data (cold)': measure(mensa.meal_data, repeat, setup=clear_caches),
+            'meal_data (warm)': measure(mensa.meal_data, repeat)}
+
+
+def bench_get_daily_menu(repeat) -> dict:
+    context = make_context()
+    update = make_command_update(chat_id=1)
+
+    def get_daily_menu():
+        controller.get_daily_menu(update, context, chat_id=1)
+
+    results = {'get_daily_menu (cold)': measure(get_daily_menu, repeat, setup=clear_caches),
+               'get_daily_menu (warm)': measure(get_daily_menu, repeat)}
+    assert context.bot.count('send_message') == 2 * repeat + 2
+    return results
+
+
+def bench_get_results(repeat, n_voters=50) -> dict:
+    poll = PollData(OPTIONS)
+    for num in range(n_voters):
+        poll.set_choice(f'User{num}', OPTIONS[num % len(OPTIONS)], user_id=num)
+    return {f'PollData.get_results ({n_voters} voters)': measure(poll.get_results, repeat)}
+
+
+def bench_button(repeat, n_voters=50) -> dict:
+    bot = FakeBot()
+    context = make_context(bot=bot, job_queue=FakeJobQueue(bot))
+    controller.schedule(make_command_update(chat_id=2, text='/schedule'), context)
+    message_id = bot.calls[-1][1].get('message_id', 1000)
+
+    votes = iter(range(10 ** 9))
+
+    def vote():
+        num = next(votes)
+        update = make_callback_update(chat_id=2, message_id=message_id, data=f'option_{num % len(OPTIONS)}',
+                                      user_id=num % n_voters, first_name=f'User{num % n_voters}')
+        controller.button(update, context)
+
+    results = {f'controller.button vote ({n_voters} voters)': measure(vote, repeat)}
+    assert bot.count('edit_message_text') > 0
+    return results
+
+
+def bench_inline(repeat) -> dict:
+    context = make_context()
+    queries = iter(range(10 ** 9))
+    words = ['gulasch', 'vegan', 'vegan <2', 'linie 3', 'piz', 'max 1.5', 'nudeln fleisch']
+
+    def inline():
+        controller.inline(make_inline_update(words[next(queries) % len(words)]), context)
+
+    results = {'controller.inline search (warm)': measure(inline, repeat)}
+    assert context.bot.count('answer_inline_query') == repeat + 1
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--baseline', help='Results file of a previous run to compare with')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir, FakeOpenMensa() as fake_openmensa:
+        # Point the OpenMensa client at the local stand-in and keep the state store and archives in tmp_dir
+        Mensa.base_url = fake_openmensa.base_url
+        Mensa.client = OpenMensaClient(fake_openmensa.base_url)
+        controller.open_state(os.path.join(tmp_dir, 'state.sqlite3'), archive_dir=os.path.join(tmp_dir, 'archive'),
+                              poll_archive_dir=os.path.join(tmp_dir, 'polls'))
+
+        results = {}
+        for bench in (bench_meal_data, bench_get_daily_menu, bench_get_results, bench_button, bench_inline):
+            results.update(bench(args.repeat))
+        controller.state_store.close()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+
+    print(f'{"benchmark":<40}{"p50 ms":>10}{"p99 ms":>10}{"peak KiB":>10}{"allocs":>8}')
+    for name, result in results.items():
+        line = f'{name:<40}{result["p50_ms"]:10.3f}{result["p99_ms"]:10.3f}{result["peak_kib"]:10.1f}' \
+               f'{result["allocations"]:8d}'
+        if name in baseline:
+            line += f'   p50 x{result["p50_ms"] / baseline[name]["p50_ms"]:.2f} vs. baseline'
+        print(line)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f'{datetime.datetime.now():%Y%m%d-%H%M%S}.json')
+    with open(path, 'w') as f:
+        json.dump({'created': datetime.datetime.now().isoformat(), 'results': results}, f, indent=2)
+    print(f'\nResults saved to {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,153 @@
-import pandas as pd
 import os
 
-pd.set_option('precision', 6)
-pd.set_option('display.max_rows', 200)
-pd.set_option('display.max_columns', 40)
-pd.set_option('max_colwidth', 80)
-pd.set_option('mode.sim_interactive', True)
-pd.set_option('expand_frame_repr', True)
-pd.set_option('large_repr', 'truncate')
+_pandas_configured = False
+
+
+def import_pandas():
+    """
+    Import pandas on first use and apply display options once
+
+    :return: pandas module
+    """
+    global _pandas_configured
+    import pandas as pd
+
+    if not _pandas_configured:
+        pd.set_option('precision', 6)
+        pd.set_option('display.max_rows', 200)
+        pd.set_option('display.max_columns', 40)
+        pd.set_option('max_colwidth', 80)
+        pd.set_option('mode.sim_interactive', True)
+        pd.set_option('expand_frame_repr', True)
+        pd.set_option('large_repr', 'truncate')
+
+        pd.set_option('colheader_justify', 'left')
+        pd.set_option('display.width', 800)
+        pd.set_option('display.html.table_schema', False)
+        _pandas_configured = True
+
+    return pd
 
-pd.set_option('colheader_justify', 'left')
-pd.set_option('display.width', 800)
-pd.set_option('display.html.table_schema', False)
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 
-CURRENT_POLL = None
-CURRENT_POLL_ID = None
-CHAT_ID = None
+# Logging level and local Prometheus metrics endpoint
+LOG_LEVEL = 'INFO'
+METRICS_ENABLED = True
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9464
+
+# Serving mode ('polling' or 'webhook'), dispatcher worker threads and update queue depth
+SERVING_MODE = 'polling'
+DISPATCHER_WORKERS = 8
+UPDATE_QUEUE_SIZE = 1000
+
+# Handlers run asynchronously on a bounded executor; updates of the same chat are handled in order
+ASYNC_HANDLERS = True
+HANDLER_WORKERS = 16
+HANDLER_QUEUE_SIZE = 500
+
+# Telegram Bot API base URL (the token is appended) and long polling timeout of the sharded front process
+TELEGRAM_API_URL = 'https://api.telegram.org/bot'
+POLLING_TIMEOUT = 10
+
+# Sharded mode: a front process routes updates by chat ID to SHARDS worker processes, each owning the polls and
+# state of its chats in SHARD_DIR/<shard>. The front process alone talks to OpenMensa and publishes all responses
+# to a shared read-only menu snapshot every SNAPSHOT_INTERVAL seconds. SHARDS = 1 runs a single process
+SHARDS = 1
+SHARD_QUEUE_SIZE = 1000
+SHARD_DIR = os.path.join(ROOT_DIR, 'data/shards')
+MENU_SNAPSHOT_PATH = os.path.join(ROOT_DIR, 'data/menus.sqlite3')
+SNAPSHOT_INTERVAL = 5 * 60
+
+# Webhook listener; updates are rejected with 503 if the queue stays full for WEBHOOK_QUEUE_TIMEOUT seconds.
+# WEBHOOK_URL is the public base URL registered with Telegram, None skips registration (e.g. local testing)
+WEBHOOK_HOST = '127.0.0.1'
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = 'webhook'
+WEBHOOK_QUEUE_TIMEOUT = 1.0
+WEBHOOK_URL = None
+
+# Fast start: fetch canteen info in the background instead of blocking startup on it
+FAST_START = True
+
+# Additional meal symbols as keyword -> symbol, checked after the built-in keywords
+EXTRA_MEAL_SYMBOLS = {}
+
+# Base URL of the OpenMensa REST API
+OPENMENSA_BASE_URL = 'https://openmensa.org/api/v2/'
+DEFAULT_CANTEEN_ID = 31  # KIT Mensa Am Adenauerring, used by chats that did not pick a canteen
+
+# Canteen directory: canteens per page when fetching /canteens, grid cell size in degrees for nearest-canteen
+# lookups and number of canteens offered per search
+DIRECTORY_PAGE_SIZE = 100
+DIRECTORY_GRID_DEGREES = 0.25
+DIRECTORY_RESULTS = 6
+
+# OpenMensa response cache: time to live in seconds per endpoint and maximum number of entries
+CACHE_TTL = {'canteen': 6 * 60 * 60, 'days': 10 * 60, 'meals': 30 * 60, 'directory': 7 * 24 * 60 * 60}
+CACHE_MAX_SIZE = 256
+# Seconds after expiry during which cached responses are still served while being refreshed in the background
+CACHE_STALE_TTL = {'canteen': 24 * 60 * 60, 'days': 60 * 60, 'meals': 2 * 60 * 60, 'directory': 7 * 24 * 60 * 60}
+
+# Menus of the upcoming days are prefetched concurrently; the interval keeps them fresher than the meals TTL
+PREFETCH_DAYS = 7
+PREFETCH_WORKERS = 7
+PREFETCH_INTERVAL = 25 * 60
+# Menus of the next REFRESH_DAYS open days are revalidated every REFRESH_INTERVAL seconds with conditional requests
+REFRESH_INTERVAL = 5 * 60
+REFRESH_DAYS = 2
+
+# The prefetch job also refreshes the opening calendars; handlers only refetch calendars older than this (seconds)
+CALENDAR_MAX_AGE = 2 * 60 * 60
+
+# Rendered menu messages are reused until the meal payload changes
+RENDER_CACHE_TTL = 24 * 60 * 60
+RENDER_CACHE_MAX_SIZE = 64
+
+# Seconds Telegram may cache answers to inline dish searches, maximum number of results per answer
+INLINE_CACHE_TIME = 300
+INLINE_MAX_RESULTS = 50
+
+# OpenMensa HTTP client: pool size, (connect, read) timeouts in seconds, retries and circuit breaker
+HTTP_POOL_SIZE = 10
+HTTP_TIMEOUT = (3.05, 10)
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.3
+HTTP_BACKOFF_MAX = 5
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 60
+
+# Live poll edits: votes within the window are merged into one edit, flood waits and timeouts are retried
+EDIT_COALESCE_WINDOW = 1.0
+EDIT_MAX_RETRIES = 5
+EDIT_BACKOFF_MAX = 30
+EDIT_LAST_SENT_TTL = 24 * 60 * 60
+
+# SQLite state store for polls, votes and OpenMensa payloads, written in batches in the background
+STATE_DB_PATH = os.path.join(ROOT_DIR, 'data/state.sqlite3')
+STATE_FLUSH_INTERVAL = 0.5
+STATE_BATCH_SIZE = 500
+# Payloads are pruned once they are too old to be served (CACHE_TTL + CACHE_STALE_TTL), polls this long after closing
+STATE_POLL_RETENTION = 30 * 24 * 60 * 60
+
+# Columnar archive of past menus backing /stats
+ARCHIVE_DIR = os.path.join(ROOT_DIR, 'data/archive')
+
+# Vote archive of closed polls backing /poll_stats; predictions weigh a poll half after this many days
+POLL_ARCHIVE_DIR = os.path.join(ROOT_DIR, 'data/polls')
+POLL_PREDICTION_HALF_LIFE = 8 * 7
+
+# Daily menu broadcast: chats subscribed by default, global rate (messages per second), minimum seconds between
+# messages to one chat, concurrent senders and retries after flood waits (timed out messages are not retried)
+DEFAULT_SUBSCRIBERS = [-1001463530288]
+BROADCAST_RATE = 30
+BROADCAST_CHAT_INTERVAL = 1.0
+BROADCAST_WORKERS = 32
+BROADCAST_MAX_RETRIES = 3
+
+# Closed polls are kept for a day, polls that were never closed are dropped after two days (in seconds)
+POLL_CLOSED_RETENTION = 24 * 60 * 60
+POLL_STALE_AFTER = 2 * 24 * 60 * 60
+POLL_EVICTION_INTERVAL = 60 * 60
 
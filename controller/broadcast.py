@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import telegram
+
+from utils.metrics import registry, telegram_errors
+
+logger = logging.getLogger(__name__)
+
+broadcast_messages = registry.counter('mensabot_broadcast_messages_total', 'Broadcast messages by delivery status',
+                                      labels=('status',))
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the rate of an operation
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Constructor for TokenBucket instance
+
+        :param rate: Tokens added per second
+        :param capacity: Maximum number of tokens, defaults to rate
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()  # Time tokens were last added, in the future while paused
+        self._lock = threading.Lock()
+
+    def pause(self, seconds) -> None:
+        """
+        Hand out no tokens for a while, then refill from empty
+
+        :param seconds: Number of seconds to pause
+        """
+        with self._lock:
+            self._updated = max(self._updated, time.monotonic() + seconds)
+            self._tokens = 0
+
+    def acquire(self) -> None:
+        """
+        Take one token, waiting until one is available
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._updated:
+                    wait = self._updated - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Broadcaster:
+    """
+    Sends messages to many chats concurrently within Telegram's rate limits: a global token bucket bounds the total
+    rate, each chat gets at most one message per interval, and a flood wait pauses the bucket for all chats before
+    the message is retried.
+    Timed out messages are not retried: Telegram may have delivered them already, and a chat missing the daily
+    menu is preferred over a chat getting it twice.
+    """
+
+    def __init__(self, rate, per_chat_interval, workers, max_retries):
+        """
+        Constructor for Broadcaster instance
+
+        :param rate: Maximum number of messages per second over all chats
+        :param per_chat_interval: Minimum number of seconds between two messages to the same chat
+        :param workers: Number of concurrent senders
+        :param max_retries: Maximum number of retries per message after flood waits
+        """
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.max_retries = max_retries
+        self._last_sent = {}  # chat_id -> monotonic time of last message
+        self._lock = threading.Lock()
+
+    def _wait_for_chat(self, chat_id) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._last_sent.get(chat_id, -self.per_chat_interval) + self.per_chat_interval - now
+                if wait <= 0:
+                    self._last_sent[chat_id] = now
+                    return
+            time.sleep(wait)
+
+    def _send(self, bot, chat_id, message) -> str:
+        for _ in range(self.max_retries + 1):
+            self._wait_for_chat(chat_id)
+            self.bucket.acquire()
+            try:
+                bot.send_message(chat_id=chat_id, **message)
+                return 'delivered'
+            except telegram.error.RetryAfter as rae:
+                # The limit applies to the bot, not to this chat, so all senders wait
+                telegram_errors.inc('RetryAfter')
+                self.bucket.pause(rae.retry_after)
+            except telegram.error.TimedOut:
+                telegram_errors.inc('TimedOut')
+                logger.warning(f'Broadcast to {chat_id} timed out, not retried as it may have been delivered')
+                return 'timed_out'
+            except telegram.error.Unauthorized:
+                telegram_errors.inc('Unauthorized')
+                return 'unauthorized'
+            except telegram.error.TelegramError as te:
+                telegram_errors.inc(type(te).__name__)
+                logger.warning(f'Broadcast to {chat_id} failed: {te!r}')
+                return 'failed'
+        return 'failed'
+
+    def broadcast(self, bot, deliveries) -> dict:
+        """
+        Send messages and block until all are delivered or given up
+
+        :param bot: Bot instance
+        :param deliveries: List of (chat_id, message) tuples, message being a dict of send_message keyword arguments;
+            chats sharing a message should share the same dict so it is rendered only once
+        :return: Dict of status -> list of chat IDs
+        """
+        results = {'delivered': [], 'unauthorized': [], 'timed_out': [], 'failed': []}
+        if not deliveries:
+            return results
+
+        start = time.monotonic()
+        done = 0
+        progress_every = max(len(deliveries) // 10, 1)
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(deliveries)),
+                                thread_name_prefix='Broadcast') as executor:
+            futures = [(chat_id, executor.submit(self._send, bot, chat_id, message))
+                       for chat_id, message in deliveries]
+            for chat_id, future in futures:
+                status = future.result()
+                results[status].append(chat_id)
+                broadcast_messages.inc(status)
+                done += 1
+                if done % progress_every == 0 or done == len(deliveries):
+                    logger.info(f'Broadcast progress: {done}/{len(deliveries)} '
+                                f'({len(results["delivered"])} delivered) after {time.monotonic() - start:.1f} s')
+
+        return results
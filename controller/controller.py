@@ -1,17 +1,138 @@
 import datetime
+import html
+import logging
+import os
 import socket
+import threading
 
+from concurrent.futures import ThreadPoolExecutor
 from math import ceil
 
+import pytz
 import telegram
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent, \
     ReplyKeyboardMarkup
 from telegram.ext import CommandHandler, MessageHandler, Filters, InlineQueryHandler, CallbackQueryHandler
-from emoji import emojize
 
 import config
+from controller.broadcast import Broadcaster
+from controller.edits import EditCoalescer
+from controller.executor import KeyedExecutor
+from controller.sharding import shard_dir, shard_of
+from model.client import OpenMensaUnavailable
+from model.archive import MenuArchive, PollArchive, WEEKDAYS
+from model.directory import get_directory
+from model.meals import diff_lines
 from model.model import Mensa, PollData
+from model.registry import PollRegistry
+from model.search import DIET_ALIASES, DIETS, get_index
+from model.store import StateStore
+from utils.metrics import job_lag, registry, telegram_errors, timed
 from utils.utils import is_int
+from view.menu import render_cache, render_menu, render_menu_changes
+
+logger = logging.getLogger(__name__)
+
+edit_coalescer = EditCoalescer()
+poll_registry = PollRegistry()
+state_store = None  # StateStore, opened by open_state() at startup so importing creates no files
+broadcaster = Broadcaster(config.BROADCAST_RATE, config.BROADCAST_CHAT_INTERVAL, config.BROADCAST_WORKERS,
+                          config.BROADCAST_MAX_RETRIES)
+default_subscribers = list(config.DEFAULT_SUBSCRIBERS)  # Default chats owned by this process
+subscriptions = set()  # Chat IDs receiving the daily menu
+change_subscriptions = set()  # Chat IDs notified when today's menu changes
+chat_canteens = {}  # Chat ID -> canteen ID picked by the chat
+menu_archive = None  # MenuArchive, opened by open_state()
+poll_archive = None  # PollArchive, opened by open_state()
+_background_jobs = {}  # Job name -> thread of its latest run
+_background_lock = threading.Lock()
+
+DAILY_UPDATE_TIME = datetime.time(hour=9, minute=30, second=30, tzinfo=pytz.timezone('CET'))
+POLL_CLOSE_TIME = datetime.time(hour=11, minute=0, second=10, tzinfo=pytz.timezone('CET'))
+ARCHIVE_TIME = datetime.time(hour=14, minute=30, tzinfo=pytz.timezone('CET'))
+
+registry.gauge('mensabot_cache_hit_ratio', 'Hit ratio of caches',
+               lambda: {('openmensa',): Mensa.cache.stats()['hit_ratio'],
+                        ('render',): render_cache.stats()['hit_ratio']}, labels=('cache',))
+registry.gauge('mensabot_cache_entries', 'Number of cache entries',
+               lambda: {('openmensa',): Mensa.cache.stats()['size'],
+                        ('render',): render_cache.stats()['size']}, labels=('cache',))
+registry.gauge('mensabot_subscriptions', 'Number of chats subscribed to the daily menu', lambda: len(subscriptions))
+menu_refreshes = registry.counter('mensabot_menu_refreshes_total', 'Menu revalidations by result',
+                                  labels=('result',))
+registry.gauge('mensabot_polls', 'Number of registered polls', lambda: len(poll_registry))
+registry.gauge('mensabot_poll_edits', 'Live poll edits by outcome',
+               lambda: {(outcome,): count for outcome, count in edit_coalescer.stats().items()}, labels=('outcome',))
+
+
+def open_state(state_path=None, archive_dir=None, poll_archive_dir=None) -> StateStore:
+    """
+    Open the state store and the archives of this process
+
+    :param state_path: Path of the state store database, defaults to STATE_DB_PATH
+    :param archive_dir: Directory of the menu archive, defaults to ARCHIVE_DIR
+    :param poll_archive_dir: Directory of the poll archive, defaults to POLL_ARCHIVE_DIR
+    :return: State store
+    """
+    global state_store, menu_archive, poll_archive
+    state_store = StateStore(state_path if state_path is not None else config.STATE_DB_PATH)
+    menu_archive = MenuArchive(archive_dir if archive_dir is not None else config.ARCHIVE_DIR)
+    poll_archive = PollArchive(poll_archive_dir if poll_archive_dir is not None else config.POLL_ARCHIVE_DIR)
+    return state_store
+
+
+def configure_shard(shard, shards) -> StateStore:
+    """
+    Let this process own the chats of one shard in sharded mode: chat state is kept in the shard's own state store,
+    default subscribers of other shards are left to them and the broadcast rate is split between the shards.
+    Archives are shared, each chat's polls are only archived by the shard owning it.
+
+    :param shard: Shard index of this process
+    :param shards: Number of shards
+    :return: State store of the shard
+    """
+    global broadcaster, default_subscribers
+    store = open_state(os.path.join(shard_dir(shard), 'state.sqlite3'))
+    broadcaster = Broadcaster(config.BROADCAST_RATE / shards, config.BROADCAST_CHAT_INTERVAL,
+                              config.BROADCAST_WORKERS, config.BROADCAST_MAX_RETRIES)
+    default_subscribers = [chat_id for chat_id in config.DEFAULT_SUBSCRIBERS if shard_of(chat_id, shards) == shard]
+    return store
+
+
+def observe_job_lag(job_name, scheduled_time) -> None:
+    """
+    Record delay between the scheduled time of day of a job and now
+
+    :param job_name: Job label
+    :param scheduled_time: Scheduled time of day with pytz timezone
+    """
+    tz = scheduled_time.tzinfo
+    now = datetime.datetime.now(tz)
+    scheduled = tz.localize(datetime.datetime.combine(now.date(), scheduled_time.replace(tzinfo=None)))
+    lag = (now - scheduled).total_seconds()
+    if lag >= 0:
+        job_lag.observe(lag, job_name)
+
+
+def run_in_background(name, function, *args) -> bool:
+    """
+    Run the work of a job on its own thread, as PTB runs all jobs one after another on the job queue thread.
+    Runs of the same job do not overlap.
+
+    :param name: Job name, also used as thread name
+    :param function: Callable doing the work
+    :param args: Arguments of function
+    :return: False if the previous run of the job is still going
+    """
+    with _background_lock:
+        thread = _background_jobs.get(name)
+        if thread is not None and thread.is_alive():
+            logger.warning(f'Skipping {name} job, its previous run is still going.')
+            return False
+        thread = threading.Thread(target=function, args=args, name=name, daemon=True)
+        _background_jobs[name] = thread
+        thread.start()
+    return True
 
 
 class Controller:
@@ -21,34 +142,64 @@ class Controller:
         :param dispatcher:
         """
         self.dispatcher = dispatcher
+        self.executor = None
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
 
     def register_handlers(self):
+        # JOB: Run handlers on the handler executor, ordered per chat
+        if config.ASYNC_HANDLERS:
+            executor = KeyedExecutor(config.HANDLER_WORKERS, config.HANDLER_QUEUE_SIZE,
+                                     error_callback=lambda args, e: self.dispatcher.dispatch_error(args[0], e))
+            self.executor = executor
+            wrap = executor.wrap
+        else:
+            wrap = lambda callback: callback
+
         # JOB: Create function handlers
-        start_handler = CommandHandler('start', start)
-        inline_handler = InlineQueryHandler(inline)
-        help_handler = CommandHandler('help', help)
-        today_handler = CommandHandler('today', today)
-        tomorrow_handler = CommandHandler('tomorrow', tomorrow)
-        schedule_handler = CommandHandler('schedule', schedule)
-        l6_today_handler = CommandHandler('l6_today', l6_today)
-        l6_tomorrow_handler = CommandHandler('l6_tomorrow', l6_today)
-        poll_handler = CommandHandler('daily_poll', daily_poll)
-        unknown_handler = MessageHandler(Filters.command, unknown)
+        start_handler = CommandHandler('start', wrap(start))
+        inline_handler = InlineQueryHandler(wrap(inline))
+        help_handler = CommandHandler('help', wrap(help))
+        today_handler = CommandHandler('today', wrap(today))
+        tomorrow_handler = CommandHandler('tomorrow', wrap(tomorrow))
+        schedule_handler = CommandHandler('schedule', wrap(schedule))
+        l6_today_handler = CommandHandler('l6_today', wrap(l6_today))
+        l6_tomorrow_handler = CommandHandler('l6_tomorrow', wrap(l6_today))
+        poll_handler = CommandHandler('daily_poll', wrap(daily_poll))
+        subscribe_handler = CommandHandler('subscribe', wrap(subscribe))
+        unsubscribe_handler = CommandHandler('unsubscribe', wrap(unsubscribe))
+        canteen_handler = CommandHandler('canteen', wrap(canteen))
+        location_handler = MessageHandler(Filters.location, wrap(location))
+        stats_handler = CommandHandler('stats', wrap(stats))
+        changes_handler = CommandHandler('changes', wrap(changes))
+        poll_stats_handler = CommandHandler('poll_stats', wrap(poll_stats))
+        unknown_handler = MessageHandler(Filters.command, wrap(unknown))
 
         # JOB: Add handlers to dispatcher
         self.dispatcher.add_handler(start_handler)
         self.dispatcher.add_handler(help_handler)
         self.dispatcher.add_handler(inline_handler)
-        self.dispatcher.add_handler(CallbackQueryHandler(button))
+        self.dispatcher.add_handler(CallbackQueryHandler(wrap(button)))
         self.dispatcher.add_handler(today_handler)
         self.dispatcher.add_handler(tomorrow_handler)
         self.dispatcher.add_handler(schedule_handler)
         self.dispatcher.add_handler(l6_today_handler)
         self.dispatcher.add_handler(l6_tomorrow_handler)
         self.dispatcher.add_handler(poll_handler)
+        self.dispatcher.add_handler(subscribe_handler)
+        self.dispatcher.add_handler(unsubscribe_handler)
+        self.dispatcher.add_handler(canteen_handler)
+        self.dispatcher.add_handler(location_handler)
+        self.dispatcher.add_handler(stats_handler)
+        self.dispatcher.add_handler(changes_handler)
+        self.dispatcher.add_handler(poll_stats_handler)
         self.dispatcher.add_handler(unknown_handler)
+        self.dispatcher.add_error_handler(error)
 
 
+@timed('start')
 def start(update, context):
     """
     Start bot
@@ -67,121 +218,454 @@ def start(update, context):
     update.message.reply_text('Please choose:', reply_markup=reply_markup)
 
 
-def get_daily_menu(update, context, chat_id, l6=False):
-    text = ''
-    mensa = Mensa()
+def build_daily_menu(mensa, offset, l6=False, next_open=True):
+    """
+    Build daily menu message
 
-    if context.user_data is not None:
-        offset = context.user_data['offset']
+    :param mensa: Mensa instance
+    :param offset: Day offset relative to today
+    :param l6: Build L6 view instead of regular lines
+    :param next_open: Show the next open day if the mensa is closed on the requested day
+    :return: Dict of send_message keyword arguments or None if the mensa is closed
+    """
+    today = datetime.date.today()
+    requested = today + datetime.timedelta(days=offset)
+    date = mensa.next_open_day(requested) if next_open else requested
+    if date is None or not mensa.is_open(date):
+        return None
+
+    text = render_menu(mensa, (date - today).days, date, l6=l6)
+    if date != requested:
+        text = f'<i>Closed on {requested.strftime("%A")}, showing the next open day.</i>\n{text}'
+
+    # context.bot.send_message(chat_id=chat_id,
+    #                          text=f'<a href="https://openmensa.org/c/31/{date}">Full menu</a>',
+    #                          parse_mode=telegram.ParseMode.HTML)
+
+    if offset == 0:
+        keyboard = [[InlineKeyboardButton('Tomorrow\'s Menu', callback_data='tomorrow'),
+                     InlineKeyboardButton('L6 Menu', callback_data='l6_today')],
+                    [InlineKeyboardButton('Schedule', callback_data='daily_poll')]]
     else:
-        offset = 0
-
-    if mensa.is_open(datetime.date.today() + datetime.timedelta(days=offset)):
-        date = (datetime.date.today() + datetime.timedelta(days=offset))
-
-        if not l6:
-            text = f'<b>{mensa.get_info().get("name")}</b> {emojize(":fork_and_knife:", use_aliases=True)}\n' \
-                   f'<b>Menu for {date.strftime("%A, %B %d, %Y")}</b>\n'
-            whitelist = ['Linie']
-
-        else:
-            print('L6')
-            whitelist = ['L6 Update']
+        keyboard = [[InlineKeyboardButton('Today\'s Menu', callback_data='today'),
+                     InlineKeyboardButton('L6 Menu', callback_data='l6_tomorrow')],
+                    [InlineKeyboardButton('Schedule', callback_data='daily_poll')]]
 
-        line_data = [(line, contents) for line, contents in
-                     mensa.meal_data_lines(offset=offset)]
-
-        for line, contents in line_data:
-            contents = contents.loc[line].reset_index().apply(
-                lambda
-                    x: f'▫ {x["name"]} {x["symbol"]}',
-                axis=1).tolist()  # TODO: Add number emojis to lines
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    return {'text': text, 'parse_mode': telegram.ParseMode.HTML, 'reply_markup': reply_markup}
 
-            if any(e in line for e in whitelist):
-                text += f'\n\n<b>{line}</b>:\n' + '\n'.join(contents)
 
-        text += f'\n\n<a href="https://openmensa.org/c/31/{date}">Full menu</a>'
+def get_mensa(chat_id) -> Mensa:
+    """
+    Get Mensa instance of the canteen picked by a chat
 
-        # context.bot.send_message(chat_id=chat_id,
-        #                          text=f'<a href="https://openmensa.org/c/31/{date}">Full menu</a>',
-        #                          parse_mode=telegram.ParseMode.HTML)
+    :param chat_id: Chat ID
+    :return: Mensa instance
+    """
+    return Mensa(chat_canteens.get(chat_id, config.DEFAULT_CANTEEN_ID))
 
-        if offset == 0:
-            keyboard = [[InlineKeyboardButton('Tomorrow\'s Menu', callback_data='tomorrow'),
-                         InlineKeyboardButton('L6 Menu', callback_data='l6_today')],
-                        [InlineKeyboardButton('Schedule', callback_data='daily_poll')]]
-        else:
-            keyboard = [[InlineKeyboardButton('Today\'s Menu', callback_data='today'),
-                         InlineKeyboardButton('L6 Menu', callback_data='l6_tomorrow')],
-                        [InlineKeyboardButton('Schedule', callback_data='daily_poll')]]
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        context.bot.send_message(chat_id=chat_id,
-                                 text=text,
-                                 parse_mode=telegram.ParseMode.HTML, reply_markup=reply_markup)
+def get_daily_menu(update, context, chat_id, offset=0, l6=False):
+    """
+    Send the daily menu of the chat's canteen
+
+    :param update: Update
+    :param context: Callback context
+    :param chat_id: Chat ID
+    :param offset: Day offset relative to today, passed along instead of kept in user_data, which is shared by
+                   the handlers of a user running concurrently in different chats
+    :param l6: Send L6 view instead of regular lines
+    """
+    mensa = get_mensa(chat_id)
+    message = build_daily_menu(mensa, offset, l6=l6)
+    if message is not None:
+        context.bot.send_message(chat_id=chat_id, **message)
+    else:
+        context.bot.send_message(chat_id=chat_id, text='The mensa is closed.')
 
 
+@timed('today')
 def today(update, context):
     """
     Show daily menu
     """
-    context.user_data['offset'] = 0
     get_daily_menu(update, context, chat_id=update.effective_chat.id)
 
 
+@timed('l6_today')
 def l6_today(update, context):
     """
     """
-    context.user_data['offset'] = 0
     get_daily_menu(update, context, chat_id=update.effective_chat.id, l6=True)
 
 
+@timed('l6_tomorrow')
 def l6_tomorrow(update, context):
     """
     """
-    context.user_data['offset'] = 1
-    get_daily_menu(update, context, chat_id=update.effective_chat.id, l6=True)
+    get_daily_menu(update, context, chat_id=update.effective_chat.id, offset=1, l6=True)
 
 
+@timed('tomorrow')
 def tomorrow(update, context):
     """
     Show daily menu
     """
-    context.user_data['offset'] = 1
-    get_daily_menu(update, context, update.effective_chat.id)
+    get_daily_menu(update, context, update.effective_chat.id, offset=1)
 
 
 def callback_daily_update(context: telegram.ext.CallbackContext):
-    get_daily_menu(update=None, context=context, chat_id=-1001463530288)
-    # get_daily_menu(update=None, context=context, chat_id=-1001316049000)
+    observe_job_lag('daily_update', DAILY_UPDATE_TIME)
+    # Broadcasting to all subscribers takes minutes, the job queue thread has to stay free for poll edits
+    run_in_background('DailyUpdate', send_daily_update, context.bot)
 
 
-def callback_daily_results(context: telegram.ext.CallbackContext):
-    if Mensa().is_open():
-        close_daily_poll(update=None, context=context)
+def send_daily_update(bot) -> None:
+    """
+    Send today's menu to all subscribed chats and unsubscribe chats the bot was removed from
 
+    :param bot: Bot instance
+    """
+    # Render each canteen's menu once for all chats subscribed to it
+    chats_by_canteen = {}
+    for chat_id in sorted(subscriptions):
+        chats_by_canteen.setdefault(chat_canteens.get(chat_id, config.DEFAULT_CANTEEN_ID), []).append(chat_id)
+
+    deliveries = []
+    for canteen_id, chat_ids in chats_by_canteen.items():
+        message = build_daily_menu(Mensa(canteen_id), offset=0, next_open=False)
+        if message is not None:
+            deliveries.extend((chat_id, message) for chat_id in chat_ids)
+
+    results = broadcaster.broadcast(bot, deliveries)
+    for chat_id in results['unauthorized']:
+        # Bot was removed from the chat or blocked
+        unsubscribe_chat(chat_id)
+    logger.info(f'Daily menu delivered to {len(results["delivered"])} of {len(subscriptions)} chats, '
+                f'{len(results["unauthorized"])} unsubscribed, {len(results["timed_out"])} timed out, '
+                f'{len(results["failed"])} failed.')
+
+
+def restore_subscriptions() -> int:
+    """
+    Load subscribed chats from the state store
+
+    :return: Number of subscribed chats
+    """
+    subscriptions.update(state_store.load_subscriptions(defaults=default_subscribers))
+    change_subscriptions.update(state_store.load_subscriptions(topic='changes'))
+    return len(subscriptions)
 
+
+def unsubscribe_chat(chat_id) -> None:
+    subscriptions.discard(chat_id)
+    state_store.save_subscription(chat_id, active=False)
+
+
+@timed('subscribe')
+def subscribe(update, context):
+    """
+    Subscribe chat to the daily menu
+    """
+    chat_id = update.effective_chat.id
+    subscriptions.add(chat_id)
+    state_store.save_subscription(chat_id)
+    context.bot.send_message(chat_id=chat_id, text='Subscribed to the daily menu.')
+
+
+@timed('unsubscribe')
+def unsubscribe(update, context):
+    """
+    Unsubscribe chat from the daily menu
+    """
+    unsubscribe_chat(update.effective_chat.id)
+    context.bot.send_message(chat_id=update.effective_chat.id, text='Unsubscribed from the daily menu.')
+
+
+@timed('changes')
+def changes(update, context):
+    """
+    Toggle notifications about changes of today's menu
+    """
+    chat_id = update.effective_chat.id
+    active = chat_id not in change_subscriptions
+    if active:
+        change_subscriptions.add(chat_id)
+    else:
+        change_subscriptions.discard(chat_id)
+    state_store.save_subscription(chat_id, active=active, topic='changes')
+    context.bot.send_message(chat_id=chat_id, text='You will be notified when today\'s menu changes.' if active
+                             else 'Menu change notifications turned off.')
+
+
+def callback_refresh_menus(context: telegram.ext.CallbackContext):
+    run_in_background('RefreshMenus', refresh_menus, context.bot)
+
+
+def refresh_menus(bot) -> None:
+    """
+    Revalidate the menus of the upcoming open days of every canteen in use and notify chats about changes of
+    today's menu
+
+    :param bot: Bot instance
+    """
+    today = datetime.date.today()
+    canteen_ids = {config.DEFAULT_CANTEEN_ID, *chat_canteens.values()}
+
+    def refresh(canteen_id):
+        mensa = Mensa(canteen_id)
+        results = []
+        for date in mensa.calendar().open_days(today, today + datetime.timedelta(days=config.REFRESH_DAYS - 1)):
+            try:
+                results.append((date, mensa.refresh_menu(date)))
+                menu_refreshes.inc('changed' if results[-1][1] is not None else 'unchanged')
+            except OpenMensaUnavailable as oue:
+                menu_refreshes.inc('failed')
+                logger.warning(f'Refreshing menu of canteen {canteen_id} for {date} failed: {oue}')
+        return mensa, results
+
+    try:
+        with ThreadPoolExecutor(max_workers=config.PREFETCH_WORKERS) as executor:
+            refreshed = list(executor.map(refresh, canteen_ids))
+    except OpenMensaUnavailable as oue:
+        logger.warning(f'Refreshing menus failed: {oue}')
+        return
+
+    deliveries = []
+    for mensa, results in refreshed:
+        for date, changed in results:
+            if changed is None or changed[0] is None or date != today:
+                continue
+            lines = diff_lines(*changed)
+            logger.info(f'Menu of canteen {mensa.id} for {date} changed in {len(lines)} lines.')
+            chat_ids = [chat_id for chat_id in change_subscriptions
+                        if chat_canteens.get(chat_id, config.DEFAULT_CANTEEN_ID) == mensa.id]
+            if lines and chat_ids:
+                message = {'text': render_menu_changes(mensa, date, lines), 'parse_mode': telegram.ParseMode.HTML}
+                deliveries.extend((chat_id, message) for chat_id in chat_ids)
+
+    if deliveries:
+        broadcaster.broadcast(bot, deliveries)
+
+
+def restore_chat_canteens() -> int:
+    """
+    Load the canteens picked by chats from the state store
+
+    :return: Number of chats with a picked canteen
+    """
+    chat_canteens.update(state_store.load_chat_canteens())
+    return len(chat_canteens)
+
+
+def set_chat_canteen(chat_id, canteen_id) -> None:
+    chat_canteens[chat_id] = canteen_id
+    state_store.save_chat_canteen(chat_id, canteen_id)
+
+
+def canteen_keyboard(canteens) -> InlineKeyboardMarkup:
+    """
+    Build keyboard with one button per canteen
+
+    :param canteens: List of (label, Canteen) tuples
+    :return: InlineKeyboardMarkup
+    """
+    return InlineKeyboardMarkup([[InlineKeyboardButton(label, callback_data=f'canteen_{canteen.id}')]
+                                 for label, canteen in canteens])
+
+
+@timed('canteen')
+def canteen(update, context):
+    """
+    Show the chat's canteen or search canteens by name
+    """
+    chat_id = update.effective_chat.id
+    if not context.args:
+        name = get_mensa(chat_id).mensa_name
+        context.bot.send_message(chat_id=chat_id,
+                                 text=f'Current canteen: {name}\n'
+                                      f'Use /canteen <name or city> or share a location to pick another one.')
+        return
+
+    matches = get_directory().search(' '.join(context.args))
+    if not matches:
+        context.bot.send_message(chat_id=chat_id, text='No canteen found.')
+        return
+
+    context.bot.send_message(chat_id=chat_id, text='Please choose your canteen:',
+                             reply_markup=canteen_keyboard([(match.name, match) for match in matches]))
+
+
+@timed('location')
+def location(update, context):
+    """
+    Offer the canteens closest to a shared location
+    """
+    shared = update.message.location
+    nearest = get_directory().nearest(shared.latitude, shared.longitude)
+    if not nearest:
+        context.bot.send_message(chat_id=update.effective_chat.id, text='No canteen found.')
+        return
+
+    context.bot.send_message(chat_id=update.effective_chat.id, text='Closest canteens:',
+                             reply_markup=canteen_keyboard([(f'{match.name} ({km:.1f} km)', match)
+                                                            for km, match in nearest]))
+
+
+def callback_archive_menus(context: telegram.ext.CallbackContext):
+    """
+    Archive today's menu of every canteen in use
+    """
+    observe_job_lag('archive_menus', ARCHIVE_TIME)
+    archive_menus(menu_archive, {config.DEFAULT_CANTEEN_ID, *chat_canteens.values()}, datetime.date.today())
+
+
+def archive_menus(archive, canteen_ids, date) -> None:
+    """
+    Archive the menu of a day of each canteen that is open and not archived for that day yet
+
+    :param archive: MenuArchive
+    :param canteen_ids: Canteen IDs
+    :param date: Date of the menus
+    """
+    for canteen_id in canteen_ids:
+        if archive.has_day(canteen_id, date):
+            continue
+        try:
+            mensa = Mensa(canteen_id)
+            if mensa.is_open(date):
+                rows = archive.append(canteen_id, date, mensa.get_menu(date))
+                logger.info(f'Archived {rows} meals of canteen {canteen_id}.')
+        except OpenMensaUnavailable as oue:
+            logger.warning(f'Archiving menu of canteen {canteen_id} failed: {oue}')
+
+
+@timed('stats')
+def stats(update, context):
+    """
+    Show price trend, diet frequency per line and most frequent dishes of the chat's canteen,
+    optionally for another diet than vegan, e.g. /stats vegetarian
+    """
+    chat_id = update.effective_chat.id
+    diet = DIET_ALIASES.get(context.args[0].lower()) if context.args else 'vegan'
+    if diet is None:
+        context.bot.send_message(chat_id=chat_id, text=f'Unknown diet "{context.args[0]}", '
+                                                       f'valid options are: {", ".join(DIET_ALIASES)}')
+        return
+
+    mensa = get_mensa(chat_id)
+    summary = menu_archive.summary(mensa.id)
+    if not summary['days']:
+        context.bot.send_message(chat_id=chat_id, text='No menus archived yet.')
+        return
+
+    start = datetime.date.today() - datetime.timedelta(days=365)
+
+    text = f'<b>{html.escape(str(mensa.mensa_name))}</b>\n' \
+           f'{summary["days"]} days archived, {summary["first"]:%d.%m.%Y} to {summary["last"]:%d.%m.%Y}\n\n' \
+           f'<b>Student price of mains per month</b>\n'
+    text += '\n'.join(f'{month}: {mean:.2f} € ({low:.2f} to {high:.2f} €)'
+                      for month, mean, low, high, _ in menu_archive.price_trend(mensa.id, start=start))
+    text += f'\n\n<b>Days with a {diet} main</b>\n'
+    text += '\n'.join(f'{html.escape(line)}: {matched} of {days} ({matched / days:.0%})'
+                      for line, matched, days in menu_archive.line_frequency(mensa.id, DIETS[diet]))
+    text += '\n\n<b>Most frequent mains</b>\n'
+    text += '\n'.join(f'{count}× {html.escape(name)}' for name, count in menu_archive.top_dishes(mensa.id))
+
+    context.bot.send_message(chat_id=chat_id, text=text, parse_mode=telegram.ParseMode.HTML)
+
+
+@timed('poll_stats')
+def poll_stats(update, context):
+    """
+    Show attendance, most popular time per weekday and today's predicted time of the chat's past polls
+    """
+    chat_id = update.effective_chat.id
+    summary = poll_archive.summary(chat_id)
+    # Polls bringing the chat's option labels above what the archive holds are not archived
+    skipped = f'{summary["skipped"]} polls not archived, this chat used more than 64 different options.' \
+        if summary['skipped'] else None
+    if not summary['polls']:
+        context.bot.send_message(chat_id=chat_id, text='No closed polls yet.' + (f'\n{skipped}' if skipped else ''))
+        return
+
+    today = datetime.datetime.now(POLL_CLOSE_TIME.tzinfo).date()
+    text = f'<b>Poll statistics</b>\n{summary["polls"]} polls since {summary["first"]:%d.%m.%Y}\n'
+    if skipped:
+        text += f'{skipped}\n'
+    text += '\n<b>Attendance</b>\n'
+    text += '\n'.join(f'{html.escape(name)}: {attended} of {eligible} ({rate:.0%})'
+                      for name, attended, eligible, rate in poll_archive.attendance(chat_id)[:10])
+    text += '\n\n<b>Most popular time</b>\n'
+    text += '\n'.join(f'{WEEKDAYS[weekday]}: {option} ({votes} votes in {polls} polls)'
+                      for weekday, (option, votes, polls) in sorted(poll_archive.popular_slots(chat_id).items()))
+    text += f'\n\n<b>Predicted time today</b>: {poll_archive.predict_slot(chat_id, today) or "-"}'
+
+    context.bot.send_message(chat_id=chat_id, text=text, parse_mode=telegram.ParseMode.HTML)
+
+
+def callback_prefetch_menus(context: telegram.ext.CallbackContext):
+    run_in_background('PrefetchMenus', prefetch_menus)
+
+
+def prefetch_menus() -> None:
+    # Canteens are shared by all chats picking them, so every canteen in use is fetched once
+    canteen_ids = {config.DEFAULT_CANTEEN_ID, *chat_canteens.values()}
+    try:
+        get_directory()
+        menus = {canteen_id: Mensa(canteen_id).prefetch(days=config.PREFETCH_DAYS) for canteen_id in canteen_ids}
+    except OpenMensaUnavailable as oue:
+        logger.warning(f'Prefetching menus failed: {oue}')
+        return
+    logger.info(f'Prefetched menus for {sum(map(len, menus.values()))} days of {len(menus)} canteens.')
+
+
+def callback_close_poll(context: telegram.ext.CallbackContext):
+    chat_id, message_id = context.job.context
+    observe_job_lag('close_poll', POLL_CLOSE_TIME)
+    close_daily_poll(context, chat_id, message_id)
+
+
+def callback_evict_polls(context: telegram.ext.CallbackContext):
+    removed = poll_registry.evict(closed_after=config.POLL_CLOSED_RETENTION, stale_after=config.POLL_STALE_AFTER)
+    state_store.prune()
+    logger.info(f'Evicted {removed} polls, {len(poll_registry)} remaining.')
+
+
+@timed('daily_poll')
 def daily_poll(update, context):
     """
     Send daily_poll
     """
 
-    schedule(update, context)
+    send_poll(update, context)
 
 
+@timed('schedule')
 def schedule(update, context):
-    if config.CURRENT_POLL is not None:
-        if not config.CURRENT_POLL.active:
-            return
+    send_poll(update, context)
+
 
+def send_poll(update, context):
+    """
+    Send a scheduling poll to the chat of update and schedule its close job; not timed itself, so each handler
+    calling it is observed once
+
+    :param update: Update of the command or button press
+    :param context: Callback context
+    """
+    chat_id = update.effective_chat.id
     options = ['11:40 Uhr', '12:10 Uhr', '12:40 Uhr', '13:10 Uhr', '13:30 Uhr', '13:50 Uhr']
-    context.chat_data['options'] = options
+
+    today = datetime.datetime.now(POLL_CLOSE_TIME.tzinfo).date()
+    predicted = poll_archive.predict_slot(chat_id, today)
 
     n_rows = ceil(len(options) / 3)
     keyboard = [[] for _ in range(n_rows)]
     for num, option in enumerate(options):
         row_index = num // 3
-        keyboard[row_index].append(InlineKeyboardButton(option, callback_data=f'option_{num}'))
+        label = f'⭐ {option}' if option == predicted else option
+        keyboard[row_index].append(InlineKeyboardButton(label, callback_data=f'option_{num}'))
 
     keyboard.append([InlineKeyboardButton('Delete all', callback_data=f'option_delete')])
     keyboard.append([InlineKeyboardButton('Flexible', callback_data=f'option_flexible'),
@@ -189,60 +673,112 @@ def schedule(update, context):
 
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    context.chat_data['current_poll'] = PollData(options)
-    config.CURRENT_POLL = context.chat_data['current_poll']
-    config.CURRENT_POLL_ACTIVE = True
+    text = 'Please choose your preferred times:'
+    if predicted in options:
+        text += f'\n⭐ Usual choice on {WEEKDAYS[today.weekday()]}s'
+    message = context.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+
+    poll = PollData(options)
+    previous = poll_registry.get_active(chat_id)
+    poll_registry.register(chat_id, message.message_id, poll)
+    if previous is not None:
+        state_store.save_poll(chat_id, previous[0], previous[1])
+    state_store.save_poll(chat_id, message.message_id, poll)
+    context.job_queue.run_once(callback_close_poll, when=POLL_CLOSE_TIME, context=(chat_id, message.message_id))
 
-    message = context.bot.send_message(chat_id=update.effective_chat.id, text='Please choose your preferred times:',
-                                       reply_markup=reply_markup)
 
-    config.CURRENT_POLL_ID = message.message_id
-    config.CHAT_ID = update.effective_chat.id
+def restore_polls(job_queue) -> int:
+    """
+    Restore active polls from the state store and schedule their close jobs
+
+    :param job_queue: Job queue of the updater
+    :return: Number of restored polls
+    """
+    polls = state_store.load_active_polls()
+    for chat_id, message_id, options, show_out, created, votes in polls:
+        poll = PollData(options)
+        poll.restore(votes, show_out)
+        poll_registry.register(chat_id, message_id, poll)
+        job_queue.run_once(callback_close_poll, when=restored_poll_close_time(created), context=(chat_id, message_id))
+
+    return len(polls)
+
+
+def restored_poll_close_time(created, now=None):
+    """
+    Get when to close a restored poll.
+    Polls that missed their close time while the bot was down are closed right away; a time of day that has passed
+    would only close them tomorrow.
+
+    :param created: Creation timestamp of the poll
+    :param now: Current datetime with timezone, defaults to now
+    :return: POLL_CLOSE_TIME for polls created today before their close time, otherwise 0
+    """
+    tz = POLL_CLOSE_TIME.tzinfo
+    now = now if now is not None else datetime.datetime.now(tz)
+    close_at = tz.localize(datetime.datetime.combine(now.astimezone(tz).date(), POLL_CLOSE_TIME.replace(tzinfo=None)))
+    created_at = datetime.datetime.fromtimestamp(created, tz)
+    return POLL_CLOSE_TIME if created_at.date() == close_at.date() and now < close_at else 0
 
 
 def close_poll(update, context):
-    return context.bot.stop_poll(chat_id=update.effective_chat.id, message_id=config.CURRENT_POLL.message_id)
+    active = poll_registry.get_active(update.effective_chat.id)
+    if active is not None:
+        return context.bot.stop_poll(chat_id=update.effective_chat.id, message_id=active[0])
+
 
+def close_daily_poll(context, chat_id, message_id):
+    poll = poll_registry.close(chat_id, message_id)
+    if poll is None:
+        return
+    state_store.save_poll(chat_id, message_id, poll)
 
-def close_daily_poll(update, context):
     message = 'Final polling results:\n' \
-              f'{config.CURRENT_POLL.get_results()}\n\n' \
-              f'{config.CURRENT_POLL.get_final_choice()}'
+              f'{poll.get_results()}\n\n' \
+              f'{poll.get_final_choice()}'
+    edit_coalescer.cancel(chat_id=chat_id, message_id=message_id)
     try:
-        context.bot.edit_message_text(chat_id=config.CHAT_ID, message_id=config.CURRENT_POLL_ID,
+        context.bot.edit_message_text(chat_id=chat_id, message_id=message_id,
                                       text=message,
                                       reply_markup=None, parse_mode=telegram.ParseMode.HTML)
     except telegram.error.BadRequest as bre:
-        print('Message did not change.')
+        telegram_errors.inc('BadRequest')
+        logger.debug('Message did not change.')
 
-    config.CURRENT_POLL.active = False
+    # Archived after the final results are posted, a poll the archive cannot take must not keep them from the chat
+    try:
+        poll_archive.append(chat_id, message_id, datetime.datetime.now(POLL_CLOSE_TIME.tzinfo).date(), poll)
+    except ValueError as ve:
+        logger.warning(f'Poll {message_id} of chat {chat_id} was not archived: {ve}')
 
 
+@timed('inline')
 def inline(update, context):
     """
-    Example for inline capabilities
+    Search the dishes of the upcoming week
     """
     query = update.inline_query.query
-    if not query:
-        return
+    logger.debug('Inline query: %s', query)
 
-    print(query)
-    results = list()
-    results.append(
-        InlineQueryResultArticle(
-            id=query,
-            title='/schedule',
-            input_message_content=InputTextMessageContent(query)
-        )
-    )
-    context.bot.answer_inline_query(update.inline_query.id, results)
+    index = get_index(get_mensa(update.inline_query.from_user.id))  # Private chat IDs equal user IDs
+    results = [InlineQueryResultArticle(id=f'{date}-{meal.id}',
+                                        title=f'{meal.name} {meal.symbol}'.strip(),
+                                        description=f'{date.strftime("%a, %d.%m.")} · {meal.line} · {meal.price}',
+                                        input_message_content=InputTextMessageContent(
+                                            f'<b>{date.strftime("%A, %B %d")}</b>, {meal.line}:\n'
+                                            f'{meal.name} {meal.symbol} ({meal.price})',
+                                            parse_mode=telegram.ParseMode.HTML))
+               for date, meal in index.search(query, limit=config.INLINE_MAX_RESULTS)]
+    context.bot.answer_inline_query(update.inline_query.id, results, cache_time=config.INLINE_CACHE_TIME)
 
 
+@timed('help')
 def help(update, context):
     update.message.reply_text('Help!')
     # context.bot.send_message(chat_id=update.effective_chat.id, text='Test')
 
 
+@timed('button')
 def button(update, context) -> None:
     """
     Handle button press
@@ -268,54 +804,58 @@ def button(update, context) -> None:
         context.bot.send_message(chat_id=update.effective_chat.id, text='Showing tomorrow\'s L6 menu.')
         l6_tomorrow(update, context)
 
+    elif query.data.startswith('canteen_'):
+        chat_id = update.effective_chat.id
+        set_chat_canteen(chat_id, int(query.data[len('canteen_'):]))
+        context.bot.send_message(chat_id=chat_id, text=f'Canteen set to {get_mensa(chat_id).mensa_name}.')
+
     elif query.data.startswith('option'):
         # print(query)
-        if not context.chat_data['current_poll'].active:
-            return
-
-        option_list = context.chat_data['options']
-        option_chosen = query.data.split('_')[-1]
-
-        # JOB: Register vote
-        if is_int(option_chosen):
-            option_chosen = int(option_chosen)
-            context.chat_data['current_poll'].set_choice(user_first_name=query.from_user.first_name,
-                                                         option=option_list[option_chosen])
-        else:
-            if option_chosen == 'declined':
-                context.chat_data['current_poll'].data.loc[
-                    query.from_user.first_name, 'Out'] = 1
-                context.chat_data['current_poll'].delete_user(query.from_user.first_name, times_only=True)
-            elif option_chosen == 'delete':
-                context.chat_data['current_poll'].delete_user(query.from_user.first_name)
-            elif option_chosen == 'flexible':
-                context.chat_data['current_poll'].checkall_user(query.from_user.first_name)
+        chat_id = update.effective_chat.id
+        with poll_registry.lock(chat_id):
+            poll = poll_registry.get(chat_id, query.message.message_id)
+            if poll is None or not poll.active:
+                return
+
+            option_chosen = query.data.split('_')[-1]
+
+            # JOB: Register vote
+            user = query.from_user
+            if is_int(option_chosen):
+                option_chosen = int(option_chosen)
+                poll.set_choice(user_first_name=user.first_name, option=poll.options[option_chosen],
+                                user_id=user.id)
+            else:
+                if option_chosen == 'declined':
+                    poll.decline_user(user.first_name, user_id=user.id)
+                elif option_chosen == 'delete':
+                    poll.delete_user(user.first_name, user_id=user.id)
+                elif option_chosen == 'flexible':
+                    poll.checkall_user(user.first_name, user_id=user.id)
+
+            state_store.save_vote(chat_id, query.message.message_id, *poll.get_vote(user.first_name, user_id=user.id))
+            results = poll.get_results()
 
         # context.bot.send_message(chat_id=update.effective_chat.id, text=f'*{query.from_user.username}: {query.data}*',
         #                          parse_mode=telegram.ParseMode.MARKDOWN)
 
         message = 'Live polling:\n' \
-                  f'{context.chat_data["current_poll"].get_results()}\n' \
+                  f'{results}\n' \
                   f'Polling closes at 11:00 a.m.'
-        try:
-            context.bot.edit_message_text(chat_id=update.effective_chat.id, message_id=query.message.message_id,
-                                          text=message,
-                                          reply_markup=query.message.reply_markup, parse_mode=telegram.ParseMode.HTML)
-        except telegram.error.BadRequest as bre:
-            print('Message did not change.')
-
-        except telegram.error.TimedOut as toe:
-            context.bot.send_message(chat_id=update.effective_chat.id,
-                                     text=f'Timed out. Request sent by {query.from_user.first_name}',
-                                     parse_mode=telegram.ParseMode.MARKDOWN)
-
-            context.bot.send_message(chat_id=update.effective_chat.id,
-                                     text=f'Error message: {toe}',
-                                     parse_mode=telegram.ParseMode.MARKDOWN)
-
-            print(toe.message)
-            print(toe.message)
+        edit_coalescer.submit(context, chat_id=update.effective_chat.id, message_id=query.message.message_id,
+                              text=message, reply_markup=query.message.reply_markup,
+                              parse_mode=telegram.ParseMode.HTML)
 
 
+@timed('unknown')
 def unknown(update, context):
     context.bot.send_message(chat_id=update.effective_chat.id, text='Sorry, I didn\'t understand that command.')
+
+
+def error(update, context):
+    """
+    Log errors raised by handlers and count Telegram API errors
+    """
+    if isinstance(context.error, telegram.error.TelegramError):
+        telegram_errors.inc(type(context.error).__name__)
+    logger.warning(f'Update {update} caused error: {context.error!r}')
@@ -0,0 +1,117 @@
+import logging
+import threading
+
+import telegram
+
+import config
+from model.cache import TTLCache
+from utils.metrics import telegram_errors
+
+logger = logging.getLogger(__name__)
+
+
+class EditCoalescer:
+    """
+    Coalesces edits of the same message arriving within a short window into a single edit of the latest text.
+    Edits that would not change the message are skipped and flood waits or timeouts are retried with backoff.
+    """
+
+    def __init__(self, window=config.EDIT_COALESCE_WINDOW, max_retries=config.EDIT_MAX_RETRIES,
+                 backoff_max=config.EDIT_BACKOFF_MAX):
+        """
+        Constructor for EditCoalescer instance
+
+        :param window: Seconds to wait for further edits before sending
+        :param max_retries: Maximum number of retries after flood waits or timeouts
+        :param backoff_max: Upper bound for the retry delay in seconds
+        """
+        self.window = window
+        self.max_retries = max_retries
+        self.backoff_max = backoff_max
+        self.sent = 0
+        self.skipped = 0
+        self.retried = 0
+
+        self._pending = {}  # (chat_id, message_id) -> edit kwargs
+        self._scheduled = set()
+        self._last_sent = TTLCache(max_size=1024)  # (chat_id, message_id) -> last text sent
+        self._lock = threading.Lock()
+
+    def submit(self, context, chat_id, message_id, text, reply_markup=None, parse_mode=None) -> None:
+        """
+        Queue an edit of a message, replacing any edit of the same message not sent yet
+
+        :param context: Callback context providing bot and job queue
+        :param chat_id: Chat ID
+        :param message_id: Message ID
+        :param text: New message text
+        :param reply_markup: Reply markup to keep on the message
+        :param parse_mode: Parse mode of text
+        """
+        key = (chat_id, message_id)
+        with self._lock:
+            self._pending[key] = {'chat_id': chat_id, 'message_id': message_id, 'text': text,
+                                  'reply_markup': reply_markup, 'parse_mode': parse_mode}
+            if key in self._scheduled:
+                return
+            self._scheduled.add(key)
+
+        context.job_queue.run_once(self._flush, when=self.window, context=(key, 0))
+
+    def cancel(self, chat_id, message_id) -> None:
+        """
+        Drop an edit not sent yet, e.g. before the message is edited directly
+
+        :param chat_id: Chat ID
+        :param message_id: Message ID
+        """
+        with self._lock:
+            self._pending.pop((chat_id, message_id), None)
+
+    def _flush(self, context) -> None:
+        key, attempt = context.job.context
+        with self._lock:
+            edit = self._pending.pop(key, None)
+
+        if edit is not None and self._last_sent.get(key) == edit['text']:
+            self.skipped += 1
+        elif edit is not None:
+            try:
+                context.bot.edit_message_text(**edit)
+            except telegram.error.RetryAfter as rae:
+                telegram_errors.inc('RetryAfter')
+                self._retry(context, key, edit, attempt, delay=rae.retry_after)
+                return
+            except telegram.error.TimedOut:
+                telegram_errors.inc('TimedOut')
+                self._retry(context, key, edit, attempt, delay=min(self.window * 2 ** (attempt + 1), self.backoff_max))
+                return
+            except telegram.error.BadRequest as bre:
+                telegram_errors.inc('BadRequest')
+                logger.debug('Message %s not edited: %s', key, bre.message)
+            else:
+                self.sent += 1
+            self._last_sent.set(key, edit['text'], ttl=config.EDIT_LAST_SENT_TTL)
+
+        with self._lock:
+            if key not in self._pending:
+                self._scheduled.discard(key)
+                return
+        context.job_queue.run_once(self._flush, when=self.window, context=(key, 0))
+
+    def _retry(self, context, key, edit, attempt, delay) -> None:
+        with self._lock:
+            if attempt >= self.max_retries:
+                logger.warning(f'Giving up editing message {key} after {attempt} retries.')
+                if key not in self._pending:
+                    self._scheduled.discard(key)
+                    return
+                attempt = -1
+            else:
+                self._pending.setdefault(key, edit)  # Keep newer edits submitted in the meantime
+                self.retried += 1
+
+        context.job_queue.run_once(self._flush, when=delay, context=(key, attempt + 1))
+
+    def stats(self) -> dict:
+        return {'sent': self.sent, 'skipped': self.skipped, 'retried': self.retried, 'pending': len(self._pending)}
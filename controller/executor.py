@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+handler_wait = registry.histogram('mensabot_handler_wait_seconds', 'Time updates wait for a handler worker',
+                                  buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0))
+
+
+class KeyedExecutor:
+    """
+    Bounded thread pool running tasks asynchronously while tasks with the same key (e.g. chat ID) run one at a
+    time in submission order. Submitting blocks while the maximum number of pending tasks is reached.
+    """
+
+    def __init__(self, max_workers, max_pending, error_callback=None):
+        """
+        Constructor for KeyedExecutor instance
+
+        :param max_workers: Number of worker threads
+        :param max_pending: Maximum number of queued and running tasks
+        :param error_callback: Callable receiving (task args, exception) for tasks that raised
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.error_callback = error_callback
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='Handler')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._queues = {}  # key -> deque of (enqueued_at, function, args); present while key is scheduled
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+
+        registry.gauge('mensabot_handler_queue_depth', 'Handler tasks queued or running', lambda: self._pending)
+
+    def submit(self, key, function, *args) -> None:
+        """
+        Queue function(*args) behind all earlier tasks with the same key
+
+        :param key: Ordering key
+        :param function: Callable
+        :param args: Arguments of function
+        """
+        self._slots.acquire()
+        with self._lock:
+            self._pending += 1
+            tasks = self._queues.get(key)
+            if tasks is not None:
+                tasks.append((time.perf_counter(), function, args))
+                return
+            self._queues[key] = deque([(time.perf_counter(), function, args)])
+        self._pool.submit(self._run, key)
+
+    def _run(self, key) -> None:
+        with self._lock:
+            enqueued_at, function, args = self._queues[key].popleft()
+        handler_wait.observe(time.perf_counter() - enqueued_at)
+
+        try:
+            function(*args)
+        except Exception as e:
+            if self.error_callback is not None:
+                self.error_callback(args, e)
+            else:
+                logger.exception(f'Task for {key} failed')
+        finally:
+            with self._lock:
+                self._pending -= 1
+                more = len(self._queues[key]) > 0
+                if not more:
+                    del self._queues[key]
+                if self._pending == 0:
+                    self._idle.notify_all()
+            self._slots.release()
+
+        # Requeue instead of looping, so a busy chat does not hold on to a worker
+        if more:
+            self._pool.submit(self._run, key)
+
+    def wrap(self, callback):
+        """
+        Wrap handler callback so it runs on the executor, ordered per chat
+
+        :param callback: Handler callback taking (update, context)
+        :return: Wrapped callback returning immediately
+        """
+
+        @wraps(callback)
+        def wrapper(update, context):
+            self.submit(_ordering_key(update), callback, update, context)
+
+        return wrapper
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'pending': self._pending, 'keys': len(self._queues), 'max_pending': self.max_pending,
+                    'workers': self.max_workers}
+
+    def shutdown(self, wait=True) -> None:
+        """
+        Stop the worker threads
+
+        :param wait: Wait until all queued tasks have run
+        """
+        if wait:
+            with self._lock:
+                self._idle.wait_for(lambda: self._pending == 0)
+        self._pool.shutdown(wait=wait)
+
+
+def _ordering_key(update):
+    if update.effective_chat is not None:
+        return 'chat', update.effective_chat.id
+    if update.effective_user is not None:
+        return 'user', update.effective_user.id
+    return 'update', update.update_id
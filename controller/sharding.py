@@ -0,0 +1,180 @@
+import logging
+import multiprocessing
+import os
+import threading
+
+import requests
+from telegram import Update
+
+import config
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+routed_updates = registry.counter('mensabot_routed_updates_total', 'Updates routed to shard processes',
+                                  labels=('shard',))
+
+# Paths to the chat of an update, in order of precedence. Inline queries and callback queries of inline messages
+# have no chat and are routed by user, which is the private chat of that user.
+_CHAT_PATHS = (('message', 'chat'), ('edited_message', 'chat'), ('channel_post', 'chat'),
+               ('edited_channel_post', 'chat'), ('callback_query', 'message', 'chat'), ('callback_query', 'from'),
+               ('inline_query', 'from'), ('chosen_inline_result', 'from'), ('poll_answer', 'user'))
+
+
+def shard_of(chat_id, shards) -> int:
+    """
+    Get the shard owning a chat
+
+    :param chat_id: Chat ID
+    :param shards: Number of shards
+    :return: Shard index
+    """
+    return chat_id % shards
+
+
+def shard_dir(shard) -> str:
+    return os.path.join(config.SHARD_DIR, str(shard))
+
+
+def update_chat_id(data):
+    """
+    Get the ID of the chat an undecoded update belongs to
+
+    :param data: Update as decoded JSON
+    :return: Chat ID or None for updates without chat, e.g. poll state updates
+    """
+    for path in _CHAT_PATHS:
+        value = data
+        for name in path:
+            value = value.get(name) if isinstance(value, dict) else None
+        if isinstance(value, dict) and 'id' in value:
+            return value['id']
+    return None
+
+
+class ShardRouter:
+    """
+    Front of the sharded mode: starts one worker process per shard and routes undecoded updates to the worker
+    owning their chat through bounded queues, so all updates of a chat are handled in order by one process.
+    """
+
+    def __init__(self, shards, target, args=(), queue_size=config.SHARD_QUEUE_SIZE):
+        """
+        Constructor for ShardRouter instance
+
+        :param shards: Number of worker processes
+        :param target: Worker function called as target(shard, shards, updates, *args) in a new process
+        :param args: Further picklable arguments of target
+        :param queue_size: Maximum number of updates waiting for each worker
+        """
+        context = multiprocessing.get_context('spawn')  # Workers must not inherit threads or open connections
+        self.shards = shards
+        self.queues = [context.Queue(maxsize=queue_size) for _ in range(shards)]
+        self.processes = [context.Process(target=target, args=(shard, shards, self.queues[shard], *args),
+                                          name=f'Shard-{shard}') for shard in range(shards)]
+        registry.gauge('mensabot_shard_queue_depth', 'Updates waiting for a shard process',
+                       lambda: {(str(shard),): updates.qsize() for shard, updates in enumerate(self.queues)},
+                       labels=('shard',))
+
+    def start(self) -> 'ShardRouter':
+        for process in self.processes:
+            process.start()
+        return self
+
+    def put(self, data, timeout=None) -> None:
+        """
+        Route an update to the worker owning its chat
+
+        :param data: Update as decoded JSON
+        :param timeout: Seconds to wait for space in a full queue, None to wait indefinitely
+        :raises queue.Full: If the queue of the worker stays full
+        """
+        chat_id = update_chat_id(data)
+        shard = shard_of(chat_id, self.shards) if chat_id is not None else 0
+        self.queues[shard].put(data, timeout=timeout)
+        routed_updates.inc(str(shard))
+
+    def stop(self, timeout=30) -> None:
+        """
+        Let the workers handle all queued updates, then wait for them to shut down
+
+        :param timeout: Seconds to wait for each worker before terminating it
+        """
+        for updates in self.queues:
+            updates.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f'Terminating {process.name} after {timeout} s')
+                process.terminate()
+
+
+def poll_updates(router, token, stopped, timeout=config.POLLING_TIMEOUT) -> None:
+    """
+    Long poll the Bot API for updates and route them without decoding, until stopped is set.
+    An update is confirmed to Telegram with the next request once it is queued for its worker.
+
+    :param router: ShardRouter
+    :param token: Bot token
+    :param stopped: threading.Event ending the loop
+    :param timeout: Long polling timeout in seconds
+    """
+    session = requests.Session()
+    url = f'{config.TELEGRAM_API_URL}{token}/getUpdates'
+    offset = None
+    backoff = 1
+    while not stopped.is_set():
+        try:
+            response = session.post(url, json={'offset': offset, 'timeout': timeout}, timeout=timeout + 10)
+            response.raise_for_status()
+            updates = response.json()['result']
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logger.warning(f'Polling for updates failed, retrying in {backoff} s: {e!r}')
+            stopped.wait(backoff)
+            backoff = min(2 * backoff, 30)
+            continue
+
+        backoff = 1
+        for data in updates:
+            router.put(data)
+            offset = data['update_id'] + 1
+
+
+def feed_dispatcher(updates, bot, update_queue) -> None:
+    """
+    Decode updates routed to this worker and put them on the dispatcher's update queue until the router stops
+
+    :param updates: Queue of the worker
+    :param bot: Bot instance used to decode updates
+    :param update_queue: Update queue of the dispatcher
+    """
+    while True:
+        data = updates.get()
+        if data is None:
+            return
+        try:
+            update_queue.put(Update.de_json(data, bot))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f'Dropping invalid update: {e!r}')
+
+
+def start_snapshot_publisher(publish, stopped, interval=config.SNAPSHOT_INTERVAL) -> threading.Thread:
+    """
+    Run publish now and then every interval seconds on a background thread until stopped is set
+
+    :param publish: Callable without arguments refreshing the menu snapshot
+    :param stopped: threading.Event ending the loop
+    :param interval: Seconds between runs
+    :return: Started thread
+    """
+    def run():
+        while not stopped.is_set():
+            try:
+                publish()
+            except Exception as e:
+                logger.error(f'Publishing menu snapshot failed: {e!r}')
+            stopped.wait(interval)
+
+    thread = threading.Thread(target=run, name='SnapshotPublisher', daemon=True)
+    thread.start()
+    return thread
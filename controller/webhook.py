@@ -0,0 +1,130 @@
+import json
+import logging
+import queue
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Update
+
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+webhook_updates = registry.counter('mensabot_webhook_updates_total', 'Updates received by the webhook listener',
+                                   labels=('status',))
+
+
+class WebhookServer:
+    """
+    Local HTTP listener receiving Telegram updates as JSON POST requests and putting them on the update queue.
+    When the bounded update queue stays full, requests are rejected with 503 so Telegram retries them later.
+    """
+
+    def __init__(self, bot, update_queue, host, port, path, put_timeout=1.0, decode=None):
+        """
+        Constructor for WebhookServer instance
+
+        :param bot: Bot instance used to decode updates
+        :param update_queue: Update queue of the dispatcher
+        :param host: Host to listen on
+        :param port: Port to listen on, 0 picks a free port
+        :param path: URL path updates are posted to
+        :param put_timeout: Seconds to wait for space in a full update queue before rejecting an update
+        :param decode: Callable turning the posted JSON into the queued item, defaults to decoding an Update
+        """
+        self.bot = bot
+        self.update_queue = update_queue
+        self.path = '/' + path.strip('/')
+        self.put_timeout = put_timeout
+        self.decode = decode if decode is not None else lambda data: Update.de_json(data, bot)
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}{self.path}'
+
+    def _handler_class(self):
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != webhook.path:
+                    webhook_updates.inc('not_found')
+                    self.send_error(404)
+                    return
+                try:
+                    data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+                    if not isinstance(data, dict) or 'update_id' not in data:
+                        raise KeyError('update_id')
+                    update = webhook.decode(data)
+                except (ValueError, KeyError, TypeError) as e:
+                    webhook_updates.inc('invalid')
+                    logger.warning(f'Received invalid update: {e!r}')
+                    self.send_error(400)
+                    return
+
+                try:
+                    webhook.update_queue.put(update, timeout=webhook.put_timeout)
+                except queue.Full:
+                    webhook_updates.inc('rejected')
+                    self.send_response(503)
+                    self.send_header('Retry-After', '1')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                webhook_updates.inc('accepted')
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> 'WebhookServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='WebhookServer', daemon=True)
+        self._thread.start()
+        logger.info(f'Listening for updates on {self.url}')
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def run_webhook(updater, host, port, path, put_timeout=1.0, webhook_url=None) -> None:
+    """
+    Serve updates through the local webhook listener until SIGINT or SIGTERM is received
+
+    :param updater: Updater whose dispatcher and job queue process the updates
+    :param host: Host to listen on
+    :param port: Port to listen on
+    :param path: URL path updates are posted to
+    :param put_timeout: Seconds to wait for space in a full update queue
+    :param webhook_url: Public base URL registered with Telegram, None to skip registration (e.g. local testing)
+    """
+    server = WebhookServer(updater.bot, updater.update_queue, host, port, path, put_timeout=put_timeout)
+
+    updater.job_queue.start()
+    dispatcher_thread = threading.Thread(target=updater.dispatcher.start, name='Dispatcher', daemon=True)
+    dispatcher_thread.start()
+    server.start()
+
+    if webhook_url is not None:
+        updater.bot.set_webhook(url=f'{webhook_url.rstrip("/")}{server.path}')
+
+    stopped = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stopped.set())
+    stopped.wait()
+
+    logger.info('Stopping webhook listener ...')
+    server.stop()
+    updater.job_queue.stop()
+    updater.dispatcher.stop()
+    dispatcher_thread.join()
@@ -4,14 +4,107 @@ KIT Mensa Bot
 import datetime
 import logging
 import os
+import signal
+import threading
+import time
+from queue import Queue
+
+from utils.utils import PhaseTimer
+
+startup_timer = PhaseTimer()
 
 import pytz
 from colorama import Fore, Style
-from telegram.ext import Updater
+from telegram import Bot
+from telegram.ext import Dispatcher, JobQueue, Updater
+from telegram.utils.request import Request
+
+startup_timer.mark('import telegram')
 
 import config
-from controller.controller import callback_daily_update, Controller, callback_daily_results
+from controller.controller import callback_daily_update, Controller, callback_evict_polls, callback_prefetch_menus, \
+    callback_archive_menus, callback_refresh_menus, configure_shard, restore_polls, restore_subscriptions, \
+    open_state, restore_chat_canteens, archive_menus, ARCHIVE_TIME, DAILY_UPDATE_TIME
+from controller.sharding import feed_dispatcher, poll_updates, shard_dir, start_snapshot_publisher, ShardRouter
+from controller.webhook import run_webhook, WebhookServer
+from model.archive import MenuArchive
+from model.client import OpenMensaClient, OpenMensaUnavailable
+from model.directory import get_directory
 from model.model import Mensa
+from model.snapshot import MenuSnapshot, PublishingClient, SnapshotClient
+from model.store import StateStore
+from utils.metrics import MetricsServer, registry
+
+startup_timer.mark('import bot modules')
+
+logger = logging.getLogger(__name__)
+
+
+def print_canteen_info():
+    """
+    Fetch canteen info and print canteen name
+    """
+    try:
+        mensa = Mensa()
+    except OpenMensaUnavailable as oue:
+        print(f'\nCould not fetch canteen info: {oue}')
+        return
+    print(f'\nServing menu for {Style.BRIGHT}{mensa.get_info().get("name")}{Style.RESET_ALL}')
+
+
+def create_updater(token) -> Updater:
+    """
+    Create bot, dispatcher with bounded update queue and job queue
+
+    :param token: Bot token
+    :return: Updater instance
+    """
+    # Bounded update queue: polling blocks and the webhook listener rejects updates while it is full
+    # Handlers run on the handler executor and call the Bot API from there, so the pool is sized for both
+    pool_size = max(config.DISPATCHER_WORKERS, config.HANDLER_WORKERS if config.ASYNC_HANDLERS else 0) + 4
+    bot = Bot(token, base_url=config.TELEGRAM_API_URL,
+              request=Request(con_pool_size=pool_size, read_timeout=20, connect_timeout=20))
+    job_queue = JobQueue()
+    dispatcher = Dispatcher(bot, Queue(maxsize=config.UPDATE_QUEUE_SIZE), workers=config.DISPATCHER_WORKERS,
+                            job_queue=job_queue, use_context=True)
+    job_queue.set_dispatcher(dispatcher)
+    updater = Updater(dispatcher=dispatcher, workers=None, use_context=True)
+    registry.gauge('mensabot_update_queue_depth', 'Updates waiting for the dispatcher', updater.update_queue.qsize)
+    return updater
+
+
+def schedule_jobs(queue, archive=True) -> None:
+    """
+    Schedule the recurring jobs
+
+    :param queue: JobQueue
+    :param archive: Archive the menus of the day, only one process may write the menu archive; in sharded mode
+                    the front process does, as it knows the canteens of all shards
+    """
+    # JOB: Keep menus of the upcoming days warm, with an extra run right before the daily menu update message
+    queue.run_repeating(callback=callback_prefetch_menus, interval=config.PREFETCH_INTERVAL, first=0)
+    queue.run_daily(time=datetime.time(hour=9, minute=15, tzinfo=pytz.timezone('CET')),
+                    callback=callback_prefetch_menus)
+
+    # JOB: Revalidate upcoming menus and swap in changes, readers never wait for it
+    queue.run_repeating(callback=callback_refresh_menus, interval=config.REFRESH_INTERVAL,
+                        first=config.REFRESH_INTERVAL)
+
+    # JOB: Schedule daily menu update message
+    queue.run_daily(time=DAILY_UPDATE_TIME, callback=callback_daily_update)
+
+    # JOB: Archive the menus of the day once they are final
+    if archive:
+        queue.run_daily(time=ARCHIVE_TIME, callback=callback_archive_menus)
+
+    # JOB: Drop closed and stale polls of all chats; each poll schedules its own close job
+    queue.run_repeating(callback=callback_evict_polls, interval=config.POLL_EVICTION_INTERVAL)
+
+
+def read_token() -> str:
+    # Read token string from text file
+    with open(os.path.join(config.ROOT_DIR, 'data/connection_token.txt'), 'r') as f:
+        return f.read().strip()
 
 
 def main():
@@ -19,20 +112,36 @@ def main():
     Main method for running bot server.
     """
     logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                        level=logging.INFO)
+                        level=config.LOG_LEVEL)
 
-    # JOB: Create mensa object
-    mensa = Mensa()
-    print(f'\nServing menu for {Style.BRIGHT}{mensa.get_info().get("name")}{Style.RESET_ALL}')
+    if config.SHARDS > 1:
+        stopped = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stopped.set())
+        run_sharded(read_token(), config.SHARDS, stopped)
+        return
 
-    # JOB: Create Updater and Controller instance
-    print('\nCreating Updater ...')
+    # JOB: Serve metrics locally
+    if config.METRICS_ENABLED:
+        MetricsServer(config.METRICS_HOST, config.METRICS_PORT).start()
 
-    # Read token string from text file
-    with open(os.path.join(config.ROOT_DIR, 'data/connection_token.txt'), 'r') as f:
-        token = f.read()
+    # JOB: Open and prune the state store and warm caches from it
+    state_store = open_state()
+    state_store.prune()
+    Mensa.store = state_store
+    print(f'\nRestored {Mensa.warm_from_store(state_store)} cached OpenMensa responses.')
+    startup_timer.mark('warm caches')
 
-    updater = Updater(token=token, use_context=True, request_kwargs={'read_timeout': 20, 'connect_timeout': 20})
+    # JOB: Fetch canteen info, in the background in fast start mode
+    if config.FAST_START:
+        threading.Thread(target=print_canteen_info, name='CanteenInfo', daemon=True).start()
+    else:
+        print_canteen_info()
+    startup_timer.mark('canteen info')
+
+    # JOB: Create Updater and Controller instance
+    print('\nCreating Updater ...')
+    updater = create_updater(read_token())
     print(
         f'Successfully created Updater with username {Style.BRIGHT}{updater.bot.username}{Style.RESET_ALL} '
         f'and display name {Style.BRIGHT}{updater.bot.first_name}{Style.RESET_ALL}.')
@@ -40,19 +149,133 @@ def main():
     controller = Controller(dispatcher)
     controller.register_handlers()
     queue = updater.job_queue
+    startup_timer.mark('create updater')
+    print(f'Restored {restore_polls(queue)} active polls, {restore_subscriptions()} subscriptions '
+          f'and {restore_chat_canteens()} canteen choices.')
 
-    # JOB: Schedule daily menu update message
-    job_daily_update = queue.run_daily(time=datetime.time(hour=9, minute=30, second=30, tzinfo=pytz.timezone('CET')),
-                                       callback=callback_daily_update)
-
-    job_daily_results = queue.run_daily(time=datetime.time(hour=11, minute=0, second=10, tzinfo=pytz.timezone('CET')),
-                                        callback=callback_daily_results)
+    schedule_jobs(queue)
 
     # JOB: Start bot
-    updater.start_polling()
-    if updater.running:
-        print('Bot started.')
-    updater.idle()
+    if config.SERVING_MODE == 'webhook':
+        startup_timer.mark('start webhook')
+        print('Bot started in webhook mode.')
+        print(f'\nStartup timings:\n{startup_timer.report()}')
+        run_webhook(updater, config.WEBHOOK_HOST, config.WEBHOOK_PORT, config.WEBHOOK_PATH,
+                    put_timeout=config.WEBHOOK_QUEUE_TIMEOUT, webhook_url=config.WEBHOOK_URL)
+    else:
+        updater.start_polling()
+        startup_timer.mark('start polling')
+        if updater.running:
+            print('Bot started.')
+            print(f'\nStartup timings:\n{startup_timer.report()}')
+        updater.idle()
+    controller.shutdown()
+    state_store.close()
+
+
+def run_sharded(token, shards, stopped, overrides=None) -> None:
+    """
+    Run the front process of the sharded mode until stopped is set: receive updates by polling or webhook, route
+    them to the shard processes and keep the shared menu snapshot up to date
+
+    :param token: Bot token
+    :param shards: Number of shard processes
+    :param stopped: threading.Event shutting down the front process and all shards
+    :param overrides: Dict of config names -> values applied in the front and all shard processes
+    """
+    overrides = overrides or {}
+    for name, value in overrides.items():
+        setattr(config, name, value)
+
+    if config.METRICS_ENABLED:
+        MetricsServer(config.METRICS_HOST, config.METRICS_PORT).start()
+
+    # JOB: Publish every OpenMensa response fetched by this process to the menu snapshot the shards read from
+    snapshot = MenuSnapshot(config.MENU_SNAPSHOT_PATH)
+    Mensa.client = PublishingClient(OpenMensaClient(config.OPENMENSA_BASE_URL), snapshot)
+    shard_stores = [StateStore(os.path.join(shard_dir(shard), 'state.sqlite3')) for shard in range(shards)]
+    menu_archive = MenuArchive(config.ARCHIVE_DIR)
+
+    def publish():
+        canteen_ids = {config.DEFAULT_CANTEEN_ID}
+        for store in shard_stores:
+            canteen_ids.update(store.load_chat_canteens().values())
+        get_directory()
+        for canteen_id in canteen_ids:
+            Mensa(canteen_id).prefetch(days=config.PREFETCH_DAYS)
+        logger.info(f'Published menus of {len(canteen_ids)} canteens to the snapshot.')
+
+        # Archive the menus of the day of the canteens of all shards once they are final
+        now = datetime.datetime.now(ARCHIVE_TIME.tzinfo)
+        if now.time() >= ARCHIVE_TIME.replace(tzinfo=None):
+            archive_menus(menu_archive, canteen_ids, now.date())
+
+    start_snapshot_publisher(publish, stopped)
+    startup_timer.mark('start snapshot publisher')
+
+    # JOB: Start shard processes and route updates to them by chat
+    router = ShardRouter(shards, run_shard, args=(token, overrides)).start()
+    print(f'Started {shards} shard processes.')
+    if config.SERVING_MODE == 'webhook':
+        server = WebhookServer(None, router, config.WEBHOOK_HOST, config.WEBHOOK_PORT, config.WEBHOOK_PATH,
+                               put_timeout=config.WEBHOOK_QUEUE_TIMEOUT, decode=lambda data: data).start()
+        if config.WEBHOOK_URL is not None:
+            Bot(token, base_url=config.TELEGRAM_API_URL).set_webhook(
+                url=f'{config.WEBHOOK_URL.rstrip("/")}{server.path}')
+        stopped.wait()
+        server.stop()
+    else:
+        poll_updates(router, token, stopped)
+
+    print('Stopping shard processes ...')
+    router.stop()
+
+
+def run_shard(shard, shards, updates, token, overrides) -> None:
+    """
+    Run a shard process handling the updates of its chats with its own dispatcher, job queue and state store.
+    Menus are read from the shared snapshot and only fetched from OpenMensa if the snapshot cannot serve them.
+
+    :param shard: Shard index
+    :param shards: Number of shards
+    :param updates: Queue of updates routed to this shard, None stops the shard
+    :param token: Bot token
+    :param overrides: Dict of config names -> values
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Shut down by the front process only
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    logging.basicConfig(format=f'%(asctime)s - shard {shard} - %(name)s - %(levelname)s - %(message)s',
+                        level=config.LOG_LEVEL)
+
+    if config.METRICS_ENABLED:
+        MetricsServer(config.METRICS_HOST, config.METRICS_PORT + 1 + shard).start()
+
+    store = configure_shard(shard, shards)
+    Mensa.client = SnapshotClient(MenuSnapshot(config.MENU_SNAPSHOT_PATH),
+                                  fallback=OpenMensaClient(config.OPENMENSA_BASE_URL))
+
+    updater = create_updater(token)
+    controller = Controller(updater.dispatcher)
+    controller.register_handlers()
+    queue = updater.job_queue
+    logger.info(f'Restored {restore_polls(queue)} active polls, {restore_subscriptions()} subscriptions '
+                f'and {restore_chat_canteens()} canteen choices.')
+    schedule_jobs(queue, archive=False)
+
+    queue.start()
+    dispatcher_thread = threading.Thread(target=updater.dispatcher.start, name='Dispatcher', daemon=True)
+    dispatcher_thread.start()
+    feed_dispatcher(updates, updater.bot, updater.update_queue)
+
+    # Let the dispatcher and the handlers finish the updates routed so far
+    while not updater.update_queue.empty():
+        time.sleep(0.05)
+    queue.stop()
+    updater.dispatcher.stop()
+    dispatcher_thread.join()
+    controller.shutdown()
+    store.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,510 @@
+import datetime
+import json
+import os
+import threading
+
+import config
+from model.meals import normalize_meals
+
+PRICE_GROUPS = ['students', 'employees', 'pupils', 'others']
+COLUMNS = {'date': 'int32', 'line': 'int32', 'name': 'int32', 'notes': 'int32', 'symbol': 'int32',
+           **{group: 'float32' for group in PRICE_GROUPS}}
+NOTES_SEPARATOR = '\x1f'
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def _numpy():
+    # Imported on first use, it is only needed for archiving and statistics
+    import numpy
+    return numpy
+
+
+def _write_json(path, data) -> None:
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(data, f)
+    os.replace(temporary, path)
+
+
+def _read_json(path, default):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def _append_columns(directory, spec, committed_rows, columns, prefix='') -> None:
+    """
+    Append values to column files, dropping rows of an interrupted append that were never committed
+
+    :param directory: Directory of the column files
+    :param spec: Dict of column -> dtype
+    :param committed_rows: Number of rows recorded in the meta file
+    :param columns: Dict of column -> list of values
+    :param prefix: File name prefix
+    """
+    np = _numpy()
+    os.makedirs(directory, exist_ok=True)
+    for column, dtype in spec.items():
+        with open(os.path.join(directory, f'{prefix}{column}.bin'), 'ab') as f:
+            f.truncate(committed_rows * np.dtype(dtype).itemsize)
+            f.write(np.asarray(columns[column], dtype=dtype).tobytes())
+
+
+def _map_columns(directory, spec, rows, prefix='') -> dict:
+    """
+    Memory-map the committed rows of column files
+
+    :param directory: Directory of the column files
+    :param spec: Dict of column -> dtype
+    :param rows: Number of committed rows
+    :param prefix: File name prefix
+    :return: Dict of column -> read-only memmap, or None if there are no rows
+    """
+    if not rows:
+        return None
+    np = _numpy()
+    return {column: np.memmap(os.path.join(directory, f'{prefix}{column}.bin'), dtype=dtype, mode='r',
+                              shape=(rows,))
+            for column, dtype in spec.items()}
+
+
+class MenuArchive:
+    """
+    Append-only columnar archive of daily menus.
+    Every canteen has one partition per year holding one file per column. Strings (lines, names, notes and
+    symbols) are dictionary encoded per canteen, prices are stored per group with NaN for missing prices.
+    A partition's meta file records the committed number of rows and is replaced atomically after the column
+    files were appended to, so readers memory-map committed rows only.
+    """
+
+    def __init__(self, root=config.ARCHIVE_DIR):
+        """
+        Constructor for MenuArchive instance
+
+        :param root: Archive directory
+        """
+        self.root = root
+        self._lock = threading.Lock()
+        self._strings = {}  # canteen ID -> (list of strings, dict of string -> code, version of strings.json)
+        self._partitions = {}  # (canteen ID, year) -> (meta, dict of column -> memmap)
+
+    def _canteen_dir(self, canteen_id) -> str:
+        return os.path.join(self.root, str(canteen_id))
+
+    def _partition_dir(self, canteen_id, year) -> str:
+        return os.path.join(self._canteen_dir(canteen_id), str(year))
+
+    def _load_strings(self, canteen_id) -> tuple:
+        # Strings are only ever appended, so a file of another size or time holds strings added by another process
+        path = os.path.join(self._canteen_dir(canteen_id), 'strings.json')
+        try:
+            stat = os.stat(path)
+            version = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            version = None
+        strings = self._strings.get(canteen_id)
+        if strings is None or strings[2] != version:
+            values = _read_json(path, [])
+            strings = (values, {value: code for code, value in enumerate(values)}, version)
+            self._strings[canteen_id] = strings
+        return strings
+
+    def _encode(self, canteen_id, value) -> int:
+        values, codes, _ = self._load_strings(canteen_id)
+        code = codes.get(value)
+        if code is None:
+            code = len(values)
+            values.append(value)
+            codes[value] = code
+        return code
+
+    def _meta(self, canteen_id, year) -> dict:
+        return _read_json(os.path.join(self._partition_dir(canteen_id, year), 'meta.json'), {'rows': 0, 'dates': []})
+
+    def years(self, canteen_id) -> list:
+        try:
+            return sorted(int(name) for name in os.listdir(self._canteen_dir(canteen_id)) if name.isdigit())
+        except FileNotFoundError:
+            return []
+
+    def append(self, canteen_id, date, payload) -> int:
+        """
+        Append the meals of a day, unless the day is archived already
+
+        :param canteen_id: Canteen ID
+        :param date: Date of the menu
+        :param payload: Decoded JSON list of meals as returned by /meals
+        :return: Number of appended rows
+        """
+        np = _numpy()
+        day = (date - EPOCH).days
+        meals = [meal for _, meals in normalize_meals(payload, mains_only=False) for meal in meals]
+
+        with self._lock:
+            directory = self._partition_dir(canteen_id, date.year)
+            meta = self._meta(canteen_id, date.year)
+            if day in meta['dates'] or not meals:
+                return 0
+
+            columns = {'date': [day] * len(meals),
+                       'line': [self._encode(canteen_id, meal.line) for meal in meals],
+                       'name': [self._encode(canteen_id, meal.name) for meal in meals],
+                       'notes': [self._encode(canteen_id, NOTES_SEPARATOR.join(meal.notes)) for meal in meals],
+                       'symbol': [self._encode(canteen_id, meal.symbol) for meal in meals]}
+            for group in PRICE_GROUPS:
+                columns[group] = [meal.prices.get(group) if meal.prices.get(group) is not None else np.nan
+                                  for meal in meals]
+
+            os.makedirs(directory, exist_ok=True)
+            _write_json(os.path.join(self._canteen_dir(canteen_id), 'strings.json'),
+                        self._load_strings(canteen_id)[0])
+            _append_columns(directory, COLUMNS, meta['rows'], columns)
+
+            meta = {'rows': meta['rows'] + len(meals), 'dates': meta['dates'] + [day]}
+            _write_json(os.path.join(directory, 'meta.json'), meta)
+            self._partitions.pop((canteen_id, date.year), None)
+
+        return len(meals)
+
+    def has_day(self, canteen_id, date) -> bool:
+        return (date - EPOCH).days in self._meta(canteen_id, date.year)['dates']
+
+    def _partition(self, canteen_id, year) -> dict:
+        partition = self._partitions.get((canteen_id, year))
+        meta = self._meta(canteen_id, year)
+        if partition is None or partition[0]['rows'] != meta['rows']:
+            # Rows may have been appended by another process
+            partition = (meta, _map_columns(self._partition_dir(canteen_id, year), COLUMNS, meta['rows']))
+            self._partitions[(canteen_id, year)] = partition
+        return partition[1]
+
+    def scan(self, canteen_id, start=None, end=None) -> dict:
+        """
+        Read columns of all rows within a date range, reading only the partitions of the years in range
+
+        :param canteen_id: Canteen ID
+        :param start: First date, inclusive
+        :param end: Last date, inclusive
+        :return: Dict of column -> numpy array
+        """
+        np = _numpy()
+        first = (start - EPOCH).days if start is not None else None
+        last = (end - EPOCH).days if end is not None else None
+
+        parts = []
+        for year in self.years(canteen_id):
+            if (start is not None and year < start.year) or (end is not None and year > end.year):
+                continue
+            columns = self._partition(canteen_id, year)
+            if columns is None:
+                continue
+            mask = np.ones(len(columns['date']), dtype=bool)
+            if first is not None:
+                mask &= columns['date'] >= first
+            if last is not None:
+                mask &= columns['date'] <= last
+            parts.append({column: values[mask] for column, values in columns.items()})
+
+        if not parts:
+            return {column: np.empty(0, dtype=dtype) for column, dtype in COLUMNS.items()}
+        return {column: np.concatenate([part[column] for part in parts]) for column in COLUMNS}
+
+    def strings(self, canteen_id) -> list:
+        return self._load_strings(canteen_id)[0]
+
+    def codes(self, canteen_id, values) -> list:
+        codes = self._load_strings(canteen_id)[1]
+        return [codes[value] for value in values if value in codes]
+
+    def summary(self, canteen_id) -> dict:
+        """
+        Get number of archived days and meals and the archived date range
+
+        :param canteen_id: Canteen ID
+        :return: Dict with days, meals, first and last date
+        """
+        dates = sorted(day for year in self.years(canteen_id) for day in self._meta(canteen_id, year)['dates'])
+        return {'days': len(dates), 'meals': sum(self._meta(canteen_id, year)['rows']
+                                                 for year in self.years(canteen_id)),
+                'first': EPOCH + datetime.timedelta(days=dates[0]) if dates else None,
+                'last': EPOCH + datetime.timedelta(days=dates[-1]) if dates else None}
+
+    def price_trend(self, canteen_id, group='students', start=None, end=None, min_price=1.0) -> list:
+        """
+        Get monthly price statistics of main dishes
+
+        :param canteen_id: Canteen ID
+        :param group: Price group
+        :param start: First date, inclusive
+        :param end: Last date, inclusive
+        :param min_price: Minimum student price of main dishes
+        :return: List of (month as 'YYYY-MM', mean, min, max, number of meals) tuples
+        """
+        np = _numpy()
+        data = self.scan(canteen_id, start, end)
+        mask = (data['students'] > min_price) & ~np.isnan(data[group])
+        prices = data[group][mask].astype('float64')
+        months = data['date'][mask].astype('datetime64[D]').astype('datetime64[M]').astype('int64')
+        if not len(months):
+            return []
+
+        keys, inverse = np.unique(months, return_inverse=True)
+        counts = np.bincount(inverse)
+        means = np.bincount(inverse, weights=prices) / counts
+        minima = np.full(len(keys), np.inf)
+        maxima = np.full(len(keys), -np.inf)
+        np.minimum.at(minima, inverse, prices)
+        np.maximum.at(maxima, inverse, prices)
+
+        return [(str(np.datetime64(int(key), 'M')), float(mean), float(low), float(high), int(count))
+                for key, mean, low, high, count in zip(keys, means, minima, maxima, counts)]
+
+    def line_frequency(self, canteen_id, symbols, start=None, end=None, min_price=1.0) -> list:
+        """
+        Count per line on how many days a main dish with one of the symbols was served
+
+        :param canteen_id: Canteen ID
+        :param symbols: Meal symbols, e.g. the symbols of a diet
+        :param start: First date, inclusive
+        :param end: Last date, inclusive
+        :param min_price: Minimum student price of main dishes
+        :return: List of (line, days with a matching main, days with any main) tuples in line order
+        """
+        np = _numpy()
+        data = self.scan(canteen_id, start, end)
+        mains = data['students'] > min_price
+        matches = mains & np.isin(data['symbol'], self.codes(canteen_id, symbols))
+
+        def day_counts(mask):
+            # Unique (line, date) pairs, counted per line
+            pairs = np.unique(data['line'][mask].astype('int64') << 32 | data['date'][mask].astype('int64'))
+            lines, counts = np.unique(pairs >> 32, return_counts=True)
+            return dict(zip(lines.tolist(), counts.tolist()))
+
+        served = day_counts(mains)
+        matched = day_counts(matches)
+        strings = self.strings(canteen_id)
+        return [(strings[line], matched.get(line, 0), days) for line, days in sorted(served.items())]
+
+    def top_dishes(self, canteen_id, limit=5, start=None, end=None, min_price=1.0) -> list:
+        """
+        Get most frequently served main dishes
+
+        :param canteen_id: Canteen ID
+        :param limit: Number of dishes
+        :param start: First date, inclusive
+        :param end: Last date, inclusive
+        :param min_price: Minimum student price of main dishes
+        :return: List of (name, number of times served) tuples
+        """
+        np = _numpy()
+        data = self.scan(canteen_id, start, end)
+        names = data['name'][data['students'] > min_price]
+        if not len(names):
+            return []
+        counts = np.bincount(names)
+        top = np.argsort(-counts, kind='stable')[:limit]
+        strings = self.strings(canteen_id)
+        return [(strings[code], int(counts[code])) for code in top if counts[code] > 0]
+
+
+POLL_COLUMNS = {'day': 'int32', 'choice': 'int32'}
+VOTE_COLUMNS = {'poll': 'int32', 'user': 'int32', 'mask': 'uint64'}
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+class PollArchive:
+    """
+    Append-only archive of closed polls per chat, stored as a sparse vote matrix (polls x users x options):
+    one row per poll with its day and winning option, and one row per vote with poll, user and a bitmask over
+    the chat's option labels. Labels and users are numbered per chat in the meta file, so polls with differing
+    option lists share one bit layout. Masks hold 64 labels, polls needing more are counted as skipped instead.
+    """
+
+    def __init__(self, root=config.POLL_ARCHIVE_DIR):
+        """
+        Constructor for PollArchive instance
+
+        :param root: Archive directory
+        """
+        self.root = root
+        self._lock = threading.Lock()
+        self._chats = {}  # chat ID -> (meta, poll columns, vote columns)
+
+    def _chat_dir(self, chat_id) -> str:
+        return os.path.join(self.root, str(chat_id))
+
+    def _meta(self, chat_id) -> dict:
+        return _read_json(os.path.join(self._chat_dir(chat_id), 'meta.json'),
+                          {'polls': 0, 'votes': 0, 'message_ids': [], 'options': [], 'users': [], 'skipped': []})
+
+    def append(self, chat_id, message_id, date, poll) -> int:
+        """
+        Append a closed poll, unless it is archived already
+
+        :param chat_id: Chat ID
+        :param message_id: ID of the poll message
+        :param date: Date of the poll
+        :param poll: PollData instance
+        :return: Number of appended votes
+        :raises ValueError: If the chat's option labels and the poll's new ones are more than 64, the poll is
+            recorded as skipped then
+        """
+        times, unique_max, _ = poll.calculate_stats()
+        with self._lock:
+            meta = self._meta(chat_id)
+            if message_id in meta['message_ids'] or message_id in meta['skipped']:
+                return 0
+
+            labels = meta['options']
+            new_labels = [option for option in dict.fromkeys(poll.options + ['Out']) if option not in labels]
+            if len(labels) + len(new_labels) > 64:
+                meta['skipped'].append(message_id)
+                os.makedirs(self._chat_dir(chat_id), exist_ok=True)
+                _write_json(os.path.join(self._chat_dir(chat_id), 'meta.json'), meta)
+                self._chats.pop(chat_id, None)
+                raise ValueError(f'PollArchive supports at most 64 option labels per chat, the chat has '
+                                 f'{len(labels)} and the poll adds {len(new_labels)}.')
+            labels.extend(new_labels)
+
+            users = {key: num for num, (key, _) in enumerate(meta['users'])}
+            bits = [1 << labels.index(option) for option in poll.options + ['Out']]  # poll bit -> chat label bit
+
+            votes = {'poll': [], 'user': [], 'mask': []}
+            for key, name, mask in poll.get_votes():
+                if not mask:
+                    continue
+                if key not in users:
+                    users[key] = len(meta['users'])
+                    meta['users'].append([key, name])
+                meta['users'][users[key]][1] = name
+                votes['poll'].append(meta['polls'])
+                votes['user'].append(users[key])
+                votes['mask'].append(sum(bit for num, bit in enumerate(bits) if mask >> num & 1))
+
+            choice = [labels.index(time) for time, _, _, is_choice in times if is_choice]
+            directory = self._chat_dir(chat_id)
+            _append_columns(directory, POLL_COLUMNS, meta['polls'],
+                            {'day': [(date - EPOCH).days], 'choice': [choice[0] if unique_max else -1]},
+                            prefix='polls_')
+            _append_columns(directory, VOTE_COLUMNS, meta['votes'], votes, prefix='votes_')
+
+            meta.update(polls=meta['polls'] + 1, votes=meta['votes'] + len(votes['mask']),
+                        message_ids=meta['message_ids'] + [message_id])
+            _write_json(os.path.join(directory, 'meta.json'), meta)
+            self._chats.pop(chat_id, None)
+
+        return len(votes['mask'])
+
+    def _load(self, chat_id) -> tuple:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            meta = self._meta(chat_id)
+            directory = self._chat_dir(chat_id)
+            chat = (meta, _map_columns(directory, POLL_COLUMNS, meta['polls'], prefix='polls_'),
+                    _map_columns(directory, VOTE_COLUMNS, meta['votes'], prefix='votes_'))
+            self._chats[chat_id] = chat
+        return chat
+
+    def _vote_matrix(self, meta, votes):
+        """
+        Unpack vote bitmasks
+
+        :return: Array of shape (votes, option labels) with 1 for every chosen label
+        """
+        np = _numpy()
+        shifts = np.arange(len(meta['options']), dtype='uint64')
+        return ((votes['mask'][:, None] >> shifts) & np.uint64(1)).astype('int32')
+
+    def _time_labels(self, meta):
+        np = _numpy()
+        return np.array([label != 'Out' for label in meta['options']], dtype=bool)
+
+    def summary(self, chat_id) -> dict:
+        meta, polls, _ = self._load(chat_id)
+        first = EPOCH + datetime.timedelta(days=int(polls['day'].min())) if polls is not None else None
+        return {'polls': meta['polls'], 'votes': meta['votes'], 'users': len(meta['users']), 'first': first,
+                'skipped': len(meta['skipped'])}
+
+    def attendance(self, chat_id, start=None) -> list:
+        """
+        Get how often users voted for a time, relative to the polls since they first voted
+
+        :param chat_id: Chat ID
+        :param start: First date, inclusive
+        :return: List of (name, attended polls, polls since first vote, rate) tuples, highest rate first
+        """
+        np = _numpy()
+        meta, polls, votes = self._load(chat_id)
+        if votes is None:
+            return []
+
+        in_range = polls['day'] >= (start - EPOCH).days if start is not None else np.ones(meta['polls'], bool)
+        selected = in_range[votes['poll']]
+        attended = selected & (self._vote_matrix(meta, votes)[:, self._time_labels(meta)].sum(axis=1) > 0)
+
+        n_users = len(meta['users'])
+        counts = np.bincount(votes['user'][attended], minlength=n_users)
+        first_poll = np.full(n_users, meta['polls'])
+        np.minimum.at(first_poll, votes['user'][selected], votes['poll'][selected])
+
+        positions = np.flatnonzero(in_range)
+        eligible = len(positions) - np.searchsorted(positions, first_poll)
+        result = [(meta['users'][user][1], int(counts[user]), int(eligible[user]), float(counts[user] / eligible[user]))
+                  for user in range(n_users) if eligible[user] > 0]
+        return sorted(result, key=lambda item: (-item[3], -item[1]))
+
+    def popular_slots(self, chat_id, start=None) -> dict:
+        """
+        Get the most voted time per weekday
+
+        :param chat_id: Chat ID
+        :param start: First date, inclusive
+        :return: Dict of weekday (0 is Monday) -> (option label, votes, polls on that weekday)
+        """
+        np = _numpy()
+        meta, polls, votes = self._load(chat_id)
+        if votes is None:
+            return {}
+
+        weekdays = (polls['day'].astype('int64') + 3) % 7  # 1970-01-01 was a Thursday
+        in_range = polls['day'] >= (start - EPOCH).days if start is not None else np.ones(meta['polls'], bool)
+        selected = in_range[votes['poll']]
+
+        # Count the set bits of the vote matrix per (weekday, label) cell
+        n_labels = len(meta['options'])
+        vote_rows, labels = np.nonzero(self._vote_matrix(meta, votes)[selected])
+        cells = weekdays[votes['poll'][selected]][vote_rows].astype('int64') * n_labels + labels
+        counts = np.bincount(cells, minlength=7 * n_labels).reshape(7, n_labels)
+        counts[:, ~self._time_labels(meta)] = -1
+        n_polls = np.bincount(weekdays[in_range], minlength=7)
+
+        return {int(weekday): (meta['options'][int(counts[weekday].argmax())], int(counts[weekday].max()),
+                               int(n_polls[weekday]))
+                for weekday in range(7) if n_polls[weekday] and counts[weekday].max() > 0}
+
+    def predict_slot(self, chat_id, date, half_life=config.POLL_PREDICTION_HALF_LIFE):
+        """
+        Predict the time a chat will choose, from exponentially decayed votes of past polls on the same weekday,
+        or of all past polls if there were none on that weekday
+
+        :param chat_id: Chat ID
+        :param date: Date of the poll
+        :param half_life: Number of days after which a poll counts half
+        :return: Option label or None without history
+        """
+        meta, polls, votes = self._load(chat_id)
+        if votes is None:
+            return None
+
+        days = polls['day'].astype('int64')
+        same_weekday = (days + 3) % 7 == date.weekday()
+        weights = 0.5 ** (((date - EPOCH).days - days) / half_life)
+        if same_weekday.any():
+            weights = weights * same_weekday
+
+        scores = (self._vote_matrix(meta, votes) * weights[votes['poll']][:, None]).sum(axis=0)
+        scores[~self._time_labels(meta)] = 0
+        return meta['options'][int(scores.argmax())] if scores.max() > 0 else None
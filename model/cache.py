@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe, size-bounded LRU cache with a time to live per entry.
+    Concurrent misses on the same key are collapsed into a single fetch. Entries may stay servable for a grace
+    period after they expire, during which get_or_fetch returns them immediately and refreshes them in the
+    background (stale-while-revalidate).
+    """
+
+    def __init__(self, max_size=256):
+        """
+        Constructor for TTLCache instance
+
+        :param max_size: Maximum number of entries before least recently used entries are evicted
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+        self._data = OrderedDict()  # key -> (expires_at, stale_until, value)
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, key, default=None):
+        """
+        Get cached value for key if present and not expired
+
+        :param key: Cache key
+        :param default: Value to return on a miss
+        :return: Cached value or default
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            now = time.monotonic()
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            if entry is not None and entry[1] <= now:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """
+        Get cached value for key, even if expired, without updating counters or recency
+
+        :param key: Cache key
+        :param default: Value to return if there is no entry
+        :return: Cached value or default
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            return entry[2] if entry is not None else default
+
+    def set(self, key, value, ttl, stale_ttl=0) -> None:
+        """
+        Store value under key for ttl seconds
+
+        :param key: Cache key
+        :param value: Value to store
+        :param ttl: Time to live in seconds
+        :param stale_ttl: Seconds after expiry during which get_or_fetch still serves the value
+        """
+        with self._lock:
+            expires_at = time.monotonic() + ttl
+            self._data[key] = (expires_at, expires_at + stale_ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_fetch(self, key, fetch, ttl, stale_ttl=0):
+        """
+        Get cached value for key or call fetch() once to fill the cache.
+        Expired values within their grace period are returned right away while a background thread refreshes them.
+
+        :param key: Cache key
+        :param fetch: Callable without arguments returning the value to cache
+        :param ttl: Time to live in seconds
+        :param stale_ttl: Seconds after expiry during which the value is served while being refreshed
+        :return: Cached or freshly fetched value
+        """
+        _missing = object()
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.stale_hits += 1
+                key_lock = self._key_locks.setdefault(key, threading.Lock())
+                if key_lock.acquire(blocking=False):
+                    threading.Thread(target=self._refresh, args=(key, key_lock, fetch, ttl, stale_ttl),
+                                     name='CacheRefresh', daemon=True).start()
+                return entry[2]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Another thread may have filled the entry while we were waiting
+            with self._lock:
+                entry = self._data.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    return entry[2]
+            try:
+                value = fetch()
+                self.set(key, value, ttl, stale_ttl)
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+
+        return value
+
+    def _refresh(self, key, key_lock, fetch, ttl, stale_ttl) -> None:
+        try:
+            self.set(key, fetch(), ttl, stale_ttl)
+        except Exception:
+            pass  # The stale value stays servable until its grace period ends
+        finally:
+            with self._lock:
+                self._key_locks.pop(key, None)
+            key_lock.release()
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """
+        Get cache counters
+
+        :return: Dict with size, hits, misses, stale hits, evictions and hit ratio
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._data), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                    'stale_hits': self.stale_hits, 'evictions': self.evictions,
+                    'hit_ratio': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,210 @@
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import config
+from utils.metrics import openmensa_errors, openmensa_latency
+
+logger = logging.getLogger(__name__)
+
+
+class OpenMensaUnavailable(Exception):
+    """
+    Raised when OpenMensa cannot be reached and no previous payload is available
+    """
+
+
+class OpenMensaRequestError(OpenMensaUnavailable):
+    """
+    Raised when OpenMensa rejects a request with a 4xx status, e.g. for an unknown canteen or date.
+    The API itself is fine, so the circuit breaker is left alone and no previous payload is served.
+    """
+
+
+class _BoundedRetry(Retry):
+    BACKOFF_MAX = config.HTTP_BACKOFF_MAX  # Upper bound for the exponential backoff between retries
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker that opens after consecutive failures and lets a single trial request through
+    once the reset timeout has passed.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow_request(self) -> bool:
+        """
+        Check whether a request may be sent upstream
+
+        :return: False while the breaker is open
+        """
+        with self._lock:
+            if self.state != 'open':
+                if self.opened_at is not None:
+                    # Half-open: restart the timer so only one trial request passes
+                    self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class OpenMensaClient:
+    """
+    HTTP client for the OpenMensa API using a pooled keep-alive session with timeouts, retries
+    and a circuit breaker. The last good payload per request is served while the breaker is open.
+    """
+
+    def __init__(self, base_url, pool_size=config.HTTP_POOL_SIZE, timeout=config.HTTP_TIMEOUT,
+                 retries=config.HTTP_RETRIES, backoff_factor=config.HTTP_BACKOFF_FACTOR):
+        """
+        Constructor for OpenMensaClient instance
+
+        :param base_url: Base URL of the REST API
+        :param pool_size: Number of keep-alive connections kept in the pool
+        :param timeout: Tuple of (connect, read) timeouts in seconds
+        :param retries: Number of retries for failed requests
+        :param backoff_factor: Backoff factor between retries
+        """
+        self.base_url = base_url
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(failure_threshold=config.BREAKER_FAILURE_THRESHOLD,
+                                      reset_timeout=config.BREAKER_RESET_TIMEOUT)
+
+        retry = _BoundedRetry(total=retries, backoff_factor=backoff_factor,
+                              status_forcelist=(500, 502, 503, 504), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._last_good = {}
+        self._validators = {}  # key -> request headers revalidating the last good payload
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    def get_json(self, endpoint, path, params=None):
+        """
+        Get decoded JSON for path.
+        Requests are conditional once the server sent an ETag or Last-Modified header; if the payload did not change,
+        the last good payload object itself is returned.
+
+        :param endpoint: Endpoint kind used to group timing stats
+        :param path: Path relative to base URL
+        :param params: Query parameters
+        :return: Decoded JSON response
+        """
+        key = (path, tuple(sorted(params.items())) if params else ())
+
+        if not self.breaker.allow_request():
+            return self._fallback(endpoint, key)
+
+        with self._lock:
+            headers = self._validators.get(key) if key in self._last_good else None
+
+        start = time.perf_counter()
+        try:
+            response = self.session.get(f'{self.base_url}{path}', params=params, timeout=self.timeout,
+                                        headers=headers)
+            if 400 <= response.status_code < 500:
+                # Client error: only connection errors, timeouts and 5xx responses count as failures
+                self._record(endpoint, time.perf_counter() - start)
+                raise OpenMensaRequestError(f'OpenMensa rejected {path} with status {response.status_code}')
+            response.raise_for_status()
+            if response.status_code == 304:
+                self.breaker.record_success()
+                self._record(endpoint, time.perf_counter() - start, not_modified=True)
+                with self._lock:
+                    return self._last_good[key]
+            payload = response.json()
+        except (requests.RequestException, ValueError):
+            self.breaker.record_failure()
+            self._record(endpoint, time.perf_counter() - start, error=True)
+            return self._fallback(endpoint, key)
+
+        self.breaker.record_success()
+        self._record(endpoint, time.perf_counter() - start)
+        validators = {header: response.headers[name]
+                      for name, header in (('ETag', 'If-None-Match'), ('Last-Modified', 'If-Modified-Since'))
+                      if name in response.headers}
+        with self._lock:
+            self._last_good[key] = payload
+            if validators:
+                self._validators[key] = validators
+            else:
+                self._validators.pop(key, None)
+
+        return payload
+
+    def remember(self, path, params, payload) -> None:
+        """
+        Register payload as last good response for path, e.g. after loading it from the state store
+
+        :param path: Path relative to base URL
+        :param params: Query parameters as dict or tuple of (name, value) pairs
+        :param payload: Decoded JSON payload
+        """
+        params = tuple(sorted(dict(params).items())) if params else ()
+        with self._lock:
+            self._last_good.setdefault((path, params), payload)
+
+    def _fallback(self, endpoint, key):
+        with self._lock:
+            if key in self._last_good:
+                self._timings.setdefault(endpoint, self._empty_stats())['stale'] += 1
+                return self._last_good[key]
+        raise OpenMensaUnavailable(f'OpenMensa unavailable for {key[0]} (circuit {self.breaker.state})')
+
+    @staticmethod
+    def _empty_stats() -> dict:
+        return {'count': 0, 'errors': 0, 'stale': 0, 'not_modified': 0, 'total': 0.0, 'max': 0.0}
+
+    def _record(self, endpoint, elapsed, error=False, not_modified=False) -> None:
+        openmensa_latency.observe(elapsed, endpoint)
+        if error:
+            openmensa_errors.inc(endpoint)
+            logger.warning(f'OpenMensa request to {endpoint} endpoint failed (circuit {self.breaker.state})')
+        with self._lock:
+            stats = self._timings.setdefault(endpoint, self._empty_stats())
+            stats['count'] += 1
+            stats['errors'] += int(error)
+            stats['not_modified'] += int(not_modified)
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+
+    def stats(self) -> dict:
+        """
+        Get request timing stats per endpoint
+
+        :return: Dict of endpoint -> count, errors, stale responses, mean and max latency in seconds
+        """
+        with self._lock:
+            return {endpoint: dict(stats, mean=stats['total'] / stats['count'] if stats['count'] else 0.0)
+                    for endpoint, stats in self._timings.items()}
@@ -0,0 +1,150 @@
+import bisect
+import math
+import threading
+from collections import namedtuple
+
+import config
+from model.model import Mensa
+from model.search import tokenize
+
+Canteen = namedtuple('Canteen', ['id', 'name', 'city', 'address', 'coordinates'])
+
+EARTH_RADIUS = 6371.0  # km
+KM_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+
+def distance(a, b) -> float:
+    """
+    Get great-circle distance of two points
+
+    :param a: (latitude, longitude) in degrees
+    :param b: (latitude, longitude) in degrees
+    :return: Distance in km
+    """
+    lat_a, lng_a, lat_b, lng_b = map(math.radians, (*a, *b))
+    h = math.sin((lat_b - lat_a) / 2) ** 2 + math.cos(lat_a) * math.cos(lat_b) * math.sin((lng_b - lng_a) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(math.sqrt(h), 1.0))
+
+
+class CanteenDirectory:
+    """
+    Directory of all OpenMensa canteens with a prefix index over name and city tokens
+    and a grid of latitude/longitude cells for nearest-canteen lookups
+    """
+
+    def __init__(self, payload, cell_size=config.DIRECTORY_GRID_DEGREES):
+        """
+        Constructor for CanteenDirectory instance
+
+        :param payload: Decoded JSON list of canteens as returned by /canteens
+        :param cell_size: Grid cell size in degrees
+        """
+        self.cell_size = cell_size
+        self.canteens = {}  # canteen ID -> Canteen
+        self._grid = {}  # (row, column) -> list of canteen IDs
+        postings = {}
+
+        for record in payload:
+            coordinates = tuple(record['coordinates']) if record.get('coordinates') else None
+            canteen = Canteen(record['id'], record['name'], record.get('city'), record.get('address'), coordinates)
+            self.canteens[canteen.id] = canteen
+            for token in set(tokenize(f'{canteen.name} {canteen.city or ""}')):
+                postings.setdefault(token, set()).add(canteen.id)
+            if coordinates is not None:
+                self._grid.setdefault(self._cell(*coordinates), []).append(canteen.id)
+
+        self._vocabulary = sorted(postings)
+        self._postings = [postings[token] for token in self._vocabulary]
+        rows = [row for row, _ in self._grid] or [0]
+        columns = [column for _, column in self._grid] or [0]
+        self._bounds = (min(rows), max(rows), min(columns), max(columns))
+
+    def __len__(self):
+        return len(self.canteens)
+
+    def get(self, canteen_id):
+        return self.canteens.get(canteen_id)
+
+    def _cell(self, latitude, longitude) -> tuple:
+        return math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size)
+
+    def search(self, query, limit=config.DIRECTORY_RESULTS) -> list:
+        """
+        Find canteens whose name or city contain words starting with every word of query
+
+        :param query: Query text
+        :param limit: Maximum number of results
+        :return: List of Canteen, sorted by name
+        """
+        matches = None
+        for word in tokenize(query):
+            found = set()
+            position = bisect.bisect_left(self._vocabulary, word)
+            while position < len(self._vocabulary) and self._vocabulary[position].startswith(word):
+                found.update(self._postings[position])
+                position += 1
+            matches = found if matches is None else matches & found
+            if not matches:
+                return []
+
+        if matches is None:
+            return []
+        return sorted((self.canteens[canteen_id] for canteen_id in matches), key=lambda canteen: canteen.name)[:limit]
+
+    def nearest(self, latitude, longitude, limit=config.DIRECTORY_RESULTS) -> list:
+        """
+        Find the canteens closest to a location by searching grid rings of growing radius until no unvisited cell
+        can hold a closer canteen
+
+        :param latitude: Latitude in degrees
+        :param longitude: Longitude in degrees
+        :param limit: Maximum number of results
+        :return: List of (distance in km, Canteen) tuples, closest first
+        """
+        origin = (latitude, longitude)
+        row, column = self._cell(latitude, longitude)
+        min_row, max_row, min_column, max_column = self._bounds
+        max_radius = max(abs(row - min_row), abs(row - max_row), abs(column - min_column), abs(column - max_column))
+
+        found = []
+        for radius in range(max_radius + 1):
+            for cell_row in range(row - radius, row + radius + 1):
+                step = 1 if abs(cell_row - row) == radius else 2 * radius
+                for cell_column in range(column - radius, column + radius + 1, max(step, 1)):
+                    for canteen_id in self._grid.get((cell_row, cell_column), ()):
+                        canteen = self.canteens[canteen_id]
+                        found.append((distance(origin, canteen.coordinates), canteen))
+
+            if len(found) >= limit:
+                # Unvisited cells are at least radius cells away; longitude degrees shrink towards the poles
+                latitude_bound = min(abs(latitude) + (radius + 1) * self.cell_size, 90.0)
+                reach = radius * self.cell_size * KM_PER_DEGREE * math.cos(math.radians(latitude_bound))
+                found.sort(key=lambda item: item[0])
+                if found[limit - 1][0] <= reach:
+                    break
+
+        found.sort(key=lambda item: item[0])
+        return found[:limit]
+
+
+_directory = None  # (payload, CanteenDirectory)
+_lock = threading.Lock()
+
+
+def get_directory() -> CanteenDirectory:
+    """
+    Get directory of all canteens, rebuilt only when the cached canteen list changes
+
+    :return: CanteenDirectory instance
+    """
+    global _directory
+
+    payload = Mensa.get_canteens()
+    cached = _directory
+    if cached is not None and cached[0] is payload:
+        return cached[1]
+
+    with _lock:
+        if _directory is None or _directory[0] is not payload:
+            _directory = (payload, CanteenDirectory(payload))
+        return _directory[1]
@@ -0,0 +1,61 @@
+import hashlib
+import json
+from collections import namedtuple
+
+from utils.utils import meal_classifier
+
+Meal = namedtuple('Meal', ['id', 'line', 'name', 'notes', 'prices', 'price', 'symbol'])
+
+
+def format_price(student_price) -> str:
+    return '{:4.2f}'.format(float(student_price)) + ' €' if student_price is not None else '-'
+
+
+def payload_hash(payload) -> str:
+    """
+    Get content hash of a JSON payload
+
+    :param payload: Decoded JSON payload
+    :return: Hex digest
+    """
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def normalize_meals(payload, mains_only=True) -> list:
+    """
+    Normalize a /meals payload into meals grouped by line in a single pass
+
+    :param payload: Decoded JSON list of meals
+    :param mains_only: Keep only meals with a student price above 1.00 €
+    :return: List of (line, list of Meal) tuples, lines in order of first appearance
+    """
+    if mains_only:
+        payload = [record for record in payload
+                   if record['prices'].get('students') is not None and record['prices']['students'] > 1.0]
+    symbols = meal_classifier.classify_many((record['name'], record['notes']) for record in payload)
+
+    lines = {}
+    for record, symbol in zip(payload, symbols):
+        line = record['category']
+        lines.setdefault(line, []).append(
+            Meal(record['id'], line, record['name'], record['notes'], record['prices'],
+                 format_price(record['prices'].get('students')), symbol))
+
+    return list(lines.items())
+
+
+def diff_lines(previous, current, mains_only=True) -> list:
+    """
+    Compare the dishes per line of two /meals payloads
+
+    :param previous: Previous payload
+    :param current: Current payload
+    :param mains_only: Compare main dishes only
+    :return: List of (line, previous list of Meal, current list of Meal) tuples for lines whose dishes changed,
+        in order of the current payload
+    """
+    before = dict(normalize_meals(previous, mains_only=mains_only))
+    after = dict(normalize_meals(current, mains_only=mains_only))
+    lines = list(after) + [line for line in before if line not in after]
+    return [(line, before.get(line, []), after.get(line, [])) for line in lines
+            if [meal.name for meal in before.get(line, [])] != [meal.name for meal in after.get(line, [])]]
@@ -1,11 +1,19 @@
 import datetime
-import math
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 
-import pandas as pd
-import numpy as np
-import requests
+import config
+from model.cache import TTLCache
+from model.client import OpenMensaClient
+from model.meals import normalize_meals, payload_hash
+from model.opening import OpeningCalendar
+from utils.table import SimpleTable
+from utils.utils import prettify_table
 
-from utils.utils import get_symbol, pretty_print_table, prettify_table
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 class Mensa:
@@ -14,16 +22,101 @@ class Mensa:
     See https://doc.openmensa.org/api/v2/ for more infos.
     """
 
-    base_url = 'https://openmensa.org/api/v2/'  # Specify base URL for REST API
+    base_url = config.OPENMENSA_BASE_URL  # Specify base URL for REST API
+    cache = TTLCache(max_size=config.CACHE_MAX_SIZE)  # Process-wide response cache shared by all instances
+    client = OpenMensaClient(base_url)  # Pooled HTTP client shared by all instances
+    store = None  # Optional StateStore persisting fetched payloads, set at startup
+    calendars = {}  # Canteen ID -> OpeningCalendar shared by all instances
 
-    def __init__(self, mensa_id=31):
+    def __init__(self, mensa_id=config.DEFAULT_CANTEEN_ID):
         """
         Constructor for Mensa instance
 
         :param mensa_id: Mensa ID (defaults to 31 for KIT Mensa)
         """
         self.id = mensa_id
-        self.mensa_name = requests.get(f'{self.base_url}canteens/{self.id}').json().get('name')
+        self.mensa_name = self.get_info().get('name')
+
+    def _get_json(self, endpoint, path, params=None):
+        """
+        Get JSON response for path, served from the shared cache while fresh and refreshed in the background
+        while stale
+
+        :param endpoint: Endpoint kind ('canteen', 'days' or 'meals'), selects the TTL
+        :param path: Path relative to base URL
+        :param params: Query parameters
+        :return: Decoded JSON response
+        """
+        key = (endpoint, path, tuple(sorted(params.items())) if params else ())
+        return self.cache.get_or_fetch(key, lambda: self._fetch(endpoint, path, params=params),
+                                       ttl=config.CACHE_TTL[endpoint], stale_ttl=config.CACHE_STALE_TTL[endpoint])
+
+    def _fetch(self, endpoint, path, params=None):
+        payload = self.client.get_json(endpoint, path, params=params)
+        if self.store is not None:
+            self.store.save_payload((endpoint, path, tuple(sorted(params.items())) if params else ()), endpoint,
+                                    payload)
+        return payload
+
+    @classmethod
+    def warm_from_store(cls, store) -> int:
+        """
+        Fill the shared cache with payloads from the state store that are still fresh and register them as
+        fallback for the HTTP client, without any network calls
+
+        :param store: StateStore instance
+        :return: Number of payloads put into the cache
+        """
+        warmed = 0
+        now = time.time()
+        for key, endpoint, payload, fetched_at in store.load_payloads():
+            _, path, params = key
+            cls.client.remember(path, params, payload)
+            remaining = fetched_at + config.CACHE_TTL[endpoint] - now
+            if remaining + config.CACHE_STALE_TTL[endpoint] > 0:
+                # Expired payloads within their grace period are served right away and refreshed on first use
+                cls.cache.set(key, payload, ttl=remaining, stale_ttl=config.CACHE_STALE_TTL[endpoint])
+                warmed += 1
+        return warmed
+
+    @classmethod
+    def get_canteens(cls) -> list:
+        """
+        Get all canteens, fetched in batches of concurrent pages and cached for a long time
+
+        :return: List of canteen infos as json
+        """
+        return cls.cache.get_or_fetch(('directory', 'canteens', ()), cls._fetch_canteens,
+                                      ttl=config.CACHE_TTL['directory'], stale_ttl=config.CACHE_STALE_TTL['directory'])
+
+    @classmethod
+    def _fetch_canteens(cls) -> list:
+        def fetch(page):
+            return cls.client.get_json('directory', 'canteens',
+                                       params={'limit': config.DIRECTORY_PAGE_SIZE, 'page': page})
+
+        canteens = []
+        first_page = 1
+        with ThreadPoolExecutor(max_workers=config.PREFETCH_WORKERS) as executor:
+            while True:
+                pages = list(executor.map(fetch, range(first_page, first_page + config.PREFETCH_WORKERS)))
+                for page in pages:
+                    canteens.extend(page)
+                if len(pages[-1]) < config.DIRECTORY_PAGE_SIZE:
+                    break
+                first_page += len(pages)
+
+        if cls.store is not None:
+            cls.store.save_payload(('directory', 'canteens', ()), 'directory', canteens)
+        return canteens
+
+    @classmethod
+    def cache_stats(cls) -> dict:
+        return cls.cache.stats()
+
+    @classmethod
+    def request_stats(cls) -> dict:
+        return cls.client.stats()
 
     def get_info(self) -> dict:
         """
@@ -31,7 +124,7 @@ class Mensa:
 
         :return: Mensa info as json
         """
-        return requests.get(f'{self.base_url}canteens/{self.id}').json()
+        return self._get_json('canteen', f'canteens/{self.id}')
 
     def print_formatted_info(self) -> None:
         for key, value in self.get_info().items():
@@ -43,12 +136,48 @@ class Mensa:
 
         :return:
         """
-        return requests.get(f'{self.base_url}canteens/{self.id}/days', params={'start': datetime.date.today()}).json()
+        return self._get_json('days', f'canteens/{self.id}/days', params={'start': str(datetime.date.today())})
 
-    def is_open(self, date=datetime.date.today()):
-        opening_days = pd.DataFrame.from_records(self.get_days(), index='date')
-        opening_days.index = pd.DatetimeIndex(opening_days.index)
-        return not opening_days.loc[date, 'closed']
+    def calendar(self) -> OpeningCalendar:
+        """
+        Get opening calendar, refreshed here only if it is missing or outdated; the prefetch job keeps it fresh
+
+        :return: OpeningCalendar instance
+        """
+        calendar = self.calendars.get(self.id)
+        if calendar is None or not calendar.covers(datetime.date.today()) \
+                or (datetime.datetime.now() - calendar.updated).total_seconds() > config.CALENDAR_MAX_AGE:
+            calendar = self.refresh_calendar()
+        return calendar
+
+    def refresh_calendar(self, days=None) -> OpeningCalendar:
+        """
+        Merge opening days into the calendar
+
+        :param days: /days payload, fetched if None
+        :return: OpeningCalendar instance
+        """
+        calendar = self.calendars.setdefault(self.id, OpeningCalendar())
+        calendar.update(days if days is not None else self.get_days())
+        return calendar
+
+    def is_open(self, date=None) -> bool:
+        """
+        Check whether the mensa is open
+
+        :param date: Date, defaults to today
+        :return: False if closed or unknown
+        """
+        return self.calendar().is_open(date if date is not None else datetime.date.today())
+
+    def next_open_day(self, date=None):
+        """
+        Get first open day on or after date
+
+        :param date: Date, defaults to today
+        :return: Date or None if no open day is known
+        """
+        return self.calendar().next_open_day(date if date is not None else datetime.date.today())
 
     def get_daily_menu(self, offset=0) -> dict:
         """
@@ -57,82 +186,246 @@ class Mensa:
         :return: Today's menu as json
         """
 
-        return requests.get(
-            f'{self.base_url}canteens/{self.id}/days/{datetime.date.today() + datetime.timedelta(days=offset)}/meals').json()
+        return self.get_menu(datetime.date.today() + datetime.timedelta(days=offset))
 
-    def meal_data(self, offset=0, mains_only=True) -> pd.DataFrame:
+    def get_menu(self, date) -> dict:
         """
-        Return DataFrame containing today's menu
+        Get menu for date
 
-        :return:
+        :param date: Date of the menu
+        :return: Menu as json
+        """
+        return self._get_json('meals', self._meals_path(date))
+
+    def _meals_path(self, date) -> str:
+        return f'canteens/{self.id}/days/{date}/meals'
+
+    def prefetch(self, days=7) -> dict:
         """
-        df = pd.DataFrame.from_records(self.get_daily_menu(offset=offset), index='category')
-        # df.set_index(['category', 'name'], inplace=True)
+        Fetch the opening days calendar and the menus of all open days within the next days concurrently
+        and store them in the shared cache
 
-        if mains_only:
-            df = df.loc[df['prices'].apply(lambda x: x.get('students')) > 1.0]
+        :param days: Number of days to prefetch, starting today
+        :return: Dict of date string -> menu as json
+        """
+        start = datetime.date.today()
+        params = {'start': str(start)}
+        calendar = self._fetch('days', f'canteens/{self.id}/days', params=params)
+        self.cache.set(('days', f'canteens/{self.id}/days', tuple(params.items())), calendar,
+                       ttl=config.CACHE_TTL['days'], stale_ttl=config.CACHE_STALE_TTL['days'])
 
-        df['price'] = df['prices'].apply(
-            lambda x: '{:4.2f}'.format(float(x.get('students'))) + ' €' if x.get(
-                'students') is not None else '-')  # Extract student prices
+        open_days = [str(date) for date in self.refresh_calendar(calendar).open_days(
+            start, start + datetime.timedelta(days=days - 1))]
 
-        df['symbol'] = df.apply(lambda x: get_symbol(x['name'], x['notes']), axis=1)
-        df.set_index('name', append=True, inplace=True)
+        def fetch(date):
+            return date, self._fetch('meals', self._meals_path(date))
 
-        df.drop(columns=['id', 'prices'], inplace=True)
+        with ThreadPoolExecutor(max_workers=config.PREFETCH_WORKERS) as executor:
+            menus = dict(executor.map(fetch, open_days))
 
-        print(df)
+        for date, menu in menus.items():
+            self.cache.set(('meals', self._meals_path(date), ()), menu, ttl=config.CACHE_TTL['meals'],
+                           stale_ttl=config.CACHE_STALE_TTL['meals'])
 
-        return df
+        return menus
 
-    def meal_data_lines(self, offset=0):
-        return self.meal_data(offset=offset).groupby(level=0, sort=False)
+    def refresh_menu(self, date):
+        """
+        Revalidate the menu for date with a conditional request and swap it into the shared cache.
+        Readers keep getting the previous payload until the new one is in place.
+
+        :param date: Date of the menu
+        :return: Tuple of (previous payload or None, current payload) if the content changed, otherwise None
+        """
+        path = self._meals_path(date)
+        key = ('meals', path, ())
+        previous = self.cache.peek(key)
+        current = self.client.get_json('meals', path)
+        self.cache.set(key, current, ttl=config.CACHE_TTL['meals'], stale_ttl=config.CACHE_STALE_TTL['meals'])
+
+        if current is previous or (previous is not None and payload_hash(previous) == payload_hash(current)):
+            return None
+        if self.store is not None:
+            self.store.save_payload(key, 'meals', current)
+        return previous, current
+
+    def meal_data(self, offset=0, mains_only=True) -> 'pd.DataFrame':
+        """
+        Return DataFrame containing today's menu
+
+        :return: DataFrame indexed by line and meal name with notes, price and symbol columns
+        """
+        pd = config.import_pandas()
+        records = [{'category': meal.line, 'name': meal.name, 'notes': meal.notes, 'price': meal.price,
+                    'symbol': meal.symbol}
+                   for line, meals in self.meal_data_lines(offset=offset, mains_only=mains_only) for meal in meals]
+
+        return pd.DataFrame.from_records(records, columns=['category', 'name', 'notes', 'price', 'symbol'],
+                                         index=['category', 'name'])
+
+    def meal_data_lines(self, offset=0, mains_only=True) -> list:
+        """
+        Get today's meals grouped by line
+
+        :return: List of (line, list of Meal) tuples
+        """
+        return normalize_meals(self.get_daily_menu(offset=offset), mains_only=mains_only)
 
 
 class PollData:
+    """
+    Vote store for a scheduling poll.
+    Each user owns a slot in preallocated arrays and their votes are kept as a bitmask over the option list,
+    with the last bit marking users who dealt themselves out.
+    Totals, attendees and the current choice are updated incrementally on every vote change.
+    """
+
+    initial_capacity = 16
+
     def __init__(self, option_list):
-        self.data = pd.DataFrame(columns=option_list, dtype='int8')
-        self.data.index.name = 'user_id'
+        """
+        Constructor for PollData instance
+
+        :param option_list: List of option labels
+        """
+        if len(option_list) >= 64:
+            raise ValueError('PollData supports at most 63 options.')
+
+        self.options = list(option_list)
         self.active = True
 
-    def get_data(self):
-        return self.data
+        self._bits = {option: 1 << num for num, option in enumerate(self.options)}
+        self._bits['Out'] = 1 << len(self.options)
+        self._times_mask = self._bits['Out'] - 1
+        self._has_out = False  # 'Out' row is shown once someone chose, declined or went flexible
+
+        self._slots = {}  # user key -> slot index
+        self._names = []  # slot index -> display name
+        self._masks = array('Q', bytes(8 * self.initial_capacity))
+
+        self._columns = self.options + ['Out']  # bit position -> option
+        self._attendees = [set() for _ in self._columns]  # bit position -> slots
+        self._attendee_text = ['' for _ in self._columns]
+        self._max_votes = 0
+        self._choices = []  # bit positions of the options currently holding the max
+        self._table = SimpleTable()  # Results table, re-rendering only rows whose votes changed
+
+    def _slot(self, user_first_name, user_id=None) -> int:
+        key = user_id if user_id is not None else user_first_name
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = len(self._names)
+            if slot == len(self._masks):
+                self._masks.extend(array('Q', bytes(8 * len(self._masks))))
+            self._slots[key] = slot
+            self._names.append(user_first_name)
+        return slot
+
+    @property
+    def show_out(self) -> bool:
+        return self._has_out
+
+    def get_vote(self, user_first_name, user_id=None) -> tuple:
+        """
+        Get vote of user
+
+        :param user_first_name: First name of user
+        :param user_id: User ID
+        :return: Tuple of (user key, display name, vote mask)
+        """
+        key = user_id if user_id is not None else user_first_name
+        slot = self._slot(user_first_name, user_id)
+        return key, self._names[slot], self._masks[slot]
+
+    def get_votes(self) -> list:
+        """
+        Get votes of all users in the order they joined the poll
+
+        :return: List of (user key, display name, vote mask) tuples
+        """
+        return [(key, self._names[slot], self._masks[slot]) for key, slot in self._slots.items()]
+
+    def restore(self, votes, show_out) -> None:
+        """
+        Restore votes, e.g. from the state store
+
+        :param votes: List of (user key, display name, vote mask) tuples
+        :param show_out: Whether the 'Out' row is shown
+        """
+        self._has_out = show_out
+        for key, name, mask in votes:
+            self._update(self._slot(name, user_id=key), mask)
+
+    def _update(self, slot, mask) -> None:
+        """
+        Set a user's vote mask and update totals, attendees and the choice for the changed options only
 
-    def set_choice(self, user_first_name, option):
-        self.data.loc[user_first_name, option] = 1
-        self.data.loc[user_first_name, 'Out'] = 0
+        :param slot: Slot index of user
+        :param mask: New vote mask
+        """
+        changed = self._masks[slot] ^ mask
+        self._masks[slot] = mask
+
+        bit = 0
+        while changed:
+            if changed & 1:
+                if mask >> bit & 1:
+                    self._attendees[bit].add(slot)
+                else:
+                    self._attendees[bit].discard(slot)
+                self._attendee_text[bit] = ', '.join(self._names[attendee]
+                                                     for attendee in sorted(self._attendees[bit]))
+            changed >>= 1
+            bit += 1
+
+        totals = [len(attendees) for attendees in self._attendees]
+        self._max_votes = max(totals) if self._has_out else max(totals[:-1])
+        self._choices = [num for num, total in enumerate(totals[:-1]) if total == self._max_votes] \
+            if self._max_votes != 0 else []
+
+    def get_data(self) -> 'pd.DataFrame':
+        """
+        Get votes as DataFrame indexed by user
+
+        :return: DataFrame with one int8 column per option
+        """
+        columns = self.options + ['Out'] if self._has_out else self.options
+        rows = [[int(bool(mask & self._bits[option])) for option in columns]
+                for mask in self._masks[:len(self._names)]]
+        pd = config.import_pandas()
+        data = pd.DataFrame(rows, index=self._names, columns=columns, dtype='int8')
+        data.index.name = 'user_id'
+        return data
+
+    def set_choice(self, user_first_name, option, user_id=None):
+        slot = self._slot(user_first_name, user_id)
+        self._has_out = True
+        self._update(slot, (self._masks[slot] | self._bits[option]) & ~self._bits['Out'])
 
     def calculate_stats(self):
-        times = self.data.T.apply(lambda x: ', '.join(x.loc[x == 1].index.tolist()), axis=1). \
-            rename('attendees',
-                   inplace=True).to_frame()
-        times['total'] = self.data.T.apply(lambda x: int(np.sum(x)) if not np.isnan(np.sum(x)) else 0, axis=1)
-
-        max_votes = times['total'].max()
-        times['is_choice'] = times['total'].apply(lambda x: x == max_votes if max_votes != 0 else False)
-        times.loc['Out', 'is_choice'] = None
-        unique_max = np.sum(times['is_choice']) == 1
-        shared_max = np.sum(times['is_choice']) > 1
-        print(times)
-        print(f'Unique max: {unique_max}')
-        print(f'Shared max: {shared_max}')
-        times.reset_index(inplace=True)
-        times.columns = ['time', 'attendees', 'total', 'is_choice']
-
-        return times, unique_max, shared_max
+        """
+        Get attendees and totals per option from the incrementally maintained state
+
+        :return: List of (option, attendees, total, is_choice) tuples, unique max flag, shared max flag
+        """
+        n_columns = len(self._columns) if self._has_out else len(self.options)
+        choices = set(self._choices)
+        times = [(self._columns[num], self._attendee_text[num], len(self._attendees[num]), num in choices)
+                 for num in range(n_columns)]
+
+        return times, len(choices) == 1, len(choices) > 1
 
     def get_results(self):
         times, unique_max, shared_max = self.calculate_stats()
-        times['time'] = times.apply(lambda x: str(f'{x["time"]} ({x["total"]}):'), axis=1)
-        times['attendees'] = times.apply(
-            lambda x: str(f'{x["attendees"]} ✔') if (x['is_choice'] == 1 and unique_max) else
-            f'{x["attendees"]} ❎' if (x['is_choice'] == 1 and shared_max)
-            else x['attendees'], axis=1)
+        table = []
+        for option, attendees, total, is_choice in times:
+            if is_choice and unique_max:
+                attendees = f'{attendees} ✔'
+            elif is_choice and shared_max:
+                attendees = f'{attendees} ❎'
+            table.append([f'{option} ({total}):', attendees])
 
-        times.set_index('time', inplace=True)
-        times.drop(columns=['total', 'is_choice'], inplace=True)
-        print(prettify_table(times, show_index=True, tablefmt='simple'))
-        return prettify_table(times, show_index=True, tablefmt='simple')
+        return self._table.render(table)
 
         # 'plain', 'simple', 'grid', 'pipe', 'orgtbl', 'rst', 'mediawiki', 'latex', 'latex_raw' and 'latex_booktabs
 
@@ -140,25 +433,31 @@ class PollData:
         result = None
         text = None
         times, unique_max, shared_max = self.calculate_stats()
+        choices = [(option, attendees) for option, attendees, total, is_choice in times if is_choice]
         if unique_max:
-            result = times.loc[times['is_choice'] == 1].iloc[0]
-            print(result['time'])
-            text = f'Chosen time: {result["time"]}\n' \
-                   f'Attendees: {result["attendees"]}'
+            option, attendees = choices[0]
+            text = f'Chosen time: {option}\n' \
+                   f'Attendees: {attendees}'
         elif shared_max:
-            result = prettify_table(times.loc[times['is_choice'] == 1].set_index('time')[['attendees']],
-                                    show_index=True, tablefmt='simple')
+            result = prettify_table([list(choice) for choice in choices], tablefmt='simple')
             text = f'Options:\n\n' \
                    f'{result}'
 
         return text
 
-    def delete_user(self, user_first_name, times_only=False):
+    def delete_user(self, user_first_name, times_only=False, user_id=None):
+        slot = self._slot(user_first_name, user_id)
         if times_only:
-            self.data.loc[user_first_name, [col for col in self.data.columns if col != 'Out']] = 0
+            self._update(slot, self._masks[slot] & self._bits['Out'])
         else:
-            self.data.loc[user_first_name, :] = 0
+            self._update(slot, 0)
+
+    def decline_user(self, user_first_name, user_id=None):
+        slot = self._slot(user_first_name, user_id)
+        self._has_out = True
+        self._update(slot, self._bits['Out'])
 
-    def checkall_user(self, user_first_name):
-        self.data.loc[user_first_name, [col for col in self.data.columns if col != 'Out']] = 1
-        self.data.loc[user_first_name, 'Out'] = 0
+    def checkall_user(self, user_first_name, user_id=None):
+        slot = self._slot(user_first_name, user_id)
+        self._has_out = True
+        self._update(slot, self._times_mask)
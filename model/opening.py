@@ -0,0 +1,90 @@
+import bisect
+import datetime
+import threading
+
+
+class OpeningCalendar:
+    """
+    Opening days of a canteen as sorted date lists, answering lookups and range queries by bisection.
+    Updates merge fetched /days payloads into the known range instead of rebuilding it.
+    """
+
+    def __init__(self):
+        # (sorted known dates, closed flag per known date, sorted open dates), replaced as a whole on every update
+        # so readers taking it once always see matching lists
+        self._state = ((), (), ())
+        self.updated = None  # Time of last update
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._state[0])
+
+    def update(self, days, keep_past=1) -> int:
+        """
+        Merge a /days payload: known dates within the payload's range are replaced, others kept
+
+        :param days: Decoded JSON list of {'date', 'closed'} dicts
+        :param keep_past: Number of past days to keep
+        :return: Number of dates whose state changed
+        """
+        fetched = sorted((datetime.date.fromisoformat(day['date']), bool(day['closed'])) for day in days)
+        cutoff = datetime.date.today() - datetime.timedelta(days=keep_past)
+
+        with self._lock:
+            known = dict(zip(*self._state[:2]))
+            if fetched:
+                first, last = fetched[0][0], fetched[-1][0]
+                merged = [(date, closed) for date, closed in known.items()
+                          if (date < first or date > last) and date >= cutoff]
+                merged.extend(fetched)
+                merged.sort()
+            else:
+                merged = [(date, closed) for date, closed in known.items() if date >= cutoff]
+
+            changed = sum(1 for date, closed in fetched if known.get(date) != closed)
+            dates = tuple(date for date, _ in merged)
+            closed_flags = tuple(closed for _, closed in merged)
+            open_dates = tuple(date for date, closed in merged if not closed)
+
+            # One assignment swaps all lists at once, readers never see a partial update
+            self._state = (dates, closed_flags, open_dates)
+            self.updated = datetime.datetime.now()
+
+        return changed
+
+    def covers(self, date) -> bool:
+        dates = self._state[0]
+        return bool(dates) and dates[0] <= date <= dates[-1]
+
+    def is_open(self, date) -> bool:
+        """
+        Check whether the canteen is open on date
+
+        :param date: Date
+        :return: False for closed and unknown dates
+        """
+        dates, closed, _ = self._state
+        position = bisect.bisect_left(dates, date)
+        return position < len(dates) and dates[position] == date and not closed[position]
+
+    def next_open_day(self, date):
+        """
+        Get first open day on or after date
+
+        :param date: Date
+        :return: Date or None if no later open day is known
+        """
+        open_dates = self._state[2]
+        position = bisect.bisect_left(open_dates, date)
+        return open_dates[position] if position < len(open_dates) else None
+
+    def open_days(self, start, end) -> list:
+        """
+        Get open days within a range
+
+        :param start: First date
+        :param end: Last date, inclusive
+        :return: Sorted list of dates
+        """
+        open_dates = self._state[2]
+        return list(open_dates[bisect.bisect_left(open_dates, start):bisect.bisect_right(open_dates, end)])
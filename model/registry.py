@@ -0,0 +1,117 @@
+import threading
+import time
+
+
+class PollRegistry:
+    """
+    Registry of polls keyed by chat ID and message ID.
+    Each chat has its own lock so votes in one chat never wait for another chat.
+    """
+
+    def __init__(self):
+        self._polls = {}  # chat_id -> {message_id: (poll, registered_at)}
+        self._active = {}  # chat_id -> message_id of the active poll
+        self._chat_locks = {}  # chat_id -> lock guarding the chat's polls
+        self._lock = threading.Lock()  # Guards the dicts above, held only briefly
+
+    def lock(self, chat_id) -> threading.RLock:
+        """
+        Get lock for chat, to be held while reading or changing the chat's polls
+
+        :param chat_id: Chat ID
+        :return: Reentrant lock of chat
+        """
+        with self._lock:
+            return self._chat_locks.setdefault(chat_id, threading.RLock())
+
+    def register(self, chat_id, message_id, poll) -> None:
+        """
+        Register poll as the active poll of chat, deactivating the previous one
+
+        :param chat_id: Chat ID
+        :param message_id: ID of the poll message
+        :param poll: PollData instance
+        """
+        with self.lock(chat_id):
+            previous = self.get_active(chat_id)
+            if previous is not None:
+                previous[1].active = False
+            with self._lock:
+                self._polls.setdefault(chat_id, {})[message_id] = (poll, time.time())
+                self._active[chat_id] = message_id
+
+    def get(self, chat_id, message_id):
+        """
+        Get poll by chat and message ID
+
+        :param chat_id: Chat ID
+        :param message_id: ID of the poll message
+        :return: PollData instance or None
+        """
+        with self._lock:
+            entry = self._polls.get(chat_id, {}).get(message_id)
+        return entry[0] if entry is not None else None
+
+    def get_active(self, chat_id):
+        """
+        Get active poll of chat
+
+        :param chat_id: Chat ID
+        :return: Tuple of (message_id, PollData) or None
+        """
+        with self._lock:
+            message_id = self._active.get(chat_id)
+            entry = self._polls.get(chat_id, {}).get(message_id)
+        if entry is None or not entry[0].active:
+            return None
+        return message_id, entry[0]
+
+    def close(self, chat_id, message_id):
+        """
+        Mark poll as closed
+
+        :param chat_id: Chat ID
+        :param message_id: ID of the poll message
+        :return: Closed PollData instance or None if it was not active
+        """
+        with self.lock(chat_id):
+            poll = self.get(chat_id, message_id)
+            if poll is None or not poll.active:
+                return None
+            poll.active = False
+            with self._lock:
+                if self._active.get(chat_id) == message_id:
+                    del self._active[chat_id]
+            return poll
+
+    def evict(self, closed_after, stale_after) -> int:
+        """
+        Remove closed polls and polls that were never closed once they reach the given age
+
+        :param closed_after: Age in seconds after which closed polls are removed
+        :param stale_after: Age in seconds after which any poll is removed
+        :return: Number of removed polls
+        """
+        now = time.time()
+        removed = 0
+        with self._lock:
+            for chat_id in list(self._polls):
+                polls = self._polls[chat_id]
+                for message_id, (poll, registered_at) in list(polls.items()):
+                    age = now - registered_at
+                    if age > stale_after or (not poll.active and age > closed_after):
+                        del polls[message_id]
+                        removed += 1
+                        if self._active.get(chat_id) == message_id:
+                            del self._active[chat_id]
+                if not polls:
+                    del self._polls[chat_id]
+                    chat_lock = self._chat_locks.get(chat_id)
+                    if chat_lock is not None and chat_lock.acquire(blocking=False):
+                        del self._chat_locks[chat_id]
+                        chat_lock.release()
+        return removed
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(polls) for polls in self._polls.values())
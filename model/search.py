@@ -0,0 +1,158 @@
+import bisect
+import datetime
+import re
+import threading
+
+import config
+from model.meals import normalize_meals, payload_hash
+from utils.utils import SYMBOLS
+
+DIETS = {'vegan': {SYMBOLS['vegan']},
+         'vegetarian': {SYMBOLS['vegan'], SYMBOLS['vegetarisch']},
+         'meat': {SYMBOLS[key] for key in ('fleisch', 'hnchen', 'schwein', 'rinder')}}
+DIET_ALIASES = {'vegan': 'vegan', 'vegetarian': 'vegetarian', 'vegetarisch': 'vegetarian', 'veggie': 'vegetarian',
+                'meat': 'meat', 'fleisch': 'meat'}
+
+TOKEN_PATTERN = re.compile(r'\w+')
+PRICE_PATTERN = re.compile(r'^(?:<=?|max:?)(\d+(?:[.,]\d+)?)€?$|^(\d+[.,]\d+|\d+€)€?$')
+MIN_SUFFIX_LENGTH = 3
+
+
+def tokenize(text) -> list:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class MenuIndex:
+    """
+    Inverted index over the meals of several days.
+    Every suffix of every token in a meal's name and line is a term, so query words match anywhere inside
+    German compound words; the sorted vocabulary turns a query word into a range of terms via bisection.
+    """
+
+    max_memo_size = 4096
+
+    def __init__(self, days):
+        """
+        Constructor for MenuIndex instance
+
+        :param days: List of (date, list of (line, list of Meal)) tuples
+        """
+        self.entries = []  # entry id -> (date, Meal)
+        postings = {}
+        self._diets = {diet: set() for diet in DIETS}
+        self._prices = []  # entry id -> student price or None
+
+        for date, lines in days:
+            for line, meals in lines:
+                for meal in meals:
+                    entry = len(self.entries)
+                    self.entries.append((date, meal))
+                    self._prices.append(meal.prices.get('students'))
+                    for diet, symbols in DIETS.items():
+                        if meal.symbol in symbols:
+                            self._diets[diet].add(entry)
+                    for token in set(tokenize(meal.name) + tokenize(line)):
+                        for start in range(max(len(token) - MIN_SUFFIX_LENGTH, 0) + 1):
+                            postings.setdefault(token[start:], set()).add(entry)
+
+        self._vocabulary = sorted(postings)
+        self._postings = [frozenset(postings[term]) for term in self._vocabulary]
+        self._memo = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _lookup(self, word) -> frozenset:
+        """
+        Get entries with a term starting with word
+
+        :param word: Lower case query word
+        :return: Set of entry ids
+        """
+        entries = self._memo.get(word)
+        if entries is None:
+            entries = set()
+            position = bisect.bisect_left(self._vocabulary, word)
+            while position < len(self._vocabulary) and self._vocabulary[position].startswith(word):
+                entries.update(self._postings[position])
+                position += 1
+            entries = frozenset(entries)
+            if len(self._memo) >= self.max_memo_size:
+                self._memo.clear()
+            self._memo[word] = entries
+        return entries
+
+    def search(self, query, limit=50) -> list:
+        """
+        Find meals matching all words of query.
+        Words are matched against meal names and lines, diet words (vegan, vegetarian, meat) against the meal
+        symbol and prices such as '<4', 'max 3.5' or '2.50€' against the student price.
+
+        :param query: Query text
+        :param limit: Maximum number of results
+        :return: List of (date, Meal) tuples in menu order
+        """
+        candidates = []
+        max_price = None
+        words = query.lower().replace('max ', 'max').replace('< ', '<').replace(' €', '€').split()
+        for word in words:
+            price = PRICE_PATTERN.match(word)
+            if price is not None:
+                value = float((price.group(1) or price.group(2)).rstrip('€').replace(',', '.'))
+                max_price = value if max_price is None else min(max_price, value)
+                continue
+            for token in tokenize(word):
+                diet = DIET_ALIASES.get(token)
+                candidates.append(self._diets[diet] if diet is not None else self._lookup(token))
+
+        if candidates:
+            candidates.sort(key=len)
+            matches = set(candidates[0]).intersection(*candidates[1:])
+        else:
+            matches = range(len(self.entries))
+
+        if max_price is not None:
+            matches = [entry for entry in matches
+                       if self._prices[entry] is not None and self._prices[entry] <= max_price]
+
+        return [self.entries[entry] for entry in sorted(matches)[:limit]]
+
+
+_indexes = {}  # canteen ID -> (payloads, content hash, MenuIndex)
+_lock = threading.Lock()
+
+
+def _same_payloads(old, new) -> bool:
+    # Cached payloads are returned as the same objects while fresh, so identity avoids hashing on every query
+    return len(old) == len(new) and all(old_date == new_date and old_payload is new_payload
+                                        for (old_date, old_payload), (new_date, new_payload) in zip(old, new))
+
+
+def get_index(mensa, days=config.PREFETCH_DAYS) -> MenuIndex:
+    """
+    Get search index over the menus of the open days within the next days.
+    Payloads come from the shared response cache; the index is only rebuilt when their content changes.
+
+    :param mensa: Mensa instance
+    :param days: Number of days, starting today
+    :return: MenuIndex instance
+    """
+    start = datetime.date.today()
+    payloads = [(str(date), mensa.get_menu(date))
+                for date in mensa.calendar().open_days(start, start + datetime.timedelta(days=days - 1))]
+
+    cached = _indexes.get(mensa.id)
+    if cached is not None and _same_payloads(cached[0], payloads):
+        return cached[2]
+
+    with _lock:
+        content_hash = payload_hash(payloads)
+        cached = _indexes.get(mensa.id)
+        if cached is not None and cached[1] == content_hash:
+            index = cached[2]
+        else:
+            index = MenuIndex([(datetime.date.fromisoformat(date), normalize_meals(payload, mains_only=False))
+                               for date, payload in payloads])
+        _indexes[mensa.id] = (payloads, content_hash, index)
+
+    return index
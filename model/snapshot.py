@@ -0,0 +1,193 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import config
+from model.client import OpenMensaUnavailable
+from model.meals import payload_hash
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    endpoint TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+'''
+
+
+class MenuSnapshot:
+    """
+    Shared SQLite file (WAL mode) with the latest OpenMensa response per request, written by one process and read
+    by many. Connections memory-map the database, so reading an unchanged snapshot does not copy it.
+    """
+
+    def __init__(self, path=config.MENU_SNAPSHOT_PATH, mmap_size=64 * 1024 * 1024):
+        """
+        Constructor for MenuSnapshot instance
+
+        :param path: Path of the database file
+        :param mmap_size: Maximum number of bytes of the database memory-mapped by each connection
+        """
+        self.path = path
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self._published = {}  # key -> (last published payload, content hash)
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, SQLite connections must not be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def key(path, params=None) -> str:
+        return json.dumps([path, sorted(dict(params).items()) if params else []])
+
+    def publish(self, endpoint, path, params, payload) -> bool:
+        """
+        Store payload as latest response for path; if the content did not change, only its fetch time is updated
+
+        :param endpoint: Endpoint kind
+        :param path: Path relative to base URL
+        :param params: Query parameters
+        :param payload: Decoded JSON payload
+        :return: True if the content changed
+        """
+        key = self.key(path, params)
+        previous = self._published.get(key)
+        # Conditional requests return the previous payload object itself if nothing changed
+        digest = previous[1] if previous is not None and previous[0] is payload else payload_hash(payload)
+        self._published[key] = (payload, digest)
+
+        connection = self._connection()
+        with connection:
+            if connection.execute('UPDATE responses SET fetched_at = ? WHERE key = ? AND hash = ?',
+                                  (time.time(), key, digest)).rowcount:
+                return False
+            connection.execute('INSERT OR REPLACE INTO responses (key, endpoint, hash, payload, fetched_at) '
+                               'VALUES (?, ?, ?, ?, ?)', (key, endpoint, digest, json.dumps(payload), time.time()))
+        return True
+
+    def version(self, key):
+        """
+        Get content hash and fetch time of the response stored under key
+
+        :param key: Snapshot key
+        :return: Tuple of (hash, fetched_at) or None
+        """
+        return self._connection().execute('SELECT hash, fetched_at FROM responses WHERE key = ?', (key,)).fetchone()
+
+    def load(self, key):
+        """
+        Get content hash and decoded payload of the response stored under key
+
+        :param key: Snapshot key
+        :return: Tuple of (hash, payload) or None
+        """
+        row = self._connection().execute('SELECT hash, payload FROM responses WHERE key = ?', (key,)).fetchone()
+        return (row[0], json.loads(row[1])) if row is not None else None
+
+
+class SnapshotClient:
+    """
+    Read-only OpenMensa client serving responses from a MenuSnapshot, with the interface of OpenMensaClient.
+    A payload is decoded once per content hash, so unchanged responses are returned as the same object.
+    Responses missing from the snapshot or older than their cache lifetime go through the fallback client.
+    """
+
+    def __init__(self, snapshot, fallback=None):
+        """
+        Constructor for SnapshotClient instance
+
+        :param snapshot: MenuSnapshot to read from
+        :param fallback: OpenMensaClient for responses the snapshot cannot serve, None to raise OpenMensaUnavailable
+        """
+        self.snapshot = snapshot
+        self.fallback = fallback
+        self.hits = 0
+        self.misses = 0
+        self._decoded = {}  # key -> (content hash, payload)
+        self._lock = threading.Lock()
+
+    def get_json(self, endpoint, path, params=None):
+        """
+        Get decoded JSON for path from the snapshot
+
+        :param endpoint: Endpoint kind, selects how old a snapshot response may be
+        :param path: Path relative to base URL
+        :param params: Query parameters
+        :return: Decoded JSON response
+        """
+        key = self.snapshot.key(path, params)
+        version = self.snapshot.version(key)
+        if version is not None and time.time() - version[1] < config.CACHE_TTL[endpoint] + \
+                config.CACHE_STALE_TTL[endpoint]:
+            with self._lock:
+                self.hits += 1
+                decoded = self._decoded.get(key)
+            if decoded is not None and decoded[0] == version[0]:
+                return decoded[1]
+            decoded = self.snapshot.load(key)
+            with self._lock:
+                self._decoded[key] = decoded
+            return decoded[1]
+
+        with self._lock:
+            self.misses += 1
+        if self.fallback is None:
+            raise OpenMensaUnavailable(f'No recent snapshot of {path}')
+        return self.fallback.get_json(endpoint, path, params=params)
+
+    def remember(self, path, params, payload) -> None:
+        if self.fallback is not None:
+            self.fallback.remember(path, params, payload)
+
+    def stats(self) -> dict:
+        """
+        Get request timing stats of the fallback client and snapshot hits and misses
+
+        :return: Dict of endpoint -> stats, with snapshot counters under 'snapshot'
+        """
+        stats = self.fallback.stats() if self.fallback is not None else {}
+        with self._lock:
+            stats['snapshot'] = {'hits': self.hits, 'misses': self.misses}
+        return stats
+
+
+class PublishingClient:
+    """
+    OpenMensa client wrapper publishing every response to a MenuSnapshot, used by the process owning the snapshot
+    """
+
+    def __init__(self, client, snapshot):
+        """
+        Constructor for PublishingClient instance
+
+        :param client: OpenMensaClient fetching the responses
+        :param snapshot: MenuSnapshot to publish to
+        """
+        self.client = client
+        self.snapshot = snapshot
+
+    def get_json(self, endpoint, path, params=None):
+        payload = self.client.get_json(endpoint, path, params=params)
+        self.snapshot.publish(endpoint, path, params, payload)
+        return payload
+
+    def remember(self, path, params, payload) -> None:
+        self.client.remember(path, params, payload)
+
+    def stats(self) -> dict:
+        return self.client.stats()
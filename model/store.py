@@ -0,0 +1,319 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS polls (
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    options TEXT NOT NULL,
+    active INTEGER NOT NULL,
+    show_out INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    closed REAL,
+    PRIMARY KEY (chat_id, message_id)
+);
+CREATE TABLE IF NOT EXISTS votes (
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    user_key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    mask TEXT NOT NULL,
+    PRIMARY KEY (chat_id, message_id, user_key)
+);
+CREATE TABLE IF NOT EXISTS subscriptions (
+    chat_id INTEGER PRIMARY KEY,
+    active INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS change_subscriptions (
+    chat_id INTEGER PRIMARY KEY,
+    active INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chat_canteens (
+    chat_id INTEGER PRIMARY KEY,
+    canteen_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS payloads (
+    key TEXT PRIMARY KEY,
+    endpoint TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+'''
+
+_SUBSCRIPTION_TABLES = {'daily': 'subscriptions', 'changes': 'change_subscriptions'}
+
+
+class StateStore:
+    """
+    SQLite state store (WAL mode) for polls, votes, chat settings and OpenMensa payloads.
+    Writes are queued and committed in batches by a background thread, so callers never wait for disk.
+    """
+
+    def __init__(self, path=config.STATE_DB_PATH, flush_interval=config.STATE_FLUSH_INTERVAL,
+                 batch_size=config.STATE_BATCH_SIZE):
+        """
+        Constructor for StateStore instance
+
+        :param path: Path of the database file
+        :param flush_interval: Maximum number of seconds a write waits before being committed
+        :param batch_size: Maximum number of writes committed in one transaction
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.commits = 0
+        self.writes = 0
+
+        self._queue = queue.Queue()
+        self._writer = None
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+        connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def _submit(self, sql, params) -> None:
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name='StateStoreWriter', daemon=True)
+                self._writer.start()
+        self._queue.put((sql, params))
+
+    def _run(self) -> None:
+        connection = self._connect()
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1][0] is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            writes = [(sql, params) for sql, params in batch if sql is not None]
+            try:
+                with connection:
+                    for sql, params in writes:
+                        connection.execute(sql, params)
+            except Exception as error:
+                # Any error must not stop the writer, flush() would wait forever; retry the writes one by one so only
+                # the failing ones are lost
+                logger.error(f'Committing {len(writes)} writes to state store failed, retrying one by one: {error!r}')
+                for sql, params in writes:
+                    try:
+                        with connection:
+                            connection.execute(sql, params)
+                    except Exception as error:
+                        logger.error(f'Dropping write to state store: {error!r}')
+                    else:
+                        self.commits += 1
+                        self.writes += 1
+            else:
+                self.commits += 1
+                self.writes += len(writes)
+
+            # Markers carry an event to set once everything queued before them is committed
+            for sql, params in batch:
+                if sql is None:
+                    event, stop = params
+                    event.set()
+                    running = running and not stop
+        connection.close()
+
+    def flush(self, stop=False) -> None:
+        """
+        Block until all queued writes are committed
+
+        :param stop: Stop the writer thread afterwards
+        """
+        with self._lock:
+            if self._writer is None:
+                return
+            writer = self._writer
+            if stop:
+                self._writer = None
+        event = threading.Event()
+        self._queue.put((None, (event, stop)))
+        event.wait()
+        if stop:
+            writer.join()
+
+    def close(self) -> None:
+        self.flush(stop=True)
+
+    def save_poll(self, chat_id, message_id, poll, created=None) -> None:
+        """
+        Queue insert or update of a poll and its active flag
+
+        :param chat_id: Chat ID
+        :param message_id: ID of the poll message
+        :param poll: PollData instance
+        :param created: Creation timestamp, defaults to now
+        """
+        self._submit('INSERT INTO polls (chat_id, message_id, options, active, show_out, created) '
+                     'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (chat_id, message_id) DO UPDATE SET '
+                     'active = excluded.active, show_out = excluded.show_out, '
+                     'closed = CASE WHEN excluded.active THEN NULL ELSE ? END',
+                     (chat_id, message_id, json.dumps(poll.options), int(poll.active), int(poll.show_out),
+                      created if created is not None else time.time(), time.time()))
+
+    def save_vote(self, chat_id, message_id, user_key, name, mask) -> None:
+        """
+        Queue insert or update of a user's vote mask
+
+        :param chat_id: Chat ID
+        :param message_id: ID of the poll message
+        :param user_key: User ID (or first name for users without ID)
+        :param name: Display name of user
+        :param mask: Vote mask over the poll options, stored as hex text as it may exceed SQLite's 64-bit integers
+        """
+        self._submit('INSERT INTO votes (chat_id, message_id, user_key, name, mask) VALUES (?, ?, ?, ?, ?) '
+                     'ON CONFLICT (chat_id, message_id, user_key) DO UPDATE SET mask = excluded.mask',
+                     (chat_id, message_id, json.dumps(user_key), name, hex(mask)))
+
+    def save_payload(self, key, endpoint, payload) -> None:
+        """
+        Queue insert or update of a fetched OpenMensa payload
+
+        :param key: Cache key tuple
+        :param endpoint: Endpoint kind
+        :param payload: Decoded JSON payload
+        """
+        self._submit('INSERT OR REPLACE INTO payloads (key, endpoint, payload, fetched_at) VALUES (?, ?, ?, ?)',
+                     (json.dumps(key), endpoint, json.dumps(payload), time.time()))
+
+    def save_subscription(self, chat_id, active=True, topic='daily') -> None:
+        """
+        Queue subscribing or unsubscribing a chat from the daily menu or from menu change notifications
+
+        :param chat_id: Chat ID
+        :param active: False to unsubscribe
+        :param topic: 'daily' or 'changes'
+        """
+        self._submit(f'INSERT OR REPLACE INTO {_SUBSCRIPTION_TABLES[topic]} (chat_id, active, updated) '
+                     f'VALUES (?, ?, ?)', (chat_id, int(active), time.time()))
+
+    def load_subscriptions(self, defaults=(), topic='daily') -> set:
+        """
+        Load subscribed chats, adding default chats that were never subscribed or unsubscribed before
+
+        :param defaults: Default chat IDs
+        :param topic: 'daily' or 'changes'
+        :return: Set of subscribed chat IDs
+        """
+        table = _SUBSCRIPTION_TABLES[topic]
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(f'INSERT OR IGNORE INTO {table} (chat_id, active, updated) '
+                                       f'VALUES (?, 1, ?)', [(chat_id, time.time()) for chat_id in defaults])
+            rows = connection.execute(f'SELECT chat_id FROM {table} WHERE active = 1').fetchall()
+        finally:
+            connection.close()
+        return {chat_id for chat_id, in rows}
+
+    def save_chat_canteen(self, chat_id, canteen_id) -> None:
+        """
+        Queue saving the canteen picked by a chat
+
+        :param chat_id: Chat ID
+        :param canteen_id: Canteen ID
+        """
+        self._submit('INSERT OR REPLACE INTO chat_canteens (chat_id, canteen_id) VALUES (?, ?)',
+                     (chat_id, canteen_id))
+
+    def load_chat_canteens(self) -> dict:
+        """
+        Load the canteens picked by chats
+
+        :return: Dict of chat ID -> canteen ID
+        """
+        connection = self._connect()
+        try:
+            return dict(connection.execute('SELECT chat_id, canteen_id FROM chat_canteens').fetchall())
+        finally:
+            connection.close()
+
+    def load_active_polls(self) -> list:
+        """
+        Load all active polls with their votes
+
+        :return: List of (chat_id, message_id, options, show_out, created, votes) tuples,
+            votes being a list of (user_key, name, mask) tuples in insertion order
+        """
+        connection = self._connect()
+        try:
+            polls = connection.execute('SELECT chat_id, message_id, options, show_out, created FROM polls '
+                                       'WHERE active = 1').fetchall()
+            result = []
+            for chat_id, message_id, options, show_out, created in polls:
+                votes = connection.execute('SELECT user_key, name, mask FROM votes WHERE chat_id = ? AND '
+                                           'message_id = ? ORDER BY rowid', (chat_id, message_id)).fetchall()
+                result.append((chat_id, message_id, json.loads(options), bool(show_out), created,
+                               [(json.loads(user_key), name, int(mask, 16)) for user_key, name, mask in votes]))
+        finally:
+            connection.close()
+        return result
+
+    def prune(self, poll_retention=config.STATE_POLL_RETENTION) -> None:
+        """
+        Queue deletion of payloads too old to be served and of polls closed (or, if never closed, created) before
+        the retention period, with their votes
+
+        :param poll_retention: Seconds polls are kept
+        """
+        now = time.time()
+        for endpoint, max_age in _payload_max_ages().items():
+            self._submit('DELETE FROM payloads WHERE endpoint = ? AND fetched_at < ?', (endpoint, now - max_age))
+        self._submit('DELETE FROM polls WHERE COALESCE(closed, created) < ?', (now - poll_retention,))
+        self._submit('DELETE FROM votes WHERE NOT EXISTS (SELECT 1 FROM polls WHERE polls.chat_id = votes.chat_id '
+                     'AND polls.message_id = votes.message_id)', ())
+
+    def load_payloads(self) -> list:
+        """
+        Load stored OpenMensa payloads that are still fresh enough to be served
+
+        :return: List of (key, endpoint, payload, fetched_at) tuples
+        """
+        now = time.time()
+        max_ages = _payload_max_ages()
+        connection = self._connect()
+        try:
+            rows = connection.execute('SELECT key, endpoint, payload, fetched_at FROM payloads WHERE ' +
+                                      ' OR '.join(['(endpoint = ? AND fetched_at >= ?)'] * len(max_ages)),
+                                      [value for endpoint, max_age in max_ages.items()
+                                       for value in (endpoint, now - max_age)]).fetchall()
+        finally:
+            connection.close()
+        return [(_to_tuple(json.loads(key)), endpoint, json.loads(payload), fetched_at)
+                for key, endpoint, payload, fetched_at in rows]
+
+
+def _payload_max_ages() -> dict:
+    return {endpoint: ttl + config.CACHE_STALE_TTL.get(endpoint, 0) for endpoint, ttl in config.CACHE_TTL.items()}
+
+
+def _to_tuple(value):
+    return tuple(_to_tuple(item) for item in value) if isinstance(value, list) else value
@@ -0,0 +1,47 @@
+import datetime
+
+from model.archive import MenuArchive
+
+
+def meal(num, line, name, price, notes=()):
+    return {'id': num, 'category': line, 'name': name, 'notes': list(notes),
+            'prices': {'students': price, 'employees': price + 1, 'pupils': None, 'others': price + 2}}
+
+
+def menu(*names):
+    return [meal(num, f'Linie {num % 2 + 1}', name, 2.5 + num) for num, name in enumerate(names)] + \
+           [meal(99, 'Salatbuffet', 'Salat', 0.9)]
+
+
+def test_append_and_scan(tmp_path):
+    archive = MenuArchive(str(tmp_path))
+    monday, tuesday = datetime.date(2025, 12, 29), datetime.date(2026, 1, 2)
+
+    assert archive.append(1, monday, menu('Pasta', 'Curry')) == 3
+    assert archive.append(1, monday, menu('Pizza')) == 0  # Archived already
+    assert archive.append(1, tuesday, menu('Pasta', 'Reis & Gemüse')) == 3
+
+    assert archive.years(1) == [2025, 2026]
+    assert archive.has_day(1, monday) and not archive.has_day(1, monday + datetime.timedelta(days=1))
+    data = archive.scan(1)
+    assert len(data['date']) == 6
+    assert [archive.strings(1)[code] for code in data['name']] == ['Pasta', 'Curry', 'Salat', 'Pasta',
+                                                                   'Reis & Gemüse', 'Salat']
+    assert list(data['students'][:2]) == [2.5, 3.5]
+
+    # Only the partition of the year in range is read
+    assert len(archive.scan(1, start=datetime.date(2026, 1, 1))['date']) == 3
+    assert archive.summary(1) == {'days': 2, 'meals': 6, 'first': monday, 'last': tuesday}
+    assert archive.top_dishes(1) == [('Pasta', 2), ('Curry', 1), ('Reis & Gemüse', 1)]
+    assert archive.line_frequency(1, []) == [('Linie 1', 0, 2), ('Linie 2', 0, 2)]
+
+
+def test_reader_sees_strings_of_other_writer(tmp_path):
+    writer, reader = MenuArchive(str(tmp_path)), MenuArchive(str(tmp_path))
+    writer.append(1, datetime.date(2025, 12, 30), menu('Pasta'))
+    assert reader.top_dishes(1) == [('Pasta', 1)]
+
+    # The writer opens a new year partition with new strings after the reader loaded the old ones
+    writer.append(1, datetime.date(2026, 1, 2), menu('Curry', 'Pizza'))
+
+    assert reader.top_dishes(1) == [('Pasta', 1), ('Curry', 1), ('Pizza', 1)]
@@ -0,0 +1,60 @@
+import threading
+import time
+
+import telegram
+
+from controller.broadcast import Broadcaster, TokenBucket
+
+
+class FloodBot:
+    """
+    Bot answering the first message with a flood wait and recording the send times of all others
+    """
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        self.sent = []
+        self._lock = threading.Lock()
+        self.flooded_at = None
+
+    def send_message(self, chat_id, **kwargs):
+        with self._lock:
+            if self.flooded_at is None:
+                self.flooded_at = time.monotonic()
+                raise telegram.error.RetryAfter(self.retry_after)
+            self.sent.append((chat_id, time.monotonic()))
+
+
+def test_pause_holds_back_tokens():
+    bucket = TokenBucket(rate=1000)
+    bucket.pause(0.2)
+    start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.19
+
+
+def test_flood_wait_pauses_all_chats():
+    bot = FloodBot(retry_after=0.3)
+    broadcaster = Broadcaster(rate=20, per_chat_interval=0, workers=4, max_retries=1)
+
+    results = broadcaster.broadcast(bot, [(chat_id, {'text': 'Menu'}) for chat_id in range(40)])
+
+    assert sorted(results['delivered']) == list(range(40))
+    # Apart from sends that took their token before the flood wait, no chat gets a message until it is over
+    waited = [sent - bot.flooded_at for _, sent in bot.sent if sent > bot.flooded_at + 0.05]
+    assert waited and min(waited) >= 0.29
+
+
+def test_timed_out_message_is_not_retried():
+    calls = []
+
+    class SlowBot:
+        def send_message(self, chat_id, **kwargs):
+            calls.append(chat_id)
+            raise telegram.error.TimedOut()
+
+    results = Broadcaster(rate=1000, per_chat_interval=0, workers=1, max_retries=3).broadcast(
+        SlowBot(), [(1, {'text': 'Menu'})])
+
+    assert results['timed_out'] == [1]
+    assert calls == [1]
@@ -0,0 +1,110 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from model import cache as cache_module
+from model.cache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Manually advanced monotonic clock of the cache module
+    """
+    now = [1000.0]
+    monkeypatch.setattr(cache_module, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+class Fetcher:
+    """
+    Fetch function returning increasing values, optionally blocking until released
+    """
+
+    def __init__(self, block=False):
+        self.calls = 0
+        self.release = threading.Event()
+        self.started = threading.Event()
+        if not block:
+            self.release.set()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        return self.calls
+
+
+def test_stale_value_is_served_while_refreshing(clock):
+    cache = TTLCache()
+    cache.set('key', 'old', ttl=10, stale_ttl=60)
+    clock[0] += 20
+    fetch = Fetcher(block=True)
+
+    assert cache.get_or_fetch('key', fetch, ttl=10, stale_ttl=60) == 'old'
+    assert fetch.started.wait(5)
+    # Further stale hits do not start a second refresh
+    assert cache.get_or_fetch('key', fetch, ttl=10, stale_ttl=60) == 'old'
+    fetch.release.set()
+
+    for _ in range(500):
+        if cache.peek('key') == 1:
+            break
+        time.sleep(0.01)
+    assert cache.get_or_fetch('key', fetch, ttl=10, stale_ttl=60) == 1
+    assert fetch.calls == 1
+    assert cache.stats()['stale_hits'] == 2
+
+
+def test_failed_refresh_keeps_stale_value(clock):
+    cache = TTLCache()
+    cache.set('key', 'old', ttl=10, stale_ttl=60)
+    clock[0] += 20
+    failed = threading.Event()
+
+    def fetch():
+        failed.set()
+        raise OSError('unavailable')
+
+    assert cache.get_or_fetch('key', fetch, ttl=10, stale_ttl=60) == 'old'
+    assert failed.wait(5)
+    assert cache.get_or_fetch('key', lambda: 'new', ttl=10, stale_ttl=60) == 'old'
+
+
+def test_value_past_grace_period_is_fetched(clock):
+    cache = TTLCache()
+    cache.set('key', 'old', ttl=10, stale_ttl=60)
+    clock[0] += 71
+
+    assert cache.get('key') is None
+    assert cache.get_or_fetch('key', lambda: 'new', ttl=10, stale_ttl=60) == 'new'
+
+
+def test_concurrent_misses_fetch_once(clock):
+    cache = TTLCache()
+    fetch = Fetcher(block=True)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_fetch('key', fetch, ttl=10)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    assert fetch.started.wait(5)
+    fetch.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == [1] * 8
+    assert fetch.calls == 1
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(max_size=2)
+    cache.set('a', 1, ttl=10)
+    cache.set('b', 2, ttl=10)
+    cache.get('a')
+    cache.set('c', 3, ttl=10)
+
+    assert cache.peek('b') is None and cache.peek('a') == 1 and cache.peek('c') == 3
+    assert cache.stats()['evictions'] == 1
@@ -0,0 +1,68 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from model.client import OpenMensaClient, OpenMensaRequestError, OpenMensaUnavailable
+
+
+@pytest.fixture
+def server():
+    """
+    Local API answering /ok with a payload, /missing with 404 and /broken with 500
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, body = {'/ok': (200, b'[1, 2]'), '/missing': (404, b'{}')}.get(self.path, (500, b''))
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    http_server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{http_server.server_address[1]}/'
+    http_server.shutdown()
+    http_server.server_close()
+
+
+def make_client(base_url) -> OpenMensaClient:
+    client = OpenMensaClient(base_url, retries=0)
+    client.breaker.failure_threshold = 3
+    return client
+
+
+def test_client_errors_leave_breaker_closed(server):
+    client = make_client(server)
+    for _ in range(10):
+        with pytest.raises(OpenMensaRequestError):
+            client.get_json('meals', 'missing')
+    assert client.breaker.state == 'closed'
+    assert client.get_json('meals', 'ok') == [1, 2]
+
+
+def test_client_errors_are_not_served_from_last_good_payload(server):
+    client = make_client(server)
+    client.remember('missing', None, ['stale'])
+    with pytest.raises(OpenMensaRequestError):
+        client.get_json('meals', 'missing')
+
+
+def test_server_errors_open_breaker(server):
+    client = make_client(server)
+    for _ in range(3):
+        with pytest.raises(OpenMensaUnavailable):
+            client.get_json('meals', 'broken')
+    assert client.breaker.state == 'open'
+    with pytest.raises(OpenMensaUnavailable, match='circuit open'):
+        client.get_json('meals', 'ok')
+
+
+def test_server_errors_serve_last_good_payload(server):
+    client = make_client(server)
+    assert client.get_json('meals', 'ok') == [1, 2]
+    client.base_url = f'{server}broken?'
+    assert client.get_json('meals', 'ok') == [1, 2]
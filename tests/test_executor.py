@@ -0,0 +1,72 @@
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from controller.executor import KeyedExecutor
+
+
+def test_tasks_of_a_key_run_in_order_one_at_a_time():
+    executor = KeyedExecutor(max_workers=8, max_pending=1000)
+    rng = random.Random(0)
+    order = {key: [] for key in range(4)}
+    running = {key: 0 for key in range(4)}
+    overlaps = []
+    lock = threading.Lock()
+
+    def task(key, num, delay):
+        with lock:
+            running[key] += 1
+            overlaps.append(running[key] > 1)
+        time.sleep(delay)
+        with lock:
+            running[key] -= 1
+            order[key].append(num)
+
+    for num in range(200):
+        key = rng.randrange(4)
+        executor.submit(key, task, key, num, rng.random() / 1000)
+    executor.shutdown()
+
+    assert not any(overlaps)
+    assert all(nums == sorted(nums) for nums in order.values())
+    assert sum(map(len, order.values())) == 200
+
+
+def test_busy_key_does_not_block_other_keys():
+    executor = KeyedExecutor(max_workers=2, max_pending=100)
+    release, done = threading.Event(), threading.Event()
+    executor.submit('busy', release.wait, 5)
+    executor.submit('busy', lambda: None)
+    executor.submit('other', done.set)
+
+    assert done.wait(5)
+    release.set()
+    executor.shutdown()
+
+
+def test_failing_task_reports_error_and_keeps_order():
+    errors, ran = [], []
+    executor = KeyedExecutor(max_workers=2, max_pending=10, error_callback=lambda args, e: errors.append(args))
+
+    def fail(name):
+        raise ValueError(name)
+
+    executor.submit(1, fail, 'first')
+    executor.submit(1, ran.append, 'second')
+    executor.shutdown()
+
+    assert errors == [('first',)] and ran == ['second']
+    assert executor.stats()['pending'] == 0
+
+
+def test_wrap_orders_updates_by_chat():
+    executor = KeyedExecutor(max_workers=4, max_pending=100)
+    seen = []
+    handler = executor.wrap(lambda update, context: seen.append(update.update_id))
+    for update_id in range(20):
+        handler(SimpleNamespace(effective_chat=SimpleNamespace(id=1), effective_user=None, update_id=update_id),
+                None)
+    executor.shutdown()
+
+    assert seen == list(range(20))
@@ -0,0 +1,67 @@
+import datetime
+
+from model.opening import OpeningCalendar
+
+TODAY = datetime.date.today()
+
+
+def days(offset, *closed):
+    return [{'date': (TODAY + datetime.timedelta(days=offset + num)).isoformat(), 'closed': flag}
+            for num, flag in enumerate(closed)]
+
+
+def day(offset):
+    return TODAY + datetime.timedelta(days=offset)
+
+
+def test_update_merges_into_known_range():
+    calendar = OpeningCalendar()
+    assert calendar.update(days(0, False, True, False, False)) == 4
+
+    # Overlapping payload replaces days 2 and 3, adds days 4 and 5 and keeps days 0 and 1
+    assert calendar.update(days(2, True, False, False, True)) == 3
+
+    assert len(calendar) == 6
+    assert [calendar.is_open(day(num)) for num in range(7)] == [True, False, False, True, True, False, False]
+    assert calendar.covers(day(5)) and not calendar.covers(day(6))
+
+
+def test_update_drops_past_days():
+    calendar = OpeningCalendar()
+    calendar.update(days(-5, False, False, False, False, False, False))
+    calendar.update(days(1, False))
+
+    assert not calendar.covers(day(-2))
+    assert calendar.is_open(day(-1)) and calendar.is_open(day(0)) and calendar.is_open(day(1))
+
+
+def test_next_open_day_and_open_days():
+    calendar = OpeningCalendar()
+    calendar.update(days(0, True, True, False, True, False))
+
+    assert calendar.next_open_day(day(0)) == day(2)
+    assert calendar.next_open_day(day(2)) == day(2)
+    assert calendar.next_open_day(day(5)) is None
+    assert calendar.open_days(day(0), day(4)) == [day(2), day(4)]
+    assert calendar.open_days(day(3), day(3)) == []
+
+
+def test_unknown_dates_are_closed():
+    calendar = OpeningCalendar()
+    assert not calendar.is_open(TODAY)
+    assert calendar.next_open_day(TODAY) is None
+
+    calendar.update(days(0, False))
+    assert not calendar.is_open(day(1))
+
+
+def test_update_swaps_lists_together():
+    calendar = OpeningCalendar()
+    calendar.update(days(0, False, False))
+    dates, closed, open_dates = calendar._state
+
+    calendar.update(days(-1, True, True, True, True))
+
+    # A reader holding the previous state still sees matching lists
+    assert (len(dates), len(closed), len(open_dates)) == (2, 2, 2)
+    assert len(calendar._state[0]) == len(calendar._state[1]) == 4
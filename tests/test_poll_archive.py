@@ -0,0 +1,71 @@
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from controller import controller
+from model.archive import PollArchive
+from model.model import PollData
+
+DATE = datetime.date(2026, 10, 12)
+
+
+def closed_poll(options, *votes):
+    poll = PollData(options)
+    for user_id, option in votes:
+        poll.set_choice(f'User{user_id}', option, user_id=user_id)
+    return poll
+
+
+def test_append_and_statistics(tmp_path):
+    archive = PollArchive(str(tmp_path))
+    assert archive.append(1, 10, DATE, closed_poll(['12:00', '12:30'], (1, '12:00'), (2, '12:00'))) == 2
+    assert archive.append(1, 10, DATE, closed_poll(['12:00', '12:30'], (1, '12:00'))) == 0  # Archived already
+    assert archive.append(1, 11, DATE + datetime.timedelta(days=7), closed_poll(['12:30', '13:00'], (1, '13:00'))) == 1
+
+    assert archive.summary(1) == {'polls': 2, 'votes': 3, 'users': 2, 'first': DATE, 'skipped': 0}
+    assert archive.popular_slots(1) == {0: ('12:00', 2, 2)}
+    assert archive.predict_slot(1, DATE + datetime.timedelta(days=14)) == '12:00'
+
+
+def test_polls_above_label_limit_are_skipped(tmp_path):
+    archive = PollArchive(str(tmp_path))
+    archive.append(1, 1, DATE, closed_poll([f'{num:02d}:00' for num in range(63)], (1, '00:00')))
+    archive.append(1, 2, DATE, closed_poll(['00:00', '01:00'], (1, '01:00')))  # Known labels only
+
+    with pytest.raises(ValueError):
+        archive.append(1, 3, DATE, closed_poll(['00:00', '99:00'], (1, '99:00')))
+    assert archive.append(1, 3, DATE, closed_poll(['00:00', '99:00'])) == 0
+
+    assert archive.summary(1)['polls'] == 2
+    assert PollArchive(str(tmp_path)).summary(1)['skipped'] == 1
+
+
+def test_poll_stats_reports_skipped_polls(tmp_path, monkeypatch):
+    archive = PollArchive(str(tmp_path))
+    archive.append(1, 1, DATE, closed_poll([f'{num:02d}:00' for num in range(63)], (1, '00:00')))
+    with pytest.raises(ValueError):
+        archive.append(1, 2, DATE, closed_poll(['99:00'], (1, '99:00')))
+    monkeypatch.setattr(controller, 'poll_archive', archive)
+
+    sent = []
+    bot = SimpleNamespace(send_message=lambda **kwargs: sent.append(kwargs['text']))
+    controller.poll_stats(SimpleNamespace(effective_chat=SimpleNamespace(id=1)), SimpleNamespace(bot=bot))
+
+    assert '1 polls not archived, this chat used more than 64 different options.' in sent[0]
+
+
+def test_close_daily_poll_posts_results_of_skipped_poll(tmp_path, monkeypatch, caplog):
+    archive = PollArchive(str(tmp_path))
+    archive.append(1, 1, DATE, closed_poll([f'{num:02d}:00' for num in range(63)], (1, '00:00')))
+    monkeypatch.setattr(controller, 'poll_archive', archive)
+    monkeypatch.setattr(controller, 'state_store', SimpleNamespace(save_poll=lambda *args: None))
+    controller.poll_registry.register(1, 2, closed_poll(['99:00'], (1, '99:00')))
+
+    edits = []
+    bot = SimpleNamespace(edit_message_text=lambda **kwargs: edits.append(kwargs['text']))
+    controller.close_daily_poll(SimpleNamespace(bot=bot), 1, 2)
+
+    assert edits and edits[0].startswith('Final polling results:')
+    assert 'Poll 2 of chat 1 was not archived' in caplog.text
+    assert archive.summary(1)['skipped'] == 1
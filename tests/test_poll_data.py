@@ -0,0 +1,80 @@
+import random
+
+from model.model import PollData
+from utils.utils import prettify_table
+
+OPTIONS = ['11:30', '11:45', '12:00', '12:15', '12:30']
+USERS = [(num, name) for num, name in enumerate(['Alice', 'Bob', 'Carol', 'Dave', 'Eve', 'Frank'])]
+
+
+def expected_stats(votes, show_out):
+    """
+    Recompute results from the vote masks alone, like the DataFrame based poll did
+
+    :param votes: List of (user key, display name, vote mask) tuples in the order users joined
+    :param show_out: Whether the 'Out' row is shown
+    :return: List of (option, attendees, total, is_choice) tuples
+    """
+    columns = OPTIONS + ['Out'] if show_out else OPTIONS
+    attendees = [[name for _, name, mask in votes if mask >> bit & 1] for bit in range(len(columns))]
+    max_votes = max(len(names) for names in attendees)
+    return [(option, ', '.join(names), len(names), option != 'Out' and max_votes != 0 and len(names) == max_votes)
+            for option, names in zip(columns, attendees)]
+
+
+def expected_results(stats):
+    n_choices = sum(is_choice for *_, is_choice in stats)
+    mark = ' ✔' if n_choices == 1 else ' ❎'
+    return prettify_table([[f'{option} ({total}):', attendees + mark if is_choice else attendees]
+                           for option, attendees, total, is_choice in stats], tablefmt='simple')
+
+
+def expected_final_choice(stats):
+    choices = [[option, attendees] for option, attendees, _, is_choice in stats if is_choice]
+    if len(choices) == 1:
+        return f'Chosen time: {choices[0][0]}\nAttendees: {choices[0][1]}'
+    if choices:
+        return f'Options:\n\n{prettify_table(choices, tablefmt="simple")}'
+    return None
+
+
+def test_incremental_results_match_recomputation():
+    rng = random.Random(0)
+    poll = PollData(OPTIONS)
+    for _ in range(300):
+        user_id, name = rng.choice(USERS)
+        action = rng.random()
+        if action < 0.6:
+            poll.set_choice(name, rng.choice(OPTIONS), user_id=user_id)
+        elif action < 0.7:
+            poll.decline_user(name, user_id=user_id)
+        elif action < 0.8:
+            poll.checkall_user(name, user_id=user_id)
+        else:
+            poll.delete_user(name, times_only=rng.random() < 0.5, user_id=user_id)
+
+        stats = expected_stats(poll.get_votes(), poll.show_out)
+        assert poll.get_results() == expected_results(stats)
+        assert poll.get_final_choice() == expected_final_choice(stats)
+
+
+def test_results_before_any_vote():
+    poll = PollData(OPTIONS)
+    poll.delete_user('Alice', user_id=1)
+
+    assert poll.get_results() == expected_results(expected_stats(poll.get_votes(), False))
+    assert poll.get_final_choice() is None
+
+
+def test_restored_poll_renders_like_original():
+    poll = PollData(OPTIONS)
+    poll.set_choice('Alice', '12:00', user_id=1)
+    poll.set_choice('Bob', '12:00', user_id=2)
+    poll.set_choice('Bob', '12:15', user_id=2)
+    poll.decline_user('Carol', user_id=3)
+
+    restored = PollData(OPTIONS)
+    restored.restore(poll.get_votes(), poll.show_out)
+
+    assert restored.get_results() == poll.get_results()
+    assert restored.get_final_choice() == poll.get_final_choice() == 'Chosen time: 12:00\nAttendees: Alice, Bob'
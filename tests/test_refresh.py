@@ -0,0 +1,68 @@
+import copy
+import datetime
+
+import pytest
+
+from model.cache import TTLCache
+from model.meals import diff_lines
+from model.model import Mensa
+
+DATE = datetime.date(2026, 10, 12)
+
+
+def meal(num, line, name):
+    return {'id': num, 'category': line, 'name': name, 'notes': [],
+            'prices': {'students': 3.0, 'employees': 4.0, 'pupils': None, 'others': 5.0}}
+
+
+class StubClient:
+    """
+    OpenMensa client answering from a dict of path -> payload, returning the stored object itself like a
+    conditional request for unchanged content does
+    """
+
+    def __init__(self, payloads):
+        self.payloads = payloads
+
+    def get_json(self, endpoint, path, params=None):
+        return self.payloads[path]
+
+
+class RecordingStore:
+    def __init__(self):
+        self.saved = []
+
+    def save_payload(self, key, endpoint, payload):
+        self.saved.append((key, payload))
+
+
+@pytest.fixture
+def mensa(monkeypatch):
+    payloads = {'canteens/1': {'name': 'Test Mensa'},
+                f'canteens/1/days/{DATE}/meals': [meal(1, 'Linie 1', 'Pasta'), meal(2, 'Linie 2', 'Curry')]}
+    monkeypatch.setattr(Mensa, 'client', StubClient(payloads))
+    monkeypatch.setattr(Mensa, 'cache', TTLCache())
+    monkeypatch.setattr(Mensa, 'store', RecordingStore())
+    return Mensa(1)
+
+
+def test_refresh_detects_changes(mensa):
+    payloads = mensa.client.payloads
+    path = f'canteens/1/days/{DATE}/meals'
+    first = payloads[path]
+
+    assert mensa.refresh_menu(DATE) == (None, first)
+    # Unchanged: the same object, or an equal payload decoded anew
+    assert mensa.refresh_menu(DATE) is None
+    payloads[path] = copy.deepcopy(first)
+    assert mensa.refresh_menu(DATE) is None
+    assert [key[0] for key, _ in mensa.store.saved] == ['canteen', 'meals']
+
+    payloads[path] = [meal(1, 'Linie 1', 'Pasta'), meal(3, 'Linie 2', 'Pizza')]
+    previous, current = mensa.refresh_menu(DATE)
+
+    assert previous == first and current is payloads[path]
+    assert mensa.get_menu(DATE) is current
+    assert mensa.store.saved[-1][1] is current
+    assert [(line, [m.name for m in before], [m.name for m in after])
+            for line, before, after in diff_lines(previous, current)] == [('Linie 2', ['Curry'], ['Pizza'])]
@@ -0,0 +1,73 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from model import registry as registry_module
+from model.model import PollData
+from model.registry import PollRegistry
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Manually advanced wall clock of the registry module
+    """
+    now = [1000.0]
+    monkeypatch.setattr(registry_module, 'time', SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def test_register_deactivates_previous_poll(clock):
+    registry = PollRegistry()
+    first, second = PollData(['12:00']), PollData(['12:00'])
+    registry.register(1, 10, first)
+    registry.register(1, 11, second)
+
+    assert not first.active
+    assert registry.get_active(1) == (11, second)
+    assert registry.close(1, 10) is None
+    assert registry.close(1, 11) is second
+    assert registry.get_active(1) is None
+
+
+def test_evict_removes_closed_and_stale_polls(clock):
+    registry = PollRegistry()
+    registry.register(1, 10, PollData(['12:00']))
+    registry.close(1, 10)
+    registry.register(2, 20, PollData(['12:00']))
+    clock[0] += 50
+    registry.register(3, 30, PollData(['12:00']))
+    registry.close(3, 30)
+
+    # Closed polls go after closed_after, others only after stale_after
+    assert registry.evict(closed_after=40, stale_after=100) == 1
+    assert registry.get(1, 10) is None and registry.get(2, 20) is not None and len(registry) == 2
+
+    clock[0] += 60
+    assert registry.evict(closed_after=40, stale_after=100) == 2
+    assert registry.get_active(2) is None
+    assert len(registry) == 0
+
+
+def test_evict_keeps_lock_of_chat_in_use(clock):
+    registry = PollRegistry()
+    registry.register(1, 10, PollData(['12:00']))
+    lock = registry.lock(1)
+    clock[0] += 200
+
+    # A handler thread holding the chat's lock keeps it, so later callers still get the same lock
+    held, done = threading.Event(), threading.Event()
+    thread = threading.Thread(target=lambda: (lock.acquire(), held.set(), done.wait(5), lock.release()))
+    thread.start()
+    assert held.wait(5)
+    assert registry.evict(closed_after=40, stale_after=100) == 1
+    assert registry.lock(1) is lock
+    done.set()
+    thread.join(5)
+
+    registry.register(2, 20, PollData(['12:00']))
+    lock = registry.lock(2)
+    clock[0] += 200
+    registry.evict(closed_after=40, stale_after=100)
+    assert registry.lock(2) is not lock
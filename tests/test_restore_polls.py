@@ -0,0 +1,45 @@
+import datetime
+
+import pytest
+
+from controller import controller
+from controller.controller import POLL_CLOSE_TIME, restore_polls, restored_poll_close_time
+from model.model import PollData
+from model.store import StateStore
+
+TZ = POLL_CLOSE_TIME.tzinfo
+
+
+def at(hour, minute=0, day=1):
+    return TZ.localize(datetime.datetime(2026, 6, day, hour, minute))
+
+
+@pytest.mark.parametrize('created, now, expected', [
+    (at(9), at(10), POLL_CLOSE_TIME),  # Restart before the close time of the day the poll was created
+    (at(9), at(12), 0),  # Restart after the close time: close right away instead of tomorrow
+    (at(9), at(10, day=2), 0),  # Poll from a previous day
+    (at(11, 30), at(12), 0),  # Created after the close time
+])
+def test_restored_poll_close_time(created, now, expected):
+    assert restored_poll_close_time(created.timestamp(), now=now) == expected
+
+
+class RecordingJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, context=None):
+        self.jobs.append((callback, when, context))
+
+
+def test_restore_polls_closes_polls_of_previous_days(tmp_path, monkeypatch):
+    store = StateStore(str(tmp_path / 'state.sqlite3'))
+    monkeypatch.setattr(controller, 'state_store', store)
+    yesterday = datetime.datetime.now(TZ) - datetime.timedelta(days=1)
+    store.save_poll(-1, 10, PollData(['11:30', '12:00']), created=yesterday.timestamp())
+    store.flush()
+
+    job_queue = RecordingJobQueue()
+    assert restore_polls(job_queue) == 1
+    assert job_queue.jobs == [(controller.callback_close_poll, 0, (-1, 10))]
+    store.close()
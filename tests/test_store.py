@@ -0,0 +1,65 @@
+import json
+import time
+
+import config
+from model.model import PollData
+from model.store import StateStore
+
+
+def test_prune_deletes_old_payloads_and_polls(tmp_path):
+    store = StateStore(str(tmp_path / 'state.sqlite3'))
+    now = time.time()
+    store.save_payload(('meals', 'fresh', ()), 'meals', [1])
+    store.save_poll(1, 1, PollData(['a', 'b']), created=now)
+    store.save_vote(1, 1, 7, 'Alice', 1)
+    store.save_poll(1, 2, PollData(['a', 'b']), created=now - config.STATE_POLL_RETENTION - 60)
+    store.save_vote(1, 2, 7, 'Alice', 2)
+    store.flush()
+    connection = store._connect()
+    with connection:
+        connection.execute("INSERT INTO payloads VALUES ('old', 'meals', '[2]', ?)", (now - 7 * 24 * 60 * 60,))
+
+    store.prune()
+    store.flush()
+
+    assert connection.execute('SELECT endpoint, payload FROM payloads').fetchall() == [('meals', '[1]')]
+    assert connection.execute('SELECT message_id FROM polls').fetchall() == [(1,)]
+    assert connection.execute('SELECT message_id FROM votes').fetchall() == [(1,)]
+    connection.close()
+    store.close()
+
+
+def test_load_payloads_skips_stale_rows(tmp_path):
+    store = StateStore(str(tmp_path / 'state.sqlite3'))
+    store.save_payload(('meals', 'fresh', ()), 'meals', [1])
+    store.flush()
+    connection = store._connect()
+    with connection:
+        connection.execute("INSERT INTO payloads VALUES (?, 'meals', '[2]', ?)",
+                           (json.dumps(['meals', 'old', []]), time.time() - 7 * 24 * 60 * 60))
+    connection.close()
+
+    assert [payload for _, _, payload, _ in store.load_payloads()] == [[1]]
+    store.close()
+
+
+def test_wide_vote_masks_round_trip(tmp_path):
+    store = StateStore(str(tmp_path / 'state.sqlite3'))
+    store.save_poll(1, 1, PollData([f'option {num}' for num in range(63)]))
+    store.save_vote(1, 1, 7, 'Alice', 1 << 63)
+    store.save_vote(1, 1, 8, 'Bob', (1 << 64) - 1)
+    store.flush()
+
+    (poll,) = store.load_active_polls()
+    assert poll[-1] == [(7, 'Alice', 1 << 63), (8, 'Bob', (1 << 64) - 1)]
+    store.close()
+
+
+def test_failing_write_does_not_stop_writer(tmp_path):
+    store = StateStore(str(tmp_path / 'state.sqlite3'))
+    store._submit('INSERT INTO chat_canteens (chat_id, canteen_id) VALUES (?, ?)', (1, 1 << 64))
+    store.save_chat_canteen(2, 31)
+    store.flush()
+
+    assert store.load_chat_canteens() == {2: 31}
+    store.close()
@@ -0,0 +1,42 @@
+import random
+
+import pytest
+
+from utils.table import SimpleTable
+from utils.utils import prettify_table
+
+TABLES = [
+    [['11:40 Uhr (2):', 'Alice, Bob ✔'], ['12:10 Uhr (0):', ''], ['Out (1):', 'Carol']],
+    [['12:10 Uhr (1):', 'Zoë ❎'], ['12:40 Uhr (1):', '李雷 ❎']],
+    [[' padded ', 'cell  '], ['x', ' ']],
+    [['a', 'b'], ['c']],
+    [['Price', 2.5], ['Total', 12]],
+    [['1', 'text'], ['2.50', 'more']],
+    [['inf', 'nan'], ['-inf', '1e3']],
+    [['True', 'x'], ['False', 'yes']],
+    [['None', None], ['x', 'y']],
+    [['multi\nline', 'x'], ['y', 'z']],
+    [['\x1b[31mred\x1b[0m', 'x'], ['y', 'z']],
+    [['bell\x07', 'x']],
+    [],
+]
+
+
+@pytest.mark.parametrize('rows', TABLES)
+def test_render_matches_prettify_table(rows):
+    assert SimpleTable().render(rows) == (prettify_table(rows, tablefmt='simple') if rows else '')
+
+
+def test_incremental_render_matches_prettify_table():
+    rng = random.Random(0)
+    names = ['Al', 'Bernadette', 'Zoë', '李雷', 'Ümit', '12', '3.5']
+    table = SimpleTable()
+    rows = [[f'{num:02d}:00 ({0}):', ''] for num in range(6)]
+    for _ in range(200):
+        index = rng.randrange(len(rows))
+        attendees = ', '.join(rng.sample(names, rng.randrange(4)))
+        rows[index] = [rows[index][0], attendees + rng.choice(['', ' ✔', ' ❎'])]
+        if rng.random() < 0.05:
+            rows = rows[:-1] if len(rows) > 2 else rows + [['Out (0):', '']]
+
+        assert table.render(rows) == prettify_table(rows, tablefmt='simple')
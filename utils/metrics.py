@@ -0,0 +1,248 @@
+import bisect
+import logging
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f'{{{pairs}}}'
+
+
+class Counter:
+    """
+    Monotonic counter with optional labels
+    """
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self) -> list:
+        with self._lock:
+            return [(self.name, _format_labels(self.labels, key), value) for key, value in self._values.items()]
+
+
+class Gauge:
+    """
+    Gauge whose values are read from a callback at scrape time
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, callback, labels=()):
+        """
+        :param callback: Callable returning a number, or a dict of label values tuple -> number if labels are given
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.callback = callback
+
+    def samples(self) -> list:
+        value = self.callback()
+        if not self.labels:
+            return [(self.name, '', value)]
+        return [(self.name, _format_labels(self.labels, key), number) for key, number in value.items()]
+
+
+class Histogram:
+    """
+    Histogram with cumulative buckets and optional labels
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.setdefault(label_values, [0] * (len(self.buckets) + 2))
+            if index < len(self.buckets):
+                counts[index] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def time(self, *label_values):
+        """
+        Get context manager observing the duration of its block
+        """
+        return _Timer(self, label_values)
+
+    def samples(self) -> list:
+        samples = []
+        with self._lock:
+            for key, counts in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append((f'{self.name}_bucket', _format_labels(self.labels + ('le',), key + (bound,)),
+                                    cumulative))
+                samples.append((f'{self.name}_bucket', _format_labels(self.labels + ('le',), key + ('+Inf',)),
+                                counts[-2]))
+                samples.append((f'{self.name}_count', _format_labels(self.labels, key), counts[-2]))
+                samples.append((f'{self.name}_sum', _format_labels(self.labels, key), counts[-1]))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics rendered in the Prometheus text exposition format
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labels=()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, callback, labels=()) -> Gauge:
+        return self._register(Gauge(name, documentation, callback, labels))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception:
+                logger.exception(f'Collecting metric {metric.name} failed')
+                continue
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(f'{name}{labels} {float(value)!r}' for name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+handler_latency = registry.histogram('mensabot_handler_seconds', 'Handler latency in seconds', labels=('handler',))
+handler_errors = registry.counter('mensabot_handler_errors_total', 'Exceptions raised by handlers',
+                                  labels=('handler',))
+openmensa_latency = registry.histogram('mensabot_openmensa_request_seconds', 'OpenMensa request latency in seconds',
+                                       labels=('endpoint',))
+openmensa_errors = registry.counter('mensabot_openmensa_errors_total', 'Failed OpenMensa requests',
+                                    labels=('endpoint',))
+job_lag = registry.histogram('mensabot_job_lag_seconds', 'Delay between scheduled and actual job start in seconds',
+                             labels=('job',), buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0))
+telegram_errors = registry.counter('mensabot_telegram_errors_total', 'Errors returned by the Telegram Bot API',
+                                   labels=('error',))
+
+
+def timed(handler_name):
+    """
+    Decorator observing the latency of a handler and counting its exceptions
+
+    :param handler_name: Handler label
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                handler_errors.inc(handler_name)
+                raise
+            finally:
+                handler_latency.observe(time.perf_counter() - start, handler_name)
+
+        return wrapper
+
+    return decorator
+
+
+class MetricsServer:
+    """
+    Local HTTP endpoint serving the registry at /metrics
+    """
+
+    def __init__(self, host, port, metrics_registry=registry):
+        self.metrics_registry = metrics_registry
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    def _handler_class(self):
+        metrics_registry = self.metrics_registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics_registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> 'MetricsServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='MetricsServer', daemon=True)
+        self._thread.start()
+        logger.info(f'Serving metrics on http://{self._server.server_address[0]}:{self._server.server_address[1]}'
+                    f'/metrics')
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
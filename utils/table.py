@@ -0,0 +1,92 @@
+import tabulate as tabulate_module
+from tabulate import tabulate
+
+try:
+    from wcwidth import wcswidth  # tabulate measures wide characters with wcwidth if it is installed
+except ImportError:
+    wcswidth = None
+
+_SPECIAL = ('\n', '\r', '\x1b')  # Multiline cells and ANSI codes are laid out differently by tabulate
+_OPTIONS = {'floatfmt': '.2f', 'numalign': 'decimal', 'stralign': 'left'}  # Same as prettify_table
+
+
+def _is_text(cell) -> bool:
+    # Strings float() cannot parse are text to tabulate, everything else may be inferred as another type
+    if not isinstance(cell, str):
+        return False
+    try:
+        float(cell)
+    except ValueError:
+        return True
+    return False
+
+
+class SimpleTable:
+    """
+    Renders rows exactly like prettify_table(rows, tablefmt='simple'), for tables of text whose rows
+    change one at a time: cells are stripped, measured and padded once per change, and a row's line is only
+    rebuilt when the row or a column width changed.
+    Tables with cells tabulate might infer another type than text for (anything but strings, strings that parse
+    as numbers) or lays out differently (multiline cells, ANSI codes, unprintable characters) are passed on to
+    tabulate.
+    """
+
+    def __init__(self):
+        self._rows = []  # Rows as last rendered
+        self._cells = []  # Stripped cells per row
+        self._widths = []  # Cell widths per row
+        self._special = []  # Per row, whether a cell needs tabulate
+        self._lines = []  # Rendered line per row
+        self._column_widths = None
+        self._rule = ''
+
+    def _update_row(self, index, row, width) -> None:
+        cells = ['{0}'.format(cell) for cell in row]
+        stripped = [cell.strip() for cell in cells]
+        widths = [width(cell) for cell in stripped]
+        entry = (list(row), stripped, widths,
+                 any(not _is_text(cell) for cell in row) or any(char in cell for cell in cells for char in _SPECIAL)
+                 or min(widths, default=0) < 0)
+        if index == len(self._rows):
+            for values, value in zip((self._rows, self._cells, self._widths, self._special), entry):
+                values.append(value)
+            self._lines.append(None)
+        else:
+            self._rows[index], self._cells[index], self._widths[index], self._special[index] = entry
+            self._lines[index] = None
+
+    def render(self, rows) -> str:
+        """
+        Render rows
+
+        :param rows: List of rows, each a list of cells
+        :return: Table text
+        """
+        if not rows:
+            return ''
+        width = wcswidth if wcswidth is not None and tabulate_module.WIDE_CHARS_MODE else len
+
+        del self._rows[len(rows):], self._cells[len(rows):], self._widths[len(rows):], \
+            self._special[len(rows):], self._lines[len(rows):]
+        for index, row in enumerate(rows):
+            if index == len(self._rows) or self._rows[index] != row:
+                self._update_row(index, row, width)
+
+        n_columns = len(rows[0])
+        if any(self._special) or any(len(row) != n_columns for row in rows):
+            return tabulate(rows, tablefmt='simple', **_OPTIONS)
+
+        column_widths = [max(widths[column] for widths in self._widths) for column in range(n_columns)]
+        if column_widths != self._column_widths:
+            self._column_widths = column_widths
+            self._rule = '  '.join('-' * column_width for column_width in column_widths).rstrip()
+            self._lines = [None] * len(rows)
+
+        for index, line in enumerate(self._lines):
+            if line is None:
+                self._lines[index] = '  '.join(
+                    cell + ' ' * (column_width - cell_width)
+                    for cell, cell_width, column_width in zip(self._cells[index], self._widths[index],
+                                                              column_widths)).rstrip()
+
+        return '\n'.join([self._rule, *self._lines, self._rule])
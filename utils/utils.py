@@ -1,10 +1,17 @@
-from typing import Union
+import re
+import time
+from contextlib import contextmanager
+from typing import Optional, Union, TYPE_CHECKING
 
-import pandas as pd
 from tabulate import tabulate
 
+import config
 
-def pretty_print_table(df: pd.DataFrame, headers='keys', tablefmt='fancy_grid', show_index=True):
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def pretty_print_table(df: 'pd.DataFrame', headers='keys', tablefmt='fancy_grid', show_index=True):
     """
     Print out DataFrame in tabular format.
 
@@ -19,40 +26,82 @@ def pretty_print_table(df: pd.DataFrame, headers='keys', tablefmt='fancy_grid',
     print(tabulate(df, headers, tablefmt=tablefmt, showindex=show_index, floatfmt='.2f'))
 
 
-def prettify_table(df: pd.DataFrame, headers='keys', tablefmt='fancy_grid', show_index=False):
+def prettify_table(df: Union['pd.DataFrame', list], headers='keys', tablefmt='fancy_grid', show_index=False):
     # 'plain', 'simple', 'grid', 'pipe', 'orgtbl', 'rst', 'mediawiki', 'latex', 'latex_raw' and 'latex_booktabs
     return tabulate(df, tablefmt=tablefmt, showindex=show_index, floatfmt='.2f', numalign='decimal', stralign='left')
 
 
+class MealClassifier:
+    """
+    Assigns a symbol to meals by keyword.
+    Keywords are matched through a single compiled pattern and earlier keywords take priority. The first note
+    is checked (lower case) before the meal name. Results are memoized per meal name and first note.
+    """
+
+    def __init__(self, symbols, cache_size=4096):
+        """
+        Constructor for MealClassifier instance
+
+        :param symbols: Dict of keyword -> symbol, in order of priority
+        :param cache_size: Maximum number of memoized results
+        """
+        self.symbols = dict(symbols)
+        self.cache_size = cache_size
+        self._keywords = list(self.symbols)
+        self._priority = {keyword: num for num, keyword in enumerate(self._keywords)}
+        # Lookahead so overlapping keywords are all found, alternatives ordered by priority
+        self._pattern = re.compile('(?=(' + '|'.join(re.escape(keyword) for keyword in self._keywords) + '))') \
+            if self._keywords else None
+        self._cache = {}
+
+    def _match(self, text) -> Optional[str]:
+        best = None
+        for match in self._pattern.finditer(text):
+            priority = self._priority[match.group(1)]
+            if best is None or priority < best:
+                best = priority
+                if best == 0:
+                    break
+        return self._keywords[best] if best is not None else None
+
+    def classify(self, meal_name: str, note_list: list) -> str:
+        """
+        Get symbol of meal
+
+        :param meal_name: Meal name
+        :param note_list: List of notes
+        :return: Symbol or empty string
+        """
+        key = (meal_name, note_list[0] if len(note_list) > 0 else '')
+        symbol = self._cache.get(key)
+        if symbol is None:
+            if self._pattern is None:
+                return ''
+            keyword = self._match(key[1].lower()) or self._match(meal_name)
+            symbol = self.symbols[keyword] if keyword is not None else ''
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[key] = symbol
+        return symbol
+
+    def classify_many(self, meals) -> list:
+        """
+        Get symbols of several meals
+
+        :param meals: Iterable of (meal name, note list) tuples
+        :return: List of symbols
+        """
+        return [self.classify(meal_name, note_list) for meal_name, note_list in meals]
+
+
+SYMBOLS = {'vegan': u'🍃', 'vegetarisch': u'🥕', 'fleisch': u'🥩', 'steak': u'🥩', 'wurst': u'🥩',
+           'hnchen': u'🐔', 'schwein': u'🐖', 'rinder': u'🐄'}
+
+meal_classifier = MealClassifier({**SYMBOLS, **config.EXTRA_MEAL_SYMBOLS})
+
+
 def get_symbol(meal_name: str, note_list: list) -> str:
-    symbol_dict = {'vegan': u'🍃', 'vegetarisch': u'🥕', 'fleisch': u'🥩', 'steak': u'🥩', 'wurst': u'🥩',
-                   'hnchen': u'🐔', 'schwein': u'🐖', 'rinder': u'🐄'}
-
-    if len(note_list) == 0:
-        note_string = ''
-    else:
-        note_string = note_list[0].lower()
-
-    key = None
-
-    for key in symbol_dict.keys():
-        if key in note_string:
-            print(f'Key {key} in note_string.')
-            symbol = symbol_dict.get(key)
-            print(symbol)
-            return symbol
-    else:
-        print(f'{key} not found in first')
-        for key in symbol_dict.keys():
-            if key in meal_name:
-                print(f'Key {key} in meal_name.')
-                symbol = symbol_dict.get(key)
-                print(symbol)
-                return symbol
-        else:
-            symbol = ''
-            print(f'{key} not found in second')
-            return symbol
+    return meal_classifier.classify(meal_name, note_list)
 
 
 def is_int(s):
@@ -61,3 +110,38 @@ def is_int(s):
         return True
     except ValueError:
         return False
+
+
+class PhaseTimer:
+    """
+    Records the duration of consecutive startup phases
+    """
+
+    def __init__(self):
+        self.phases = []
+        self._last = time.perf_counter()
+        self._start = self._last
+
+    def mark(self, name) -> float:
+        """
+        Record the time passed since the previous mark as phase
+
+        :param name: Phase name
+        :return: Duration of phase in seconds
+        """
+        now = time.perf_counter()
+        duration = now - self._last
+        self.phases.append((name, duration))
+        self._last = now
+        return duration
+
+    @contextmanager
+    def phase(self, name):
+        self._last = time.perf_counter()
+        yield
+        self.mark(name)
+
+    def report(self) -> str:
+        lines = [f'{name:<24}{1000 * duration:10.1f} ms' for name, duration in self.phases]
+        lines.append(f'{"total":<24}{1000 * (time.perf_counter() - self._start):10.1f} ms')
+        return '\n'.join(lines)
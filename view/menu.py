@@ -0,0 +1,72 @@
+import logging
+
+from emoji import emojize
+
+import config
+from model.cache import TTLCache
+from model.meals import payload_hash
+
+logger = logging.getLogger(__name__)
+
+render_cache = TTLCache(max_size=config.RENDER_CACHE_MAX_SIZE)  # (canteen, date, view) -> (payload hash, text)
+
+
+def render_menu(mensa, offset, date, l6=False) -> str:
+    """
+    Get HTML menu message for date, rendered once per (canteen, date, view) and meal payload
+
+    :param mensa: Mensa instance
+    :param offset: Day offset relative to today
+    :param date: Date of the menu
+    :param l6: Render L6 view instead of regular lines
+    :return: HTML message text
+    """
+    key = (mensa.id, date, 'l6' if l6 else 'regular')
+    content_hash = payload_hash(mensa.get_daily_menu(offset=offset))
+
+    cached = render_cache.get(key)
+    if cached is not None and cached[0] == content_hash:
+        return cached[1]
+
+    text = _render_menu(mensa, offset, date, l6)
+    render_cache.set(key, (content_hash, text), ttl=config.RENDER_CACHE_TTL)
+
+    return text
+
+
+def render_menu_changes(mensa, date, changes) -> str:
+    """
+    Get HTML message announcing changed lines
+
+    :param mensa: Mensa instance
+    :param date: Date of the menu
+    :param changes: List of (line, previous list of Meal, current list of Meal) tuples
+    :return: HTML message text
+    """
+    text = f'<b>{mensa.mensa_name}</b>: menu update for {date.strftime("%A, %B %d")}'
+    for line, previous, current in changes:
+        text += f'\n\n<b>{line}</b>:\n' + ('\n'.join(f'▫ {meal.name} {meal.symbol}' for meal in current) or '▫ -')
+        if previous:
+            text += f'\n<i>was: {", ".join(meal.name for meal in previous)}</i>'
+    return text
+
+
+def _render_menu(mensa, offset, date, l6=False) -> str:
+    text = ''
+
+    if not l6:
+        text = f'<b>{mensa.get_info().get("name")}</b> {emojize(":fork_and_knife:", use_aliases=True)}\n' \
+               f'<b>Menu for {date.strftime("%A, %B %d, %Y")}</b>\n'
+        whitelist = ['Linie']
+
+    else:
+        logger.debug('Rendering L6 menu')
+        whitelist = ['L6 Update']
+
+    for line, meals in mensa.meal_data_lines(offset=offset):
+        if any(e in line for e in whitelist):
+            text += f'\n\n<b>{line}</b>:\n' + '\n'.join(f'▫ {meal.name} {meal.symbol}' for meal in meals)  # TODO: Add number emojis to lines
+
+    text += f'\n\n<a href="https://openmensa.org/c/{mensa.id}/{date}">Full menu</a>'
+
+    return text